@@ -0,0 +1,172 @@
+"""
+abuse.py - Detector de abuso incremental, evaluado al registrar cada log
+
+Reglas por licencia sobre una ventana deslizante de ABUSE_WINDOW_HOURS:
+
+  • DEVICES   más de ABUSE_MAX_DEVICES dispositivos distintos   → HIGH
+  • FAILURES  más de ABUSE_MAX_FAILURES intentos fallidos        → MEDIUM
+  • IPS       más de ABUSE_MAX_IPS IPs distintas                 → LOW
+
+Cada regla solo se evalúa cuando el log puede cambiar su resultado (un fallo,
+un dispositivo nuevo o una IP nueva). Al validar solo se anota qué reglas
+revisar de qué licencia; write_behind.py las evalúa cada pocos segundos con
+una consulta agrupada por regla para todas las licencias anotadas. Un log
+correcto desde un dispositivo e IP ya conocidos no cuesta nada. Las marcas
+se guardan en SuspiciousFlag (una por licencia y regla, con primera y última
+detección), así que la pestaña de actividad sospechosa es una lectura
+indexada.
+
+Con ABUSE_AUTO_REVOKE=HIGH (o MEDIUM / LOW) las licencias marcadas con esa
+severidad o mayor se revocan en ese volcado y el bot recibe el evento REVOKED.
+"""
+
+from datetime import datetime, timedelta
+from sqlalchemy import func, distinct
+from config import Config
+from models import db, License, ActivityLog, DeviceHistory, SuspiciousFlag
+from database import dialect_insert
+from events import publish
+import metrics
+import write_behind
+
+SEVERITY_RANK = {"LOW": 1, "MEDIUM": 2, "HIGH": 3}
+
+RULES = {
+    "DEVICES":  {"severity": "HIGH",   "reason": "{n} dispositivos diferentes en {h}h"},
+    "FAILURES": {"severity": "MEDIUM", "reason": "{n} intentos fallidos en {h}h"},
+    "IPS":      {"severity": "LOW",    "reason": "{n} IPs diferentes en {h}h"},
+}
+
+
+def _limits():
+    return {
+        "DEVICES":  Config.ABUSE_MAX_DEVICES,
+        "FAILURES": Config.ABUSE_MAX_FAILURES,
+        "IPS":      Config.ABUSE_MAX_IPS,
+    }
+
+
+def _window_start(now):
+    return now - timedelta(hours=Config.ABUSE_WINDOW_HOURS)
+
+
+# ── Medidas ─────────────────────────────────────────────────────
+
+def _measure(rule, since):
+    """(modelo, expresión agregada, condiciones) de una regla en la ventana"""
+    if rule == "DEVICES":
+        return DeviceHistory, func.count(DeviceHistory.id), [DeviceHistory.last_seen > since]
+    if rule == "FAILURES":
+        return ActivityLog, func.count(ActivityLog.id), \
+            [ActivityLog.timestamp > since, ActivityLog.status != "SUCCESS"]
+    return ActivityLog, func.count(distinct(ActivityLog.ip_address)), \
+        [ActivityLog.timestamp > since, ActivityLog.ip_address != ""]
+
+
+# ── Marcas ──────────────────────────────────────────────────────
+
+def _flag(license_id, rule, value, now):
+    """Crea o actualiza la marca (license_id, rule); conserva first_seen"""
+    spec = RULES[rule]
+    reason = spec["reason"].format(n=value, h=Config.ABUSE_WINDOW_HOURS)
+    table = SuspiciousFlag.__table__
+    stmt = dialect_insert(table).values(license_id=license_id, rule=rule,
+                                        severity=spec["severity"], value=value,
+                                        reason=reason, first_seen=now, last_seen=now)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=["license_id", "rule"],
+        set_={"severity": stmt.excluded.severity, "value": stmt.excluded.value,
+              "reason": stmt.excluded.reason, "last_seen": stmt.excluded.last_seen},
+    ))
+    metrics.incr(f"abuse_flags_{rule.lower()}")
+
+
+def _auto_revoke(license_id, rule):
+    threshold = SEVERITY_RANK.get(Config.ABUSE_AUTO_REVOKE)
+    if not threshold or SEVERITY_RANK[RULES[rule]["severity"]] < threshold:
+        return
+    lic = db.session.get(License, license_id)
+    if lic is None or lic.revoked:
+        return
+    # Igual que /api/admin/revoke: se libera el dispositivo vinculado
+    lic.revoked = True
+    lic.hw_id = ""
+    lic.device_info = ""
+    publish(lic.key, "REVOKED", f"abuse:{rule}")
+    metrics.incr("abuse_auto_revoked")
+
+
+def observe(lic, status, new_device, new_ip):
+    """Anota las reglas que el log recién añadido puede disparar"""
+    if not lic.id:
+        return
+    rules = set()
+    if new_device:
+        rules.add("DEVICES")
+    if status != "SUCCESS":
+        rules.add("FAILURES")
+    if new_ip:
+        rules.add("IPS")
+    if rules:
+        _pending.add(lic.id, rules)
+
+
+def _evaluate(items):
+    """Evalúa las reglas anotadas: {license_id: {regla}}, una consulta por regla"""
+    now = datetime.utcnow()
+    since = _window_start(now)
+    limits = _limits()
+    for rule in RULES:
+        ids = [license_id for license_id, rules in items.items() if rule in rules]
+        if not ids:
+            continue
+        model, measure, conditions = _measure(rule, since)
+        # El join descarta las licencias borradas antes del volcado
+        rows = db.session.query(model.license_id, measure)\
+                         .join(License, License.id == model.license_id)\
+                         .filter(model.license_id.in_(ids), *conditions)\
+                         .group_by(model.license_id)\
+                         .having(measure > limits[rule]).all()
+        for license_id, value in rows:
+            _flag(license_id, rule, value, now)
+            _auto_revoke(license_id, rule)
+
+
+_pending = write_behind.register("abuse", lambda current, new: current | new, _evaluate)
+
+
+# ── Lectura y re-escaneo ────────────────────────────────────────
+
+def recent_flags(days=None, limit=500):
+    """Marcas detectadas en los últimos días, de más a menos grave"""
+    since = datetime.utcnow() - timedelta(days=days or Config.ABUSE_FLAG_RETENTION_DAYS)
+    rank = db.case(SEVERITY_RANK, value=SuspiciousFlag.severity, else_=0)
+    return db.session.query(SuspiciousFlag, License.key, License.user, License.revoked)\
+                     .join(License, License.id == SuspiciousFlag.license_id)\
+                     .filter(SuspiciousFlag.last_seen > since)\
+                     .order_by(rank.desc(), SuspiciousFlag.last_seen.desc())\
+                     .limit(limit).all()
+
+
+def rescan(clear=False):
+    """Recalcula las marcas de la ventana actual con tres consultas agrupadas"""
+    now = datetime.utcnow()
+    since = _window_start(now)
+    limits = _limits()
+    if clear:
+        SuspiciousFlag.query.delete()
+
+    flagged = 0
+    for rule in RULES:
+        model, measure, conditions = _measure(rule, since)
+        # El join descarta los logs de claves inexistentes (license_id NULL)
+        rows = db.session.query(model.license_id, measure)\
+                         .join(License, License.id == model.license_id)\
+                         .filter(*conditions)\
+                         .group_by(model.license_id)\
+                         .having(measure > limits[rule]).all()
+        for license_id, n in rows:
+            _flag(license_id, rule, n, now)
+            flagged += 1
+    db.session.commit()
+    return flagged
@@ -0,0 +1,103 @@
+"""
+admission.py - Control de admisión y descarte de carga por worker
+
+Cada worker admite como mucho `max_inflight` peticiones a la vez en el
+blueprint protegido. Las siguientes esperan en una cola corta (`max_queue`
+peticiones, `queue_timeout` segundos como mucho); si la cola está llena o
+la espera vence, se responde al momento con 503 BUSY sin tocar la BD. La
+respuesta indica al bot cuándo reintentar (retry_after, con algo de jitter
+para no volver todos a la vez) y cuánto tiempo puede seguir usando su
+último estado conocido (grace_seconds).
+
+Solo tiene efecto con workers de varios hilos (gthread/gevent): un worker
+síncrono ya atiende de una en una.
+"""
+
+import random
+import threading
+import time
+from flask import g, jsonify
+import metrics
+
+
+class AdmissionControl:
+    """Semáforo de peticiones en curso con cola acotada"""
+
+    def __init__(self, name, max_inflight, max_queue, queue_timeout, retry_after, grace_seconds):
+        self.name = name
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.grace_seconds = grace_seconds
+        self._slots = threading.BoundedSemaphore(max_inflight)
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._queued = 0
+        self._stats = {"admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_timeout": 0,
+                       "wait_max_ms": 0.0}
+
+    def try_enter(self):
+        """True si la petición entra (ya o tras esperar en cola)"""
+        if self._slots.acquire(blocking=False):
+            return self._admitted(0.0)
+
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self._stats["shed_queue_full"] += 1
+                return False
+            self._queued += 1
+            self._stats["queued"] += 1
+
+        start = time.monotonic()
+        ok = self._slots.acquire(timeout=self.queue_timeout)
+        with self._lock:
+            self._queued -= 1
+            if not ok:
+                self._stats["shed_timeout"] += 1
+                return False
+        return self._admitted(time.monotonic() - start)
+
+    def _admitted(self, waited):
+        with self._lock:
+            self._inflight += 1
+            self._stats["admitted"] += 1
+            self._stats["wait_max_ms"] = max(self._stats["wait_max_ms"], waited * 1000)
+        return True
+
+    def leave(self):
+        with self._lock:
+            self._inflight -= 1
+        self._slots.release()
+
+    def busy_response(self):
+        """503 barato: no toca la BD ni parsea el cuerpo"""
+        metrics.incr(f"{self.name}_shed")
+        retry = self.retry_after + random.randint(0, self.retry_after)
+        response = jsonify({"error": "BUSY", "retry_after": retry,
+                            "grace_seconds": self.grace_seconds})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(retry)
+        return response
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, inflight=self._inflight, waiting=self._queued,
+                        max_inflight=self.max_inflight, max_queue=self.max_queue)
+
+    def install(self, bp):
+        """Aplica el control a todas las rutas del blueprint"""
+        flag = f"_admitted_{self.name}"
+
+        @bp.before_request
+        def _admit():
+            if not self.try_enter():
+                return self.busy_response()
+            setattr(g, flag, True)
+
+        @bp.teardown_request
+        def _release(exc):
+            if g.pop(flag, False):
+                self.leave()
+
+        metrics.register(f"admission_{self.name}", self.stats)
@@ -19,20 +19,64 @@ def create_app(config_name='default'):
     # Inicializar base de datos
     db.init_app(app)
     
+    # Lecturas admin/analytics a la réplica, si hay DATABASE_READ_URL
+    import replica
+    replica.init_app(app)
+    
     # Registrar blueprints
     from routes.validation import bp as validation_bp
     from routes.admin_api import bp as admin_api_bp
     from routes.analytics import bp as analytics_bp
     from routes.admin_panel import bp as admin_panel_bp
+    from routes.events import bp as events_bp
+    from routes.data_transfer import bp as data_transfer_bp
     
     app.register_blueprint(validation_bp)
     app.register_blueprint(admin_api_bp)
     app.register_blueprint(analytics_bp)
     app.register_blueprint(admin_panel_bp)
+    app.register_blueprint(events_bp)
+    app.register_blueprint(data_transfer_bp)
+    
+    # Comandos CLI
+    from commands import register_commands
+    register_commands(app)
+    
+    # Bus de eventos y mantenimiento de SQLite: un hilo por worker, arrancados tras el fork
+    from events import hub
+    import sqlite_tuning
+    
+    # Caché de analytics, invalidada por los eventos del bus
+    import result_cache
+    result_cache.init_app(app)
+    
+    # Instantánea mmap de licencias para /api/validate
+    import snapshot as license_snapshot
+    license_snapshot.init_app(app)
+    
+    # device_info memoizado y, con UA_ENRICH_ASYNC, rellenado en segundo plano
+    import device_info
+    device_info.init_app(app)
+    
+    # Contadores y reglas de abuso de cada validación, volcados en segundo plano
+    import write_behind
+    write_behind.init_app(app)
+
+    @app.before_request
+    def _start_background_threads():
+        hub.start(app)
+        sqlite_tuning.start(app)
+        license_snapshot.start(app)
+        device_info.start(app)
+        write_behind.start(app)
+    
+    # Profiling bajo demanda (X-Profile: N de un admin)
+    import profiler
+    profiler.init_app(app)
     
-    # Crear tablas si no existen
-    with app.app_context():
-        db.create_all()
+    # Esquema: una consulta de versión en modo auto (ver DB_INIT_MODE)
+    from database import init_schema
+    init_schema(app)
     
     return app
 
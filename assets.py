@@ -0,0 +1,91 @@
+"""
+assets.py - CSS y JS del panel como ficheros estáticos versionados
+
+No dependen de la petición, así que cada worker los construye una vez desde
+templates/ con el hash del contenido en la URL (panel.<hash>.css) y su
+variante gzip ya comprimida. Al cambiar el contenido cambia la URL, por eso
+se sirven con Cache-Control immutable de un año: el navegador los descarga
+una vez y cada carga del panel solo trae el HTML con los datos.
+"""
+
+import gzip
+import hashlib
+from flask import Response
+from templates._styles import STYLES
+from templates._modal_and_scripts import SCRIPTS
+
+PREFIX = "/api/admin/assets/"
+MAX_AGE = 365 * 24 * 3600
+
+# Por debajo de esto gzip no compensa (cabe en un paquete)
+GZIP_MIN_BYTES = 1400
+
+_MIMETYPES = {"css": "text/css", "js": "application/javascript"}
+
+
+def _build(name, text):
+    body = text.encode()
+    digest = hashlib.sha256(body).hexdigest()[:12]
+    stem, ext = name.rsplit(".", 1)
+    return {
+        "name":     name,
+        "filename": f"{stem}.{digest}.{ext}",
+        "etag":     digest,
+        "mimetype": _MIMETYPES[ext],
+        "body":     body,
+        "gzip":     gzip.compress(body, 9, mtime=0),
+    }
+
+
+_ASSETS = {a["name"]: a for a in (_build("panel.css", STYLES), _build("panel.js", SCRIPTS))}
+_BY_FILENAME = {a["filename"]: a for a in _ASSETS.values()}
+
+
+def url(name):
+    """URL versionada de un asset ("panel.css", "panel.js")"""
+    return PREFIX + _ASSETS[name]["filename"]
+
+
+def _accepts_gzip(request):
+    return request.accept_encodings["gzip"] > 0
+
+
+def serve(filename, request):
+    """Respuesta para /api/admin/assets/<filename>, o None si no existe"""
+    asset = _BY_FILENAME.get(filename)
+    current = asset is not None
+    if not current:
+        # Hash de otra versión (HTML de un worker con otro despliegue):
+        # se sirve la actual, pero sin dejarla en caché con esa URL
+        stem, _, ext = filename.partition(".")
+        asset = _ASSETS.get(f"{stem}.{ext.rpartition('.')[2]}")
+        if asset is None:
+            return None
+
+    compressed = _accepts_gzip(request)
+    response = Response(asset["gzip"] if compressed else asset["body"],
+                        mimetype=asset["mimetype"])
+    if compressed:
+        response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    if current:
+        response.headers["Cache-Control"] = f"public, max-age={MAX_AGE}, immutable"
+        response.set_etag(asset["etag"] + ("-gz" if compressed else ""))
+        response.make_conditional(request)
+    else:
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def page(html, request):
+    """HTML generado por petición: gzip si el cliente lo acepta y nunca en caché"""
+    body = html.encode()
+    response = Response(mimetype="text/html")
+    if len(body) >= GZIP_MIN_BYTES and _accepts_gzip(request):
+        body = gzip.compress(body, 6)
+        response.headers["Content-Encoding"] = "gzip"
+    response.set_data(body)
+    response.headers["Vary"] = "Accept-Encoding"
+    # Lleva el secreto de admin y datos de licencias
+    response.headers["Cache-Control"] = "no-store"
+    return response
@@ -0,0 +1,83 @@
+"""
+benchmarks/panel_load.py - Bytes y tiempo hasta el primer pintado del panel
+
+Crea N licencias, pide /api/admin/panel como lo haría un navegador
+(Accept-Encoding: gzip) y luego los CSS/JS que enlace. Compara la primera
+visita (caché del navegador vacía) con una recarga (assets ya en caché;
+lo inline viaja siempre).
+
+El primer pintado se estima: render del servidor + RTT por cada viaje que
+bloquea el pintado (HTML y, si no está en caché, el CSS) + bytes bloqueantes
+al ancho de banda indicado. El JS se carga al final del body y no bloquea.
+
+    python benchmarks/panel_load.py [--licenses 200] [--runs 5] [--rtt-ms 50] [--mbps 10]
+"""
+
+import argparse
+import gzip as gz
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--licenses", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--rtt-ms", type=float, default=50)
+    parser.add_argument("--mbps", type=float, default=10)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{tmp}/bench.db")
+    os.environ["ADMIN_SECRET"] = "bench"
+    os.environ["SNAPSHOT_PATH"] = f"{tmp}/snapshot.bin"
+    sys.path.insert(0, ROOT)
+
+    from app import app
+    client = app.test_client()
+    for i in range(args.licenses):
+        client.post("/api/admin/create", json={"plan": "monthly", "user": f"bench{i}"},
+                    headers={"X-Admin-Secret": "bench"})
+
+    gzip = {"Accept-Encoding": "gzip"}
+    samples = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        page = client.get("/api/admin/panel?secret=bench", headers=gzip)
+        samples.append(time.perf_counter() - started)
+    render = statistics.median(samples)
+    html = len(page.data)
+
+    text = page.data
+    if page.headers.get("Content-Encoding") == "gzip":
+        text = gz.decompress(text)
+    text = text.decode()
+
+    css = js = 0
+    for url in re.findall(r'<link rel="stylesheet" href="([^"]+)"', text):
+        css += len(client.get(url, headers=gzip).data)
+    for url in re.findall(r'<script src="([^"]+)"', text):
+        js += len(client.get(url, headers=gzip).data)
+
+    def first_paint(blocking_bytes, trips):
+        transfer = blocking_bytes * 8 / (args.mbps * 1e6)
+        return (render + trips * args.rtt_ms / 1000 + transfer) * 1000
+
+    first_trips = 2 if css else 1
+    print(f"{args.licenses} licencias, RTT {args.rtt_ms:g} ms, {args.mbps:g} Mbit/s, "
+          f"render del servidor {render * 1000:.1f} ms")
+    print(f"{'':<16}{'HTML':>10}{'CSS':>10}{'JS':>10}{'total':>10}{'1er pintado':>14}")
+    print(f"{'primera visita':<16}{html:>10}{css:>10}{js:>10}{html + css + js:>10}"
+          f"{first_paint(html + css, first_trips):>11.1f} ms")
+    print(f"{'recarga':<16}{html:>10}{0:>10}{0:>10}{html:>10}"
+          f"{first_paint(html, 1):>11.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
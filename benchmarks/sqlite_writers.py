@@ -0,0 +1,83 @@
+"""
+benchmarks/sqlite_writers.py - Throughput de validate con varios workers sobre SQLite
+
+Lanza N procesos (como los workers de gunicorn) que llaman a /api/validate
+en bucle contra el mismo fichero SQLite, con y sin el perfil de
+sqlite_tuning (SQLITE_TUNING=1/0), y cuenta validaciones correctas por
+segundo y errores (normalmente "database is locked").
+
+    python benchmarks/sqlite_writers.py [--workers 4] [--seconds 10]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SETUP = """
+import json, sys
+from app import app
+c = app.test_client()
+keys = []
+for i in range(int(sys.argv[1])):
+    r = c.post("/api/admin/create", json={"plan": "monthly", "user": f"bench{i}"},
+               headers={"X-Admin-Secret": "bench"})
+    keys.append(r.json["key"])
+print(json.dumps(keys))
+"""
+
+WORKER = """
+import json, sys, time, logging
+from app import app
+app.logger.setLevel(logging.CRITICAL)
+key, seconds = sys.argv[1], float(sys.argv[2])
+c = app.test_client()
+ok = errors = 0
+end = time.time() + seconds
+while time.time() < end:
+    r = c.post("/api/validate", json={"key": key, "hw_id": "bench-hw", "app_version": "1.0"})
+    if r.status_code == 200:
+        ok += 1
+    else:
+        errors += 1
+print(json.dumps({"ok": ok, "errors": errors}))
+"""
+
+
+def run(tuning, workers, seconds):
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{tmp}/bench.db", ADMIN_SECRET="bench",
+               SQLITE_TUNING=tuning, FLASK_ENV="production")
+    keys = json.loads(subprocess.run([sys.executable, "-c", SETUP, str(workers)], cwd=ROOT,
+                                     env=env, capture_output=True, text=True, check=True).stdout)
+
+    procs = [subprocess.Popen([sys.executable, "-c", WORKER, key, str(seconds)], cwd=ROOT,
+                              env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+             for key in keys]
+    totals = {"ok": 0, "errors": 0}
+    for p in procs:
+        out, _ = p.communicate()
+        for name, n in json.loads(out.strip().splitlines()[-1]).items():
+            totals[name] += n
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{args.workers} workers, {args.seconds:.0f}s cada escenario")
+    print(f"{'perfil':<22}{'validaciones/s':>16}{'errores':>10}")
+    for label, tuning in (("sin perfil (antes)", "0"), ("sqlite_tuning", "1")):
+        totals = run(tuning, args.workers, args.seconds)
+        print(f"{label:<22}{totals['ok'] / args.seconds:>16.1f}{totals['errors']:>10}")
+
+
+if __name__ == "__main__":
+    main()
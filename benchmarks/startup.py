@@ -0,0 +1,81 @@
+"""
+benchmarks/startup.py - Tiempo de preparación del esquema al arrancar un worker
+
+En procesos nuevos (como haría gunicorn con cada worker) importa la app con
+DB_INIT_MODE=skip y mide aparte init_schema() con cada modo, sobre una BD
+con el esquema ya migrado: es la parte del arranque que cambia entre modos.
+El import completo se muestra como referencia; incluye Flask, SQLAlchemy y
+los blueprints, que cuestan lo mismo en los tres modos. También mide el
+import aislado de user_agents, que ya no se paga al arrancar.
+
+    python benchmarks/startup.py [--runs 7]
+
+La BD inaccesible por defecto es un SQLite en un directorio inexistente;
+para probar un PostgreSQL caído: BENCH_UNREACHABLE_URL=postgresql://u:p@10.255.255.1/x
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imprime "<import> <init_schema>" en segundos; BENCH_MODE es el modo medido
+PROBE = (
+    "import os, time; t = time.perf_counter(); import app; t_import = time.perf_counter() - t; "
+    "from config import Config; from database import init_schema; "
+    "Config.DB_INIT_MODE = os.environ['BENCH_MODE']; "
+    "t = time.perf_counter(); init_schema(app.app); "
+    "print(t_import, time.perf_counter() - t)"
+)
+
+
+def timed(code, env, runs):
+    """Medianas de cada columna que imprime `code` en `runs` procesos nuevos"""
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env,
+                             capture_output=True, text=True, timeout=120)
+        if out.returncode != 0:
+            return None, out.stderr.strip().splitlines()[-1]
+        samples.append([float(v) for v in out.stdout.strip().splitlines()[-1].split()])
+    return [statistics.median(column) for column in zip(*samples)], None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=7)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    reachable = f"sqlite:///{tmp}/bench.db"
+    unreachable = os.getenv("BENCH_UNREACHABLE_URL", "sqlite:////nonexistent-dir/bench.db")
+
+    base = dict(os.environ, FLASK_ENV="production")
+    # Primera importación: crea las tablas y guarda la versión del esquema
+    subprocess.run([sys.executable, "-c", "import app"], cwd=ROOT,
+                   env=dict(base, DATABASE_URL=reachable, DB_INIT_MODE="sync"), check=True)
+
+    print(f"{'escenario':<34}{'init_schema':>14}{'import app':>14}")
+    for label, url in (("BD accesible", reachable), ("BD inaccesible", unreachable)):
+        for mode in ("sync", "auto", "skip"):
+            env = dict(base, DATABASE_URL=url, DB_INIT_MODE="skip", BENCH_MODE=mode)
+            medians, error = timed(PROBE, env, args.runs)
+            if error is None:
+                init, total = medians[1], medians[0]
+                result = f"{init * 1000:12.1f}ms{total * 1000:12.1f}ms"
+            else:
+                result = f"  error: {error}"
+            print(f"{label + ' / ' + mode:<34}{result}")
+
+    ua_probe = "import time; t = time.perf_counter(); import user_agents; print(time.perf_counter() - t)"
+    medians, error = timed(ua_probe, base, args.runs)
+    if error is None:
+        print(f"{'import user_agents (diferido)':<34}{medians[0] * 1000:12.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
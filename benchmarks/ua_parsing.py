@@ -0,0 +1,77 @@
+"""
+benchmarks/ua_parsing.py - Coste de obtener device_info con y sin la LRU
+
+Simula el flujo de user agents de una flota de bots (unas pocas cadenas
+muy repetidas más una cola de cadenas únicas) y compara user_agents.parse
+en cada llamada con device_info.describe. Muestra la tasa de aciertos y el
+CPU ahorrado por llamada.
+
+    python benchmarks/ua_parsing.py [--calls 20000] [--distinct 25] [--unique-pct 1]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TEMPLATES = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:{v}.0) Gecko/20100101 Firefox/{v}.0",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/{v}.1 Safari/605.1.15",
+    "python-requests/2.{v}.0",
+    "MyBot/{v}.0 (+https://example.com/bot)",
+]
+
+
+def stream(calls, distinct, unique_pct, seed=1):
+    rng = random.Random(seed)
+    pool = [TEMPLATES[i % len(TEMPLATES)].format(v=100 + i) for i in range(distinct)]
+    # Zipf aproximado: los primeros user agents concentran casi todo el tráfico
+    weights = [1 / (i + 1) for i in range(distinct)]
+    for n in range(calls):
+        if rng.random() * 100 < unique_pct:
+            yield f"CustomClient/{n} (build {rng.randint(0, 10**9)})"
+        else:
+            yield rng.choices(pool, weights)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--distinct", type=int, default=25)
+    parser.add_argument("--unique-pct", type=float, default=1.0)
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from user_agents import parse
+    import device_info
+
+    agents = list(stream(args.calls, args.distinct, args.unique_pct))
+    parse(agents[0])    # import y compilación de regex fuera de la medida
+
+    started = time.process_time()
+    for ua in agents:
+        info = parse(ua)
+        f"{info.os.family} {info.os.version_string} - {info.browser.family}"
+    raw = time.process_time() - started
+
+    started = time.process_time()
+    for ua in agents:
+        device_info.describe(ua)
+    cached = time.process_time() - started
+
+    stats = device_info.stats()
+    print(f"llamadas:            {args.calls} ({args.distinct} user agents frecuentes, "
+          f"{args.unique_pct}% únicos)")
+    print(f"parse en cada una:   {raw:8.3f}s CPU  ({raw / args.calls * 1e6:8.1f} µs/llamada)")
+    print(f"con LRU:             {cached:8.3f}s CPU  ({cached / args.calls * 1e6:8.1f} µs/llamada)")
+    print(f"tasa de aciertos:    {stats['hit_rate'] * 100:8.2f}%")
+    print(f"CPU ahorrado:        {(raw - cached) / args.calls * 1e6:8.1f} µs/llamada "
+          f"(x{raw / cached:.0f})")
+
+
+if __name__ == "__main__":
+    main()
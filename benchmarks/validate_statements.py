@@ -0,0 +1,166 @@
+"""
+benchmarks/validate_statements.py - Sentencias SQL por resultado de validate
+
+Cuenta las sentencias que ejecuta /api/validate en el hilo de la petición
+(más el commit) para cada resultado, con las cachés del worker ya
+calientes, y falla si alguno supera su presupuesto. La instantánea de
+licencias se desactiva para medir siempre el camino completo contra la BD.
+
+    python benchmarks/validate_statements.py [--verbose]
+
+Usa un SQLite temporal salvo que se indique DATABASE_URL. En SQLite cada
+transacción de escritura añade su BEGIN IMMEDIATE a la cuenta. Al final se
+muestra también el volcado de write_behind.py, que ocurre fuera de la
+petición. tests/test_validate_statements.py importa de aquí BUDGET,
+capture() y prepare() para comprobar los mismos máximos con pytest.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Máximo de sentencias (incluido el commit) por resultado. Contadores,
+# sketches, el índice de IPs, la presencia y las reglas de abuso van por
+# write_behind.py, fuera de la petición; una activación suma su evento y el
+# alta del dispositivo, y un heartbeat normal son 4 sentencias y el commit.
+BUDGET = {
+    "heartbeat":    6,
+    "activation":   9,
+    "new_ip":       7,
+    "wrong_device": 6,
+    "invalid":      4,
+    "revoked":      5,
+    "expired":      5,
+}
+
+UA = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0"
+INVALID_KEY = "VB-NONE-NONE-NONE-NONE"
+
+
+def capture(engine):
+    """Lista que recibe las sentencias (y COMMIT) de este hilo; devuelve (lista, quitar)"""
+    from sqlalchemy import event
+
+    statements = []
+    thread = threading.get_ident()
+
+    def on_execute(conn, cursor, statement, params, context, executemany):
+        if threading.get_ident() == thread:
+            statements.append(" ".join(statement.split()))
+
+    def on_commit(conn):
+        if threading.get_ident() == thread:
+            statements.append("COMMIT")
+
+    event.listen(engine, "before_cursor_execute", on_execute)
+    event.listen(engine, "commit", on_commit)
+
+    def remove():
+        event.remove(engine, "before_cursor_execute", on_execute)
+        event.remove(engine, "commit", on_commit)
+    return statements, remove
+
+
+def prepare(app, client, admin):
+    """Calienta las cachés del worker y devuelve {resultado: (status, error, llamada)}"""
+    from datetime import datetime, timedelta
+    from models import db, License
+    from routes import validation
+
+    # Sin instantánea: siempre el camino completo contra la BD
+    validation.snapshot.lookup = lambda key: None
+
+    def create():
+        response = client.post("/api/admin/create", json={"plan": "monthly", "user": "bench"},
+                               headers=admin)
+        assert response.status_code == 201, response.json
+        return response.json["key"]
+
+    def validate(key, hw_id="hw-bench", ip="10.0.0.1"):
+        return client.post("/api/validate", json={"key": key, "hw_id": hw_id, "app_version": "1.0"},
+                           headers={"User-Agent": UA, "X-Forwarded-For": ip})
+
+    # Calentar cachés del worker (user agent, dispositivo)
+    warm = create()
+    validate(warm)
+    validate(warm, ip="10.0.0.2")
+    validate(warm, hw_id="hw-other")
+    validate(INVALID_KEY)
+
+    main_key, revoked_key, expired_key, new_key = create(), create(), create(), create()
+    for key in (main_key, revoked_key, expired_key):
+        validate(key)
+    client.post("/api/admin/revoke", json={"key": revoked_key}, headers=admin)
+    with app.app_context():
+        License.query.filter_by(key=expired_key)\
+                     .update({"expires_at": datetime.utcnow() - timedelta(days=1)})
+        db.session.commit()
+    validate(main_key)
+
+    # Orden fijo: "activation" vincula new_key y "new_ip" cambia la IP de main_key
+    return {
+        "heartbeat":    (200, None,           lambda: validate(main_key)),
+        "activation":   (200, None,           lambda: validate(new_key, hw_id="hw-new")),
+        "new_ip":       (200, None,           lambda: validate(main_key, ip="10.9.9.9")),
+        "wrong_device": (403, "WRONG_DEVICE", lambda: validate(main_key, hw_id="hw-intruder")),
+        "invalid":      (403, "INVALID",      lambda: validate(INVALID_KEY)),
+        "revoked":      (403, "REVOKED",      lambda: validate(revoked_key)),
+        "expired":      (403, "EXPIRED",      lambda: validate(expired_key)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--verbose", action="store_true", help="Mostrar las sentencias")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{tmp}/bench.db")
+    os.environ["ADMIN_SECRET"] = "bench"
+    os.environ["SNAPSHOT_PATH"] = f"{tmp}/snapshot.bin"
+    sys.path.insert(0, ROOT)
+
+    from app import app
+    from models import db
+    import write_behind
+
+    client = app.test_client()
+    with app.app_context():
+        statements, _ = capture(db.engine)
+    cases = prepare(app, client, {"X-Admin-Secret": "bench"})
+    with app.app_context():
+        write_behind.flush()
+
+    failed = []
+    print(f"{'resultado':<16}{'status':>8}{'sentencias':>12}{'máximo':>9}")
+    for name, (status, error, call) in cases.items():
+        statements.clear()
+        response = call()
+        count = len(statements)
+        mark = "" if count <= BUDGET[name] and response.status_code == status else "  ✗"
+        print(f"{name:<16}{response.status_code:>8}{count:>12}{BUDGET[name]:>9}{mark}")
+        if args.verbose:
+            for statement in statements:
+                print(f"    {statement[:90]}")
+        if mark:
+            failed.append(name)
+
+    # Lo diferido de los siete casos, en un solo volcado (fuera de las peticiones)
+    statements.clear()
+    with app.app_context():
+        keys = write_behind.flush()
+    print(f"{'volcado diferido':<16}{'':>8}{len(statements):>12}{'':>9}  ({keys} claves)")
+    if args.verbose:
+        for statement in statements:
+            print(f"    {statement[:90]}")
+
+    if failed:
+        sys.exit(f"Presupuesto superado: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+commands.py - Comandos CLI de mantenimiento (flask --app app <comando>)
+"""
+
+import sys
+import click
+
+
+def register_commands(app):
+    """Registra los comandos CLI en la aplicación"""
+
+    @app.cli.command("rebuild-stats")
+    def rebuild_stats():
+        """Recalcula los contadores incrementales del dashboard"""
+        import stats
+        stats.rebuild()
+        click.echo(f"✓ Contadores reconstruidos: {stats.dashboard_counts()}")
+
+    @app.cli.command("rebuild-license-stats")
+    def rebuild_license_stats():
+        """Recalcula contadores y sketches de vida de cada licencia desde ActivityLog"""
+        import license_stats
+        processed = license_stats.rebuild()
+        click.echo(f"✓ Estadísticas reconstruidas a partir de {processed} logs")
+
+    @app.cli.command("export-activity")
+    @click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), default="csv")
+    @click.option("--from", "start", help="Fecha/hora ISO inicial (incluida)")
+    @click.option("--to", "end", help="Fecha/hora ISO final (excluida)")
+    @click.option("--key", help="Clave de licencia")
+    @click.option("--status", help="SUCCESS, INVALID, REVOKED, EXPIRED, WRONG_DEVICE")
+    @click.option("--ip", help="IP exacta")
+    @click.option("--hw-id", help="hw_id exacto")
+    @click.option("--gzip", "compress", is_flag=True, help="Comprimir la salida con gzip")
+    @click.option("--output", "-o", type=click.Path(dir_okay=False), help="Fichero de salida (stdout por defecto)")
+    def export_activity(fmt, start, end, key, status, ip, hw_id, compress, output):
+        """Exporta ActivityLog en streaming con filtros de rango"""
+        import exporter
+        try:
+            filters = exporter.parse_filters({"from": start, "to": end, "key": key,
+                                              "status": status, "ip": ip, "hw_id": hw_id})
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+
+        out = open(output, "wb") if output else sys.stdout.buffer
+        try:
+            for chunk in exporter.stream_export(filters, fmt, compress):
+                out.write(chunk)
+        finally:
+            if output:
+                out.close()
+
+    @app.cli.command("import-licenses")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]),
+                  help="Por defecto se deduce de la extensión")
+    @click.option("--batch-size", default=1000, show_default=True)
+    def import_licenses(path, fmt, batch_size):
+        """Importa licencias desde un fichero CSV o NDJSON"""
+        import importer
+        fmt = fmt or ("ndjson" if path.endswith((".ndjson", ".jsonl", ".json")) else "csv")
+        with open(path, "rb") as f:
+            result = importer.import_licenses(f, fmt, batch_size)
+
+        click.echo(f"✓ Importadas {result.imported} de {result.total} filas ({result.failed} con error)")
+        for err in result.errors:
+            click.echo(f"  línea {err['line']} [{err['key']}]: {err['error']}", err=True)
+
+    @app.cli.command("sqlite-maintenance")
+    @click.option("--full", is_flag=True, help="ANALYZE sobre los índices completos (más lento)")
+    def sqlite_maintenance(full):
+        """Checkpoint del WAL y ANALYZE en SQLite"""
+        import sqlite_tuning
+        from models import db
+        if db.engine.dialect.name != "sqlite":
+            raise click.UsageError("Solo aplica a SQLite")
+        busy, wal_pages, done = sqlite_tuning.checkpoint(db.engine)
+        click.echo(f"✓ Checkpoint: {done}/{wal_pages} páginas" + (" (ocupada, parcial)" if busy else ""))
+        sqlite_tuning.analyze(db.engine, limit=0 if full else sqlite_tuning.ANALYSIS_LIMIT)
+        click.echo("✓ ANALYZE completado")
+
+    @app.cli.command("detect-abuse")
+    @click.option("--clear", is_flag=True, help="Borrar las marcas existentes antes de re-escanear")
+    def detect_abuse(clear):
+        """Re-escanea la ventana actual y actualiza las marcas de actividad sospechosa"""
+        import abuse
+        flagged = abuse.rescan(clear=clear)
+        click.echo(f"✓ {flagged} marcas de actividad sospechosa actualizadas")
+
+    @app.cli.command("migrate-activity-dims")
+    @click.option("--chunk-size", default=5000, show_default=True)
+    def migrate_activity_dims(chunk_size):
+        """Pasa hw_id / user agent / device_info de los logs antiguos a tablas de dimensión"""
+        import dims
+        migrated = dims.migrate(chunk_size, progress=lambda n: click.echo(f"  {n} logs migrados"))
+        click.echo(f"✓ {migrated} logs migrados")
+        _echo_storage_report(dims.storage_report())
+        click.echo("  Ejecuta VACUUM para devolver el espacio liberado al sistema")
+
+    @app.cli.command("activity-storage-report")
+    def activity_storage_report():
+        """Espacio de texto de hw_id / user agent / device_info en ActivityLog"""
+        import dims
+        _echo_storage_report(dims.storage_report())
+
+    @app.cli.command("rebuild-ip-index")
+    @click.option("--chunk-size", default=1000, show_default=True, help="Licencias por bloque")
+    def rebuild_ip_index(chunk_size):
+        """Reconstruye el índice inverso IP → licencias desde ActivityLog"""
+        import reverse_index
+        total = reverse_index.rebuild_ips(chunk_size, progress=lambda n: click.echo(f"  {n} pares licencia/IP"))
+        click.echo(f"✓ Índice de IPs reconstruido: {total} pares licencia/IP")
+
+    @app.cli.command("resume-purges")
+    @click.option("--chunk-size", type=int, help="Filas por transacción (PURGE_CHUNK_SIZE por defecto)")
+    def resume_purges(chunk_size):
+        """Termina los borrados en segundo plano interrumpidos"""
+        import purge
+        ids = purge.pending()
+        total = sum(purge.finish(license_id, chunk_size) for license_id in ids)
+        click.echo(f"✓ Borrados terminados: {len(ids)} licencias, {total} filas de historial")
+
+    @app.cli.command("run-reports")
+    @click.option("--workers", type=int, help="Procesos del pool (REPORTS_WORKERS por defecto; 1 sin pool)")
+    @click.option("--chunk-size", type=int, help="Ids de ActivityLog por bloque (REPORTS_CHUNK_SIZE por defecto)")
+    @click.option("--restart", is_flag=True, help="Descartar la ejecución pendiente en vez de retomarla")
+    def run_reports(workers, chunk_size, restart):
+        """Genera los informes offline sobre ActivityLog (se retoma si se interrumpe)"""
+        import reports
+        job = reports.run(workers, chunk_size, restart,
+                          progress=lambda done, total: click.echo(f"  bloque {done}/{total}"))
+        click.echo(f"✓ Informes generados (ejecución {job.id}): {', '.join(reports.REPORTS)}")
+
+
+def _echo_storage_report(report):
+    click.echo(f"  Logs: {report['logs']} ({report['encoded_logs']} codificados, "
+               f"{report['legacy_logs']} sin migrar)")
+    click.echo(f"  Dimensiones: {report['devices']} dispositivos, {report['user_agents']} user agents")
+    click.echo(f"  Texto inline: {_size(report['inline_bytes'])} → almacenado: "
+               f"{_size(report['stored_bytes'])} (ahorro {report['saved_pct']}%)")
+
+
+def _size(n):
+    for unit in ("B", "KB", "MB"):
+        if abs(n) < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
@@ -11,12 +11,98 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ENGINE_OPTIONS = {'poolclass': __import__('sqlalchemy.pool', fromlist=['NullPool']).NullPool}
     
+    # Réplica de lectura opcional para analytics y lecturas admin (ver replica.py)
+    DATABASE_READ_URL        = os.getenv("DATABASE_READ_URL", "")
+    SQLALCHEMY_BINDS         = {"replica": DATABASE_READ_URL} if DATABASE_READ_URL else {}
+    READ_REPLICA_MAX_LAG     = float(os.getenv("READ_REPLICA_MAX_LAG", "10"))
+    READ_YOUR_WRITES_SECONDS = int(os.getenv("READ_YOUR_WRITES_SECONDS", "30"))
+    
+    # Perfil de SQLite para varios workers (ver sqlite_tuning.py); sin efecto en PostgreSQL
+    SQLITE_TUNING               = os.getenv("SQLITE_TUNING", "1") not in ("0", "false")
+    SQLITE_BUSY_TIMEOUT_MS      = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_MMAP_SIZE            = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    SQLITE_CACHE_SIZE_KB        = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+    SQLITE_CHECKPOINT_INTERVAL  = int(os.getenv("SQLITE_CHECKPOINT_INTERVAL", "300"))
+    SQLITE_ANALYZE_INTERVAL     = int(os.getenv("SQLITE_ANALYZE_INTERVAL", "86400"))
+    
+    # Inicialización del esquema al arrancar cada worker:
+    #   auto → una consulta a schema_version; solo sincroniza si no coincide
+    #   sync → create_all + columnas/índices nuevos siempre (comportamiento clásico)
+    #   skip → no toca el esquema (p. ej. si se migra en un paso de despliegue)
+    DB_INIT_MODE = os.getenv("DB_INIT_MODE", "auto")
+    
     # Seguridad
     ADMIN_SECRET = os.getenv("ADMIN_SECRET", "TU_CLAVE_ADMIN_MUY_SEGURA")
     
     # Configuración de licencias
     LICENSE_PREFIX = "VB"
-    
+
+    # Canal de eventos push (/api/events)
+    EVENTS_POLL_INTERVAL    = float(os.getenv("EVENTS_POLL_INTERVAL", "1.0"))
+    EVENTS_KEEPALIVE        = int(os.getenv("EVENTS_KEEPALIVE", "15"))
+    EVENTS_MAX_DURATION     = int(os.getenv("EVENTS_MAX_DURATION", "300"))
+    # Cada conexión ocupa un hilo del worker durante EVENTS_MAX_DURATION: el
+    # límite queda por debajo de WEB_THREADS (--threads de gunicorn) para dejar
+    # EVENTS_RESERVED_THREADS libres a validate y al panel. WEB_THREADS=1
+    # (workers sync) desactiva /api/events (503)
+    WEB_THREADS             = int(os.getenv("WEB_THREADS", "64"))
+    EVENTS_RESERVED_THREADS = int(os.getenv("EVENTS_RESERVED_THREADS", "32"))
+    EVENTS_MAX_CONNECTIONS  = min(int(os.getenv("EVENTS_MAX_CONNECTIONS", "200")),
+                                  max(0, WEB_THREADS - EVENTS_RESERVED_THREADS))
+    EVENTS_LONGPOLL_TIMEOUT = int(os.getenv("EVENTS_LONGPOLL_TIMEOUT", "25"))
+    EVENTS_RETENTION_HOURS  = int(os.getenv("EVENTS_RETENTION_HOURS", "24"))
+    # Operaciones masivas con más claves publican un único evento "*"
+    EVENTS_BULK_THRESHOLD   = int(os.getenv("EVENTS_BULK_THRESHOLD", "50"))
+
+    # Contadores del dashboard (ancho de cada bucket de presencia, en segundos)
+    PRESENCE_BUCKET_SECONDS = int(os.getenv("PRESENCE_BUCKET_SECONDS", "300"))
+
+    # Control de admisión de /api/validate por worker (ver admission.py)
+    VALIDATE_MAX_INFLIGHT  = int(os.getenv("VALIDATE_MAX_INFLIGHT", "8"))
+    VALIDATE_MAX_QUEUE     = int(os.getenv("VALIDATE_MAX_QUEUE", "16"))
+    VALIDATE_QUEUE_TIMEOUT = float(os.getenv("VALIDATE_QUEUE_TIMEOUT", "0.5"))
+    VALIDATE_RETRY_AFTER   = int(os.getenv("VALIDATE_RETRY_AFTER", "5"))
+    VALIDATE_GRACE_SECONDS = int(os.getenv("VALIDATE_GRACE_SECONDS", "600"))
+
+    # Instantánea de licencias compartida por los workers (ver snapshot.py); vacío la desactiva
+    SNAPSHOT_PATH          = os.getenv("SNAPSHOT_PATH", "license_snapshot.bin")
+    SNAPSHOT_INTERVAL      = float(os.getenv("SNAPSHOT_INTERVAL", "2"))
+    SNAPSHOT_FULL_INTERVAL = int(os.getenv("SNAPSHOT_FULL_INTERVAL", "3600"))
+
+    # Filas de historial por transacción al borrar una licencia en segundo plano (ver purge.py)
+    PURGE_CHUNK_SIZE = int(os.getenv("PURGE_CHUNK_SIZE", "5000"))
+
+    # Profiling bajo demanda (ver profiler.py)
+    PROFILE_DIR          = os.getenv("PROFILE_DIR", "profiles")
+    PROFILE_KEEP         = int(os.getenv("PROFILE_KEEP", "50"))
+    PROFILE_MAX_REQUESTS = int(os.getenv("PROFILE_MAX_REQUESTS", "20"))
+
+    # Informes offline sobre ActivityLog (ver reports.py)
+    REPORTS_WORKERS    = int(os.getenv("REPORTS_WORKERS", str(min(os.cpu_count() or 1, 4))))
+    REPORTS_CHUNK_SIZE = int(os.getenv("REPORTS_CHUNK_SIZE", "50000"))
+
+    # device_info a partir del user agent (ver device_info.py)
+    UA_CACHE_SIZE      = int(os.getenv("UA_CACHE_SIZE", "10000"))
+    UA_ENRICH_ASYNC    = os.getenv("UA_ENRICH_ASYNC", "0") not in ("0", "false", "")
+    UA_ENRICH_INTERVAL = float(os.getenv("UA_ENRICH_INTERVAL", "2"))
+    UA_ENRICH_BATCH    = int(os.getenv("UA_ENRICH_BATCH", "500"))
+
+    # Volcado de contadores, sketches, índice de IPs y reglas de abuso (ver write_behind.py)
+    WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "2"))
+
+    # Caché de resultados de analytics (segundos; TTL=0 la desactiva, STALE=0 sin stale-while-revalidate)
+    ANALYTICS_CACHE_TTL         = int(os.getenv("ANALYTICS_CACHE_TTL", "30"))
+    ANALYTICS_CACHE_STALE       = int(os.getenv("ANALYTICS_CACHE_STALE", "120"))
+    ANALYTICS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYTICS_CACHE_MAX_ENTRIES", "1000"))
+
+    # Detector de abuso (ver abuse.py); ABUSE_AUTO_REVOKE: HIGH, MEDIUM, LOW o vacío
+    ABUSE_WINDOW_HOURS         = int(os.getenv("ABUSE_WINDOW_HOURS", "24"))
+    ABUSE_MAX_DEVICES          = int(os.getenv("ABUSE_MAX_DEVICES", "2"))
+    ABUSE_MAX_FAILURES         = int(os.getenv("ABUSE_MAX_FAILURES", "5"))
+    ABUSE_MAX_IPS              = int(os.getenv("ABUSE_MAX_IPS", "5"))
+    ABUSE_AUTO_REVOKE          = os.getenv("ABUSE_AUTO_REVOKE", "").upper()
+    ABUSE_FLAG_RETENTION_DAYS  = int(os.getenv("ABUSE_FLAG_RETENTION_DAYS", "7"))
+
     @staticmethod
     def init_app(app):
         """Inicialización de la aplicación"""
@@ -24,6 +110,11 @@ class Config:
             app.config["SQLALCHEMY_DATABASE_URI"] = app.config["SQLALCHEMY_DATABASE_URI"].replace(
                 "postgres://", "postgresql://", 1
             )
+        binds = app.config.get("SQLALCHEMY_BINDS") or {}
+        app.config["SQLALCHEMY_BINDS"] = {
+            name: url.replace("postgres://", "postgresql://", 1) if url.startswith("postgres://") else url
+            for name, url in binds.items()
+        }
 
 
 class DevelopmentConfig(Config):
@@ -0,0 +1,262 @@
+"""
+database.py - Inicialización y mantenimiento del esquema de base de datos
+"""
+
+import uuid
+from datetime import datetime
+from sqlalchemy import inspect, text, update, MetaData
+from sqlalchemy.schema import AddConstraint, CreateTable
+from sqlalchemy.exc import SQLAlchemyError
+from config import Config
+from models import db, SchemaVersion
+import search
+
+# Incrementar al cambiar los modelos para que los workers sincronicen el esquema
+SCHEMA_VERSION = 11
+
+
+def dialect_insert(table, session=None):
+    """INSERT con soporte ON CONFLICT (upsert) para el motor en uso"""
+    name = (session or db.session).get_bind().dialect.name
+    if name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"Upsert no soportado en {name}")
+    return insert(table)
+
+
+def sync_schema():
+    """
+    Crea las tablas que falten y aplica los cambios aditivos del esquema.
+
+    create_all() no modifica tablas existentes, así que las columnas e
+    índices nuevos de los modelos se añaden aquí a bases de datos antiguas.
+    Las columnas añadidas quedan como NULL en las filas existentes y antes
+    de crear un índice único se borran las filas duplicadas. Las claves
+    foráneas que faltan, cuyo ON DELETE o nulabilidad cambió, o que el
+    modelo ya no tiene, se rehacen (ver _sync_foreign_keys).
+    """
+    db.create_all()
+    if db.engine.dialect.name == "sqlite":
+        for table in db.metadata.sorted_tables:
+            if table.dialect_options["sqlite"]["autoincrement"]:
+                _sqlite_autoincrement(table)
+    with db.engine.begin() as conn:
+        # Inspeccionar en la misma conexión: otra esperaría al bloqueo de esta
+        inspector = inspect(conn)
+        for table in db.metadata.sorted_tables:
+            columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in columns:
+                    continue
+                col_type = col.type.compile(dialect=db.engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {col_type}'))
+
+            indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    if index.unique:
+                        _drop_duplicates(conn, table, index)
+                    index.create(conn)
+
+        _sync_foreign_keys(conn)
+        # Índice de texto de License.user (FTS5 / pg_trgm), fuera del metadata
+        search.sync_indexes(conn)
+
+
+def _drop_duplicates(conn, table, index):
+    """Antes de crear un índice único: deja solo la fila más antigua de cada clave"""
+    cols = ", ".join(f'"{c.name}"' for c in index.columns)
+    conn.execute(text(
+        f'DELETE FROM "{table.name}" WHERE id NOT IN '
+        f'(SELECT min_id FROM (SELECT MIN(id) AS min_id FROM "{table.name}" GROUP BY {cols}) AS keep)'
+    ))
+
+
+def _sync_foreign_keys(conn):
+    """Crea las claves foráneas que faltan y aplica su ON DELETE y nulabilidad"""
+    # Inspector nuevo: el anterior tiene en caché las columnas previas a los ALTER
+    inspector = inspect(conn)
+    for table in db.metadata.sorted_tables:
+        existing = {tuple(fk["constrained_columns"]): fk
+                    for fk in inspector.get_foreign_keys(table.name)}
+        nullable = {c["name"]: c["nullable"] for c in inspector.get_columns(table.name)}
+        changed = []
+        modeled = set()
+        for fk in table.foreign_key_constraints:
+            columns = tuple(c.name for c in fk.columns)
+            modeled.add(columns)
+            current = existing.get(columns)
+            if current is None:
+                changed.append((fk, None))
+                continue
+            ondelete = (current.get("options") or {}).get("ondelete") or ""
+            relaxed = any(c.nullable and not c.primary_key and not nullable[c.name]
+                          for c in fk.columns)
+            if ondelete.upper() != (fk.ondelete or "").upper() or relaxed:
+                changed.append((fk, current))
+        # Claves foráneas que el modelo ya no declara (p. ej. el historial de licencias)
+        changed += [(None, current) for columns, current in existing.items()
+                    if columns not in modeled]
+        if not changed:
+            continue
+        if conn.dialect.name == "sqlite":
+            _rebuild_sqlite_table(conn, table)
+            continue
+        for fk, current in changed:
+            if current is not None:
+                conn.execute(text(f'ALTER TABLE "{table.name}" DROP CONSTRAINT "{current["name"]}"'))
+            if fk is None:
+                continue
+            if current is None:
+                _detach_dangling(conn, table, fk)
+            for col in fk.columns:
+                if col.nullable and not col.primary_key:
+                    conn.execute(text(f'ALTER TABLE "{table.name}" ALTER COLUMN "{col.name}" DROP NOT NULL'))
+            conn.execute(AddConstraint(fk))
+
+
+def _detach_dangling(conn, table, fk):
+    """Antes de añadir una clave foránea, lo mismo que _rebuild_sqlite_table con las
+    referencias a filas que no existen: NULL, o se borra la fila si no admite NULL"""
+    for element in fk.elements:
+        col, target = element.parent, element.column
+        exists = f'"{col.name}" IN (SELECT "{target.name}" FROM "{target.table.name}")'
+        if col.nullable:
+            conn.execute(text(f'UPDATE "{table.name}" SET "{col.name}" = NULL '
+                              f'WHERE "{col.name}" IS NOT NULL AND NOT {exists}'))
+        else:
+            conn.execute(text(f'DELETE FROM "{table.name}" WHERE NOT {exists}'))
+
+
+def _sqlite_autoincrement(table):
+    """
+    SQLite no añade AUTOINCREMENT a una tabla existente: se crea una copia
+    con el esquema del modelo, se copian las filas (conservando los ids) y
+    se sustituye. Con foreign_keys desactivado, porque DROP TABLE de una
+    tabla referenciada borraría en cascada a sus hijas, y legacy_alter_table
+    para que el RENAME no reescriba las referencias de las demás tablas.
+    """
+    with db.engine.connect() as conn:
+        # Fuera de transacción: dentro de una el PRAGMA no tiene efecto
+        raw = conn.connection.driver_connection
+        raw.execute("PRAGMA foreign_keys=OFF")
+        try:
+            with conn.begin():
+                sql = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' "
+                                        "AND name = :n"), {"n": table.name}).scalar() or ""
+                if "AUTOINCREMENT" in sql.upper():
+                    return
+                conn.execute(text("PRAGMA legacy_alter_table=ON"))
+                new = table.to_metadata(MetaData(), name=f"_new_{table.name}")
+                conn.execute(CreateTable(new))
+                old_columns = {c["name"] for c in inspect(conn).get_columns(table.name)}
+                columns = ", ".join(f'"{c.name}"' for c in table.columns if c.name in old_columns)
+                conn.execute(text(f'INSERT INTO "{new.name}" ({columns}) '
+                                  f'SELECT {columns} FROM "{table.name}"'))
+                # Los triggers del índice de texto caen con la tabla: sync_indexes lo rehace
+                if table.name == "license":
+                    conn.execute(text(f'DROP TABLE IF EXISTS "{search.FTS_TABLE}"'))
+                conn.execute(text(f'DROP TABLE "{table.name}"'))
+                conn.execute(text(f'ALTER TABLE "{new.name}" RENAME TO "{table.name}"'))
+                conn.execute(text("PRAGMA legacy_alter_table=OFF"))
+                for index in table.indexes:
+                    index.create(conn)
+        finally:
+            raw.execute("PRAGMA foreign_keys=ON")
+
+
+def _rebuild_sqlite_table(conn, table):
+    """
+    SQLite no modifica restricciones: renombra la tabla, la crea de nuevo
+    con el esquema del modelo y copia las filas. Las referencias a filas que
+    ya no existen (logs de claves inválidas con license_id 0) quedan en NULL,
+    o se descartan si la columna no admite NULL.
+    """
+    old = f"_old_{table.name}"
+    inspector = inspect(conn)
+    old_columns = {c["name"] for c in inspector.get_columns(table.name)}
+    for index in inspector.get_indexes(table.name):
+        conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+    conn.execute(text(f'ALTER TABLE "{table.name}" RENAME TO "{old}"'))
+    table.create(conn)
+
+    references = {fk.parent.name: fk.column for fk in table.foreign_keys}
+    columns, values, where = [], [], []
+    for col in table.columns:
+        if col.name not in old_columns:
+            continue
+        columns.append(f'"{col.name}"')
+        target = references.get(col.name)
+        if target is None:
+            values.append(f'"{col.name}"')
+            continue
+        exists = f'"{col.name}" IN (SELECT "{target.name}" FROM "{target.table.name}")'
+        if col.nullable:
+            values.append(f'CASE WHEN {exists} THEN "{col.name}" END')
+        else:
+            values.append(f'"{col.name}"')
+            where.append(exists)
+
+    conn.execute(text(
+        f'INSERT INTO "{table.name}" ({", ".join(columns)}) '
+        f'SELECT {", ".join(values)} FROM "{old}"'
+        + (f' WHERE {" AND ".join(where)}' if where else "")
+    ))
+    conn.execute(text(f'DROP TABLE "{old}"'))
+
+
+def stored_schema_version(conn):
+    """Versión guardada en la BD, o None si la tabla aún no existe"""
+    try:
+        return conn.execute(text("SELECT version FROM schema_version WHERE id = 1")).scalar()
+    except SQLAlchemyError:
+        conn.rollback()
+        return None
+
+
+def init_schema(app):
+    """
+    Prepara el esquema al arrancar un worker según DB_INIT_MODE.
+
+    En modo auto basta una consulta cuando la versión ya está aplicada.
+    Si la BD no es accesible el worker arranca igualmente: las peticiones
+    fallarán hasta que vuelva, pero el arranque no se bloquea ni se cae.
+    """
+    mode = Config.DB_INIT_MODE
+    if mode == "skip":
+        return
+
+    with app.app_context():
+        try:
+            conn = db.engine.connect()
+        except SQLAlchemyError as e:
+            app.logger.warning("BD no accesible al arrancar, se omite el esquema: %s", e)
+            return
+
+        with conn:
+            if mode == "auto" and stored_schema_version(conn) == SCHEMA_VERSION:
+                return
+
+        sync_schema()
+        row = db.session.merge(SchemaVersion(id=1, version=SCHEMA_VERSION, applied_at=datetime.utcnow()))
+        row.instance_id = row.instance_id or uuid.uuid4().hex
+        db.session.commit()
+
+
+def instance_id():
+    """Identificador aleatorio de la BD: otra BD (o una restaurada) tiene otro"""
+    return db.session.execute(
+        text("SELECT instance_id FROM schema_version WHERE id = 1")).scalar() or ""
+
+
+def rotate_instance_id(old):
+    """Asigna una identidad nueva a la BD (tras detectar que se restauró); la devuelve"""
+    new = uuid.uuid4().hex
+    db.session.execute(update(SchemaVersion).where(SchemaVersion.id == 1)
+                       .where((SchemaVersion.instance_id == old) | SchemaVersion.instance_id.is_(None))
+                       .values(instance_id=new))
+    db.session.commit()
+    return instance_id()
@@ -0,0 +1,204 @@
+"""
+device_info.py - device_info legible a partir del user agent
+
+user_agents.parse recorre decenas de expresiones regulares por llamada y
+los bots mandan casi siempre las mismas pocas cadenas, así que cada worker
+guarda el resultado en una LRU de UA_CACHE_SIZE entradas por cadena exacta.
+
+Con UA_ENRICH_ASYNC=1 el camino de la petición no parsea nunca:
+  • UserAgent se inserta con device_info NULL y un hilo por worker lo
+    rellena por lotes cada UA_ENRICH_INTERVAL segundos.
+  • El device_info de License y DeviceHistory de un user agent aún sin
+    parsear queda vacío y se completa en el mismo hilo (best effort: lo
+    pendiente de un worker que se reinicia queda vacío).
+
+/api/admin/metrics muestra la tasa de aciertos y el CPU ahorrado estimado
+(aciertos × coste medio de un parseo).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import select, update, bindparam, event as sa_event
+from sqlalchemy.orm import Session
+from config import Config
+import metrics
+
+UNKNOWN = "Desconocido"
+
+_lock = threading.Lock()
+_cache = OrderedDict()      # user agent -> device_info
+_stats = {"hits": 0, "misses": 0, "deferred": 0, "parse_seconds": 0.0}
+
+_backfill_lock = threading.Lock()
+_backfill = {}              # user agent -> {("license", id) | ("device", license_id, hw_id)}
+
+_thread = None
+
+
+def _parse(user_agent):
+    """(device_info, segundos de parseo); el import diferido no cuenta en el tiempo"""
+    started = None
+    try:
+        # Import diferido: user_agents compila sus tablas de regex al cargarse
+        from user_agents import parse
+        started = time.perf_counter()
+        ua = parse(user_agent)
+        info = f"{ua.os.family} {ua.os.version_string} - {ua.browser.family}"
+    except Exception:
+        info = user_agent[:100] if user_agent else UNKNOWN
+    return info, time.perf_counter() - started if started else 0.0
+
+
+def _cached(user_agent):
+    with _lock:
+        if user_agent in _cache:
+            _cache.move_to_end(user_agent)
+            _stats["hits"] += 1
+            return _cache[user_agent]
+    return None
+
+
+def describe(user_agent):
+    """device_info del user agent (parseado una vez por worker)"""
+    user_agent = user_agent or ""
+    info = _cached(user_agent)
+    if info is not None:
+        return info
+
+    info, elapsed = _parse(user_agent)
+    with _lock:
+        _stats["misses"] += 1
+        _stats["parse_seconds"] += elapsed
+        _cache[user_agent] = info
+        while len(_cache) > Config.UA_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return info
+
+
+def describe_now(user_agent):
+    """device_info si no hay que parsear en la petición; None si queda para el enricher"""
+    if not Config.UA_ENRICH_ASYNC:
+        return describe(user_agent)
+    info = _cached(user_agent or "")
+    if info is None:
+        with _lock:
+            _stats["deferred"] += 1
+    return info
+
+
+def backfill(session, user_agent, target):
+    """Rellenar el device_info de `target` cuando el enricher parsee el user agent"""
+    # Solo tras el commit: antes el enricher no vería la fila (o no llegará a existir)
+    session.info.setdefault("ua_backfill", []).append((user_agent or "", target))
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _publish_backfill(session):
+    pending = session.info.pop("ua_backfill", None)
+    if not pending:
+        return
+    with _backfill_lock:
+        for user_agent, target in pending:
+            _backfill.setdefault(user_agent, set()).add(target)
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _discard_backfill(session):
+    session.info.pop("ua_backfill", None)
+
+
+def stats():
+    with _lock:
+        hits, misses, deferred = _stats["hits"], _stats["misses"], _stats["deferred"]
+        seconds, size = _stats["parse_seconds"], len(_cache)
+    with _backfill_lock:
+        pending = len(_backfill)
+    average = seconds / misses if misses else 0.0
+    lookups = hits + misses + deferred
+    return {
+        "async":            Config.UA_ENRICH_ASYNC,
+        "cache_size":       size,
+        "hits":             hits,
+        "misses":           misses,
+        "deferred":         deferred,
+        "hit_rate":         round(hits / lookups, 4) if lookups else None,
+        "parse_ms_avg":     round(average * 1000, 3),
+        "cpu_saved_s":      round(hits * average, 3),
+        "backfill_pending": pending,
+    }
+
+
+# ── Enriquecimiento asíncrono ───────────────────────────────────
+
+def enrich(batch_size=None):
+    """Parsea un lote de UserAgent pendientes y los rellenos de License/DeviceHistory"""
+    from models import db, License, DeviceHistory, UserAgent
+
+    batch_size = batch_size or Config.UA_ENRICH_BATCH
+    rows = db.session.execute(
+        select(UserAgent.id, UserAgent.user_agent)
+        .where(UserAgent.device_info.is_(None)).limit(batch_size)
+    ).all()
+    if rows:
+        table = UserAgent.__table__
+        db.session.execute(
+            update(table).where(table.c.id == bindparam("b_id"), table.c.device_info.is_(None))
+                         .values(device_info=bindparam("b_info")),
+            [{"b_id": ua_id, "b_info": describe(ua)[:200]} for ua_id, ua in rows])
+
+    with _backfill_lock:
+        pending = [_backfill.popitem() for _ in range(min(batch_size, len(_backfill)))]
+    licenses, devices = [], []
+    for user_agent, targets in pending:
+        info = describe(user_agent)[:200]
+        for target in targets:
+            if target[0] == "license":
+                licenses.append({"b_id": target[1], "b_info": info})
+            else:
+                devices.append({"b_license": target[1], "b_hw": target[2], "b_info": info})
+    if licenses:
+        db.session.execute(
+            update(License.__table__)
+            .where(License.id == bindparam("b_id"), License.device_info == "")
+            .values(device_info=bindparam("b_info")), licenses)
+    if devices:
+        db.session.execute(
+            update(DeviceHistory.__table__)
+            .where(DeviceHistory.license_id == bindparam("b_license"),
+                   DeviceHistory.hw_id == bindparam("b_hw"), DeviceHistory.device_info == "")
+            .values(device_info=bindparam("b_info")), devices)
+    db.session.commit()
+    metrics.incr("ua_enriched", len(rows) + len(pending))
+    return len(rows) + len(pending)
+
+
+def start(app):
+    """Arranca el enricher del worker si UA_ENRICH_ASYNC está activo (idempotente)"""
+    global _thread
+    if _thread is not None or not Config.UA_ENRICH_ASYNC:
+        return
+    with _backfill_lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_run, args=(app,), daemon=True, name="ua-enricher")
+        _thread.start()
+
+
+def _run(app):
+    from models import db
+
+    while True:
+        time.sleep(Config.UA_ENRICH_INTERVAL)
+        with app.app_context():
+            try:
+                # Lotes seguidos mientras quede trabajo
+                while enrich() >= Config.UA_ENRICH_BATCH:
+                    pass
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Error rellenando device_info")
+
+
+def init_app(app):
+    metrics.register("user_agents", stats)
@@ -0,0 +1,164 @@
+"""
+dims.py - Tablas de dimensión de ActivityLog (Device, UserAgent)
+
+Cada log guarda dos enteros en lugar de hw_id, user agent y device_info,
+que se repiten en cada heartbeat del mismo bot. Cada worker guarda en
+memoria los ids ya resueltos, así que en régimen estable registrar un log no
+añade consultas; el device_info de un user agent conocido tampoco se vuelve
+a parsear.
+
+Los ids creados en una transacción solo pasan a la caché tras su commit: un
+rollback no deja ids que apunten a filas inexistentes.
+"""
+
+import threading
+from collections import OrderedDict
+from sqlalchemy import select, update, func, or_, bindparam, event as sa_event
+from sqlalchemy.orm import Session
+from models import db, ActivityLog, Device, UserAgent
+from database import dialect_insert
+
+CACHE_SIZE = 20000
+
+_lock = threading.Lock()
+_devices = OrderedDict()    # hw_id -> id
+_agents = OrderedDict()     # user agent -> (id, device_info)
+
+
+def _lookup(cache, value):
+    with _lock:
+        if value in cache:
+            cache.move_to_end(value)
+            return cache[value]
+    return None
+
+
+def _remember(cache, value, result):
+    with _lock:
+        cache[value] = result
+        while len(cache) > CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _publish_pending(session):
+    for cache, value, result in session.info.pop("dims_pending", ()):
+        _remember(cache, value, result)
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _discard_pending(session):
+    session.info.pop("dims_pending", None)
+
+
+def _resolve(cache, model, column, value, extra):
+    """Id de `value` en la dimensión, creando la fila si no existe"""
+    pending = db.session.info.setdefault("dims_pending", [])
+    for c, v, result in pending:
+        if c is cache and v == value:
+            return result
+
+    # Un solo UPSERT que devuelve el id, exista ya la fila o no (el SET no
+    # cambia nada); solo se ejecuta cuando el valor no está en la caché
+    table = model.__table__
+    stmt = dialect_insert(table).values({column.key: value, **{c.key: v for c, v in extra.items()}})
+    row = db.session.execute(
+        stmt.on_conflict_do_update(index_elements=[column.key],
+                                   set_={column.key: stmt.excluded[column.key]})
+            .returning(table.c.id, *(table.c[c.key] for c in extra))
+    ).first()
+    result = row[0] if not extra else tuple(row)
+    pending.append((cache, value, result))
+    return result
+
+
+def device_id(hw_id):
+    """Id de Device para un hw_id (None si está vacío)"""
+    if not hw_id:
+        return None
+    return _lookup(_devices, hw_id) or _resolve(_devices, Device, Device.hw_id, hw_id, {})
+
+
+def user_agent(ua, parse):
+    """(id, device_info) de un user agent; `parse(ua)` solo se llama si no está en caché
+
+    Si `parse` devuelve None la fila nueva queda con device_info NULL (pendiente
+    del enricher de device_info.py) y se devuelve None como device_info.
+    """
+    ua = (ua or "")[:300]
+    cached = _lookup(_agents, ua)
+    if cached:
+        agent_id, info = cached
+        # Pendiente del enricher al cachearse: puede que ya esté parseado
+        return cached if info is not None else (agent_id, parse(ua))
+    info = parse(ua)
+    return _resolve(_agents, UserAgent, UserAgent.user_agent, ua,
+                    {UserAgent.device_info: info[:200] if info is not None else None})
+
+
+# ── Migración de logs antiguos ──────────────────────────────────
+
+def migrate(chunk_size=5000, progress=None):
+    """Pasa los logs con columnas legacy a ids de dimensión, por bloques de id"""
+    last_id, migrated = 0, 0
+    legacy = (ActivityLog.legacy_hw_id, ActivityLog.legacy_user_agent, ActivityLog.legacy_device_info)
+    while True:
+        rows = db.session.execute(
+            select(ActivityLog.id, *legacy)
+            .where(ActivityLog.id > last_id, or_(*(c.isnot(None) for c in legacy)))
+            .order_by(ActivityLog.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+
+        params = []
+        for log_id, hw_id, ua, info in rows:
+            agent_id, _ = user_agent(ua, lambda _: info)
+            params.append({"b_id": log_id, "b_device": device_id(hw_id), "b_agent": agent_id})
+
+        table = ActivityLog.__table__
+        db.session.execute(
+            update(table).where(table.c.id == bindparam("b_id"))
+                         .values(device_id=bindparam("b_device"), user_agent_id=bindparam("b_agent"),
+                                 hw_id=None, user_agent=None, device_info=None),
+            params)
+        db.session.commit()
+        last_id = rows[-1][0]
+        migrated += len(rows)
+        if progress:
+            progress(migrated)
+    return migrated
+
+
+def storage_report():
+    """Bytes de texto de hw_id / user agent / device_info: inline frente a codificado"""
+    def scalar(stmt):
+        return db.session.execute(stmt).scalar() or 0
+
+    length = lambda col: func.coalesce(func.length(col), 0)
+    logs = scalar(select(func.count(ActivityLog.id)))
+    encoded = scalar(select(func.count(ActivityLog.id))
+                     .where(or_(ActivityLog.device_id.isnot(None), ActivityLog.user_agent_id.isnot(None))))
+    legacy_bytes = scalar(select(func.sum(length(ActivityLog.legacy_hw_id) +
+                                          length(ActivityLog.legacy_user_agent) +
+                                          length(ActivityLog.legacy_device_info))))
+    device_refs = scalar(select(func.sum(length(Device.hw_id)))
+                         .select_from(ActivityLog).join(Device, Device.id == ActivityLog.device_id))
+    agent_refs = scalar(select(func.sum(length(UserAgent.user_agent) + length(UserAgent.device_info)))
+                        .select_from(ActivityLog).join(UserAgent, UserAgent.id == ActivityLog.user_agent_id))
+    dim_bytes = scalar(select(func.sum(length(Device.hw_id)))) + \
+        scalar(select(func.sum(length(UserAgent.user_agent) + length(UserAgent.device_info))))
+
+    inline = legacy_bytes + device_refs + agent_refs
+    stored = legacy_bytes + dim_bytes + encoded * 8    # dos ids de 4 bytes por log
+    return {
+        "logs":         logs,
+        "encoded_logs": encoded,
+        "legacy_logs":  logs - encoded,
+        "devices":      scalar(select(func.count(Device.id))),
+        "user_agents":  scalar(select(func.count(UserAgent.id))),
+        "inline_bytes": inline,
+        "stored_bytes": stored,
+        "saved_bytes":  inline - stored,
+        "saved_pct":    round(100.0 * (inline - stored) / inline, 1) if inline else 0.0,
+    }
@@ -0,0 +1,364 @@
+"""
+events.py - Bus de eventos de licencias entre workers
+
+Toda mutación de una licencia escribe un LicenseEvent en la misma transacción
+(publish). El id autoincremental de la tabla actúa como versión monótona de
+cambios: cada worker mantiene un único hilo (EventHub) que lee los eventos
+posteriores a la última versión vista y los reparte a:
+
+  • las conexiones abiertas en /api/events que esperan por esa clave
+  • los listeners registrados con hub.add_listener (invalidación de cachés)
+
+Los cambios que afectan a muchas licencias a la vez (importaciones,
+operaciones masivas de más de EVENTS_BULK_THRESHOLD claves) publican un único
+evento con la clave "*". Los eventos terminales (p. ej. una revocación masiva)
+se publican siempre clave a clave: los bots conectados esperan el suyo. Las claves
+que empiezan por "@" son mensajes de control entre workers (p. ej. activar
+el profiler) y solo llegan a los listeners registrados con control=True.
+
+En PostgreSQL además se emite NOTIFY y el hilo escucha con LISTEN, de modo
+que el sondeo solo es el mecanismo de respaldo. El worker que publica recibe
+sus propios eventos justo después del commit, sin esperar al sondeo.
+"""
+
+import select
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from flask import g
+from sqlalchemy import event as sa_event, func, insert, text
+from sqlalchemy.orm import Session
+from config import Config
+from models import db, LicenseEvent
+import database
+import metrics
+
+# Eventos tras los cuales el bot debe cerrar la sesión
+TERMINAL_EVENTS = ("REVOKED", "RESET", "DELETED")
+
+NOTIFY_CHANNEL = "license_events"
+
+# Prefijo de las claves de control (no son licencias)
+CONTROL_PREFIX = "@"
+
+
+def publish(key, kind, detail=""):
+    """Añade un evento a la sesión actual (se confirma con el commit del llamador)"""
+    db.session.add(LicenseEvent(key=key, kind=kind, detail=detail))
+    if db.session.get_bind().dialect.name == "postgresql":
+        db.session.execute(text(f"NOTIFY {NOTIFY_CHANNEL}"))
+
+
+def publish_many(keys, kind, detail=""):
+    """Publica el mismo evento para muchas claves (o un único "*" si son demasiadas)"""
+    if not keys:
+        return
+    if len(keys) > Config.EVENTS_BULK_THRESHOLD and kind not in TERMINAL_EVENTS:
+        publish("*", kind, f"{detail} ({len(keys)} licencias)"[:200])
+        return
+    db.session.execute(insert(LicenseEvent),
+                       [{"key": k, "kind": kind, "detail": detail} for k in keys])
+    if db.session.get_bind().dialect.name == "postgresql":
+        db.session.execute(text(f"NOTIFY {NOTIFY_CHANNEL}"))
+
+
+def _as_dict(ev):
+    return {
+        "id":     ev.id,
+        "key":    ev.key,
+        "kind":   ev.kind,
+        "detail": ev.detail or "",
+        "at":     (ev.created_at or datetime.utcnow()).isoformat(),
+    }
+
+
+class Subscription:
+    """Buzón de eventos de una conexión abierta"""
+
+    def __init__(self, key):
+        self.key = key
+        self.events = deque()
+        self.ready = threading.Event()
+
+    def push(self, event):
+        self.events.append(event)
+        self.ready.set()
+
+    def wait(self, timeout):
+        """Espera hasta `timeout` segundos y devuelve los eventos pendientes"""
+        self.ready.wait(timeout)
+        self.ready.clear()
+        pending = []
+        while self.events:
+            pending.append(self.events.popleft())
+        return pending
+
+
+class EventHub:
+    """Lector de eventos por worker con límite de conexiones"""
+
+    # Ids re-leídos en cada sondeo por si un commit llega fuera de orden
+    OVERLAP = 100
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs = {}
+        self._listeners = []
+        self._connections = 0
+        self._thread = None
+        self._app = None
+        self._ready = threading.Event()
+        self._last_id = 0
+        self._instance = None
+        self._seen = deque(maxlen=self.OVERLAP * 10)
+        self._seen_ids = set()
+        self._stats = {"delivered": 0, "polls": 0, "notifies": 0,
+                       "lag_last": 0.0, "lag_max": 0.0, "lag_avg": 0.0,
+                       "last_poll_at": None}
+        metrics.register("event_bus", self.stats)
+
+    # ── Conexiones ──────────────────────────────────────────────
+
+    def acquire(self):
+        """Reserva un hueco de conexión; False si el worker está lleno"""
+        with self._lock:
+            if self._connections >= Config.EVENTS_MAX_CONNECTIONS:
+                return False
+            self._connections += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._connections = max(0, self._connections - 1)
+
+    @property
+    def connections(self):
+        return self._connections
+
+    # ── Suscripciones ───────────────────────────────────────────
+
+    def add_listener(self, callback, control=False, baseline=False):
+        """Registra `callback(event)` para los eventos de licencias (o los de control)
+
+        Con baseline=True también recibe, al arrancar el lector, los eventos
+        recientes que ya existían (los demás listeners los dan por aplicados).
+        """
+        self._listeners.append((callback, control, baseline))
+
+    def subscribe(self, app, key):
+        """Registra un buzón para `key`; espera a que el lector tenga línea base"""
+        self.start(app)
+        self._ready.wait(5)
+        sub = Subscription(key)
+        with self._lock:
+            self._subs.setdefault(key, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subs.get(sub.key)
+            if subs:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.key]
+
+    def deliver(self, event):
+        """Entrega un evento una sola vez a buzones y listeners de este worker"""
+        with self._lock:
+            if event["id"] in self._seen_ids:
+                return
+            self._remember(event["id"])
+            subs = list(self._subs.get(event["key"], ()))
+
+        for sub in subs:
+            sub.push(event)
+        control = event["key"].startswith(CONTROL_PREFIX)
+        for callback, wants_control, _ in self._listeners:
+            if wants_control != control:
+                continue
+            self._call(callback, event)
+
+        lag = max(0.0, (datetime.utcnow() - datetime.fromisoformat(event["at"])).total_seconds())
+        s = self._stats
+        s["delivered"] += 1
+        s["lag_last"] = lag
+        s["lag_max"] = max(s["lag_max"], lag)
+        s["lag_avg"] = lag if s["delivered"] == 1 else s["lag_avg"] * 0.9 + lag * 0.1
+
+    def _call(self, callback, event):
+        try:
+            callback(event)
+        except Exception:
+            if self._app:
+                self._app.logger.exception("Error en listener del bus de eventos")
+
+    def _remember(self, event_id):
+        if len(self._seen) == self._seen.maxlen:
+            self._seen_ids.discard(self._seen[0])
+        self._seen.append(event_id)
+        self._seen_ids.add(event_id)
+
+    @property
+    def version(self):
+        """Último id de evento leído de la BD, o None si aún no hay línea base"""
+        return self._last_id if self._ready.is_set() else None
+
+    @property
+    def instance(self):
+        """Identidad de la BD de la que salen los eventos (database.instance_id)"""
+        return self._instance
+
+    def stats(self):
+        data = dict(self._stats)
+        data.update({"version": self._last_id, "connections": self._connections,
+                     "listeners": len(self._listeners), "running": self._thread is not None})
+        return data
+
+    # ── Hilo lector ─────────────────────────────────────────────
+
+    def start(self, app):
+        """Arranca el hilo lector del worker (idempotente)"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._app = app
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name="license-events")
+            self._thread.start()
+
+    def _baseline(self):
+        # Los eventos anteriores al arranque ya están reflejados en la BD, salvo
+        # para los listeners con baseline=True (p. ej. la instantánea, que puede
+        # ser más antigua que ellos)
+        self._instance = database.instance_id()
+        recent = LicenseEvent.query.order_by(LicenseEvent.id.desc())\
+                                   .limit(self.OVERLAP).all()
+        with self._lock:
+            for ev in recent:
+                self._remember(ev.id)
+        for ev in reversed(recent):
+            if ev.key.startswith(CONTROL_PREFIX):
+                continue
+            for callback, _, baseline in self._listeners:
+                if baseline:
+                    self._call(callback, _as_dict(ev))
+        self._last_id = recent[0].id if recent else 0
+        self._ready.set()
+
+    def _run(self):
+        last_prune = 0.0
+        listener = None
+        while True:
+            try:
+                with self._app.app_context():
+                    g.read_only = True
+                    if not self._ready.is_set():
+                        self._baseline()
+                    self._poll()
+                    if time.time() - last_prune > 3600:
+                        self._prune()
+                        last_prune = time.time()
+                    if listener is None:
+                        listener = self._listen()
+            except Exception:
+                # La BD puede no estar disponible un momento; se reintenta
+                self._app.logger.exception("Error leyendo eventos de licencias")
+                listener = self._close(listener)
+            listener = self._wait(listener)
+
+    def _listen(self):
+        """Abre una conexión LISTEN dedicada si el motor es PostgreSQL"""
+        if db.engine.dialect.name != "postgresql":
+            return False
+        conn = db.engine.raw_connection()
+        conn.driver_connection.autocommit = True
+        conn.cursor().execute(f"LISTEN {NOTIFY_CHANNEL}")
+        return conn
+
+    def _wait(self, listener):
+        """Duerme hasta el próximo sondeo o hasta un NOTIFY"""
+        if not listener:
+            time.sleep(Config.EVENTS_POLL_INTERVAL)
+            return listener
+        raw = listener.driver_connection
+        try:
+            if select.select([raw], [], [], Config.EVENTS_POLL_INTERVAL) != ([], [], []):
+                raw.poll()
+                if raw.notifies:
+                    self._stats["notifies"] += len(raw.notifies)
+                    raw.notifies.clear()
+            return listener
+        except Exception:
+            return self._close(listener)
+
+    def _close(self, listener):
+        if listener:
+            try:
+                listener.close()
+            except Exception:
+                pass
+        return None
+
+    def _poll(self):
+        if database.instance_id() != self._instance:
+            # BD sustituida: sus ids no siguen a los ya vistos
+            return self._rebaseline()
+        rows = LicenseEvent.query.filter(LicenseEvent.id > self._last_id - self.OVERLAP)\
+                                 .order_by(LicenseEvent.id)\
+                                 .limit(1000).all()
+        latest = rows[-1].id if rows else db.session.query(func.max(LicenseEvent.id)).scalar()
+        if latest is not None and latest < self._last_id:
+            # Misma identidad con menos eventos: BD restaurada. Identidad nueva
+            # para que ningún worker decida con la instantánea de antes
+            db.session.rollback()
+            g.read_only = False
+            database.rotate_instance_id(self._instance)
+            return self._rebaseline()
+        self._stats["polls"] += 1
+        self._stats["last_poll_at"] = datetime.utcnow().isoformat()
+        for ev in rows:
+            self._last_id = max(self._last_id, ev.id)
+            self.deliver(_as_dict(ev))
+
+    def _rebaseline(self):
+        with self._lock:
+            self._seen.clear()
+            self._seen_ids.clear()
+        self._baseline()
+
+    def _prune(self):
+        # Transacción nueva que empieza escribiendo (BEGIN IMMEDIATE en SQLite)
+        db.session.rollback()
+        g.read_only = False
+        cutoff = datetime.utcnow() - timedelta(hours=Config.EVENTS_RETENTION_HOURS)
+        LicenseEvent.query.filter(LicenseEvent.created_at < cutoff).delete()
+        db.session.commit()
+
+
+hub = EventHub()
+
+
+# ── Entrega local inmediata ─────────────────────────────────────
+# El worker que publica no espera al sondeo: tras el commit reparte sus
+# propios eventos (el hilo lector los ignorará al verlos ya entregados).
+
+@sa_event.listens_for(Session, "after_flush")
+def _collect_published(session, flush_context):
+    pending = session.info.setdefault("published_events", [])
+    for obj in session.new:
+        if isinstance(obj, LicenseEvent):
+            pending.append(_as_dict(obj))
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _deliver_published(session):
+    for ev in session.info.pop("published_events", []):
+        hub.deliver(ev)
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _discard_published(session):
+    session.info.pop("published_events", None)
@@ -0,0 +1,120 @@
+"""
+exporter.py - Exportación en streaming de ActivityLog (CSV / NDJSON)
+
+Las filas se leen por bloques (yield_per + stream_results: cursor de servidor
+en PostgreSQL) y se serializan según llegan, así que la memoria usada no
+depende del rango exportado.
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+from sqlalchemy import select, func, or_
+from models import db, License, ActivityLog, Device, UserAgent
+
+FIELDS = ["id", "timestamp", "license_key", "status", "error_detail", "hw_id",
+          "ip_address", "device_info", "user_agent", "app_version"]
+
+FORMATS = ("csv", "ndjson")
+
+CHUNK_SIZE = 2000
+
+
+def parse_filters(args):
+    """Convierte parámetros (query string o CLI) en filtros; ValueError si son inválidos"""
+    filters = {}
+    for name in ("from", "to"):
+        if args.get(name):
+            try:
+                filters[name] = datetime.fromisoformat(args[name])
+            except ValueError:
+                raise ValueError(f"Fecha inválida en '{name}': {args[name]}")
+    for name in ("key", "status"):
+        if args.get(name):
+            filters[name] = args[name].strip().upper()
+    for name in ("ip", "hw_id"):
+        if args.get(name):
+            filters[name] = args[name].strip()
+    return filters
+
+
+def build_query(filters):
+    """SELECT de logs con la clave de su licencia y sus dimensiones, ordenado por id"""
+    stmt = select(
+        ActivityLog.id, ActivityLog.timestamp, License.key, ActivityLog.status,
+        ActivityLog.error_detail,
+        func.coalesce(Device.hw_id, ActivityLog.legacy_hw_id, ""),
+        ActivityLog.ip_address,
+        func.coalesce(UserAgent.device_info, ActivityLog.legacy_device_info, ""),
+        func.coalesce(UserAgent.user_agent, ActivityLog.legacy_user_agent, ""),
+        ActivityLog.app_version,
+    ).outerjoin(License, License.id == ActivityLog.license_id)\
+     .outerjoin(Device, Device.id == ActivityLog.device_id)\
+     .outerjoin(UserAgent, UserAgent.id == ActivityLog.user_agent_id)
+
+    if "from" in filters:
+        stmt = stmt.where(ActivityLog.timestamp >= filters["from"])
+    if "to" in filters:
+        stmt = stmt.where(ActivityLog.timestamp < filters["to"])
+    if "key" in filters:
+        stmt = stmt.where(License.key == filters["key"])
+    if "status" in filters:
+        stmt = stmt.where(ActivityLog.status == filters["status"])
+    if "ip" in filters:
+        stmt = stmt.where(ActivityLog.ip_address == filters["ip"])
+    if "hw_id" in filters:
+        device = select(Device.id).where(Device.hw_id == filters["hw_id"]).scalar_subquery()
+        stmt = stmt.where(or_(ActivityLog.device_id == device,
+                              ActivityLog.legacy_hw_id == filters["hw_id"]))
+    return stmt.order_by(ActivityLog.id)
+
+
+def iter_rows(filters, chunk_size=CHUNK_SIZE):
+    """Recorre los logs filtrados por bloques de `chunk_size` filas"""
+    stmt = build_query(filters).execution_options(yield_per=chunk_size, stream_results=True)
+    for partition in db.session.execute(stmt).partitions():
+        yield partition
+
+
+def _csv_chunks(partitions):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(FIELDS)
+    for rows in partitions:
+        for row in rows:
+            writer.writerow([row[1].isoformat() if i == 1 and row[1] else v
+                             for i, v in enumerate(row)])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+
+def _ndjson_chunks(partitions):
+    for rows in partitions:
+        lines = []
+        for row in rows:
+            record = dict(zip(FIELDS, row))
+            record["timestamp"] = record["timestamp"].isoformat() if record["timestamp"] else None
+            lines.append(json.dumps(record, ensure_ascii=False))
+        yield "\n".join(lines) + "\n"
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)   # 31 = cabecera gzip
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_export(filters, fmt="csv", compress=False, chunk_size=CHUNK_SIZE):
+    """Generador de bytes con la exportación completa"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato desconocido: {fmt}")
+    serializer = _csv_chunks if fmt == "csv" else _ndjson_chunks
+    chunks = (c.encode("utf-8") for c in serializer(iter_rows(filters, chunk_size)) if c)
+    return _gzip(chunks) if compress else chunks
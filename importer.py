@@ -0,0 +1,219 @@
+"""
+importer.py - Importación masiva de licencias desde CSV / NDJSON
+
+Las filas se validan según se leen y se escriben en lotes dentro de una
+única transacción:
+
+  • PostgreSQL: COPY ... FROM STDIN por lote
+  • SQLite (y resto): executemany de un INSERT por lote
+
+Cada lote va en un SAVEPOINT; si falla (p. ej. una clave insertada a la vez
+por otra petición) se reintenta fila a fila para aislar las filas culpables
+sin abortar el resto de la importación.
+"""
+
+import csv
+import io
+import json
+import re
+from datetime import datetime
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from models import db, License
+from utils import make_expiry
+from events import publish
+import stats
+
+FORMATS = ("csv", "ndjson")
+
+BATCH_SIZE = 1000
+
+# Errores devueltos en el informe (el total se cuenta siempre)
+MAX_REPORTED_ERRORS = 1000
+
+COLUMNS = ["key", "plan", "user", "hw_id", "expires_at", "revoked",
+           "created_at", "updated_at", "activations", "device_info", "ip_address"]
+
+_KEY_RE = re.compile(r"^[A-Z0-9-]{4,32}$")
+_TRUE = ("1", "true", "yes", "si", "sí", "y", "t")
+
+
+class ImportResult:
+    """Informe de una importación"""
+
+    def __init__(self):
+        self.total = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def fail(self, line, key, error):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "key": key, "error": str(error)})
+
+    def to_dict(self):
+        return {"total": self.total, "imported": self.imported,
+                "failed": self.failed, "errors": self.errors}
+
+
+def read_rows(stream, fmt):
+    """Genera (línea, dict) desde un stream binario; el dict puede ser una excepción"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato desconocido: {fmt}")
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line, raw in enumerate(text, 1):
+        if not raw.strip():
+            continue
+        try:
+            row = json.loads(raw)
+            if not isinstance(row, dict):
+                raise ValueError("se esperaba un objeto JSON")
+            yield line, row
+        except ValueError as e:
+            yield line, ValueError(f"JSON inválido: {e}")
+
+
+def validate_row(raw, now):
+    """Normaliza una fila de entrada; ValueError con el motivo si no es válida"""
+    key = str(raw.get("key") or "").strip().upper()
+    if not _KEY_RE.match(key):
+        raise ValueError("Clave vacía o con formato inválido")
+
+    plan = str(raw.get("plan") or "").strip().lower()
+    if plan not in ("monthly", "yearly", "lifetime"):
+        raise ValueError(f"Plan inválido: {plan!r}")
+
+    user = str(raw.get("user") or "").strip()
+    hw_id = str(raw.get("hw_id") or "").strip()
+    if len(user) > 100:
+        raise ValueError("Usuario demasiado largo (máx. 100)")
+    if len(hw_id) > 64:
+        raise ValueError("hw_id demasiado largo (máx. 64)")
+
+    expires = raw.get("expires_at")
+    if expires in (None, "", "lifetime"):
+        expires_at = None if plan == "lifetime" or expires == "lifetime" else make_expiry(plan)
+    else:
+        try:
+            expires_at = datetime.fromisoformat(str(expires).strip())
+        except ValueError:
+            raise ValueError(f"Fecha de expiración inválida: {expires!r}")
+
+    revoked = raw.get("revoked")
+    if not isinstance(revoked, bool):
+        revoked = str(revoked or "").strip().lower() in _TRUE
+
+    return {
+        "key": key, "plan": plan, "user": user, "hw_id": hw_id,
+        "expires_at": expires_at, "revoked": revoked,
+        "created_at": now, "updated_at": now, "activations": 0,
+        "device_info": "", "ip_address": "",
+    }
+
+
+# ── Escritura por lotes ─────────────────────────────────────────
+
+def _copy_rows(rows):
+    """COPY FROM STDIN en la conexión de la sesión (PostgreSQL)"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([
+            "" if row[c] is None else
+            ("t" if row[c] else "f") if isinstance(row[c], bool) else
+            row[c].isoformat() if isinstance(row[c], datetime) else row[c]
+            for c in COLUMNS
+        ])
+    buf.seek(0)
+    conn = db.session.connection()
+    statement = f"COPY license ({', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    with conn.connection.driver_connection.cursor() as cur:
+        try:
+            cur.copy_expert(statement, buf)
+        except conn.dialect.dbapi.IntegrityError as e:
+            # El cursor crudo no pasa por SQLAlchemy: mismo tipo que el INSERT
+            # para que _flush caiga al fila a fila
+            raise IntegrityError(statement, None, e) from e
+
+
+def _write(rows):
+    if db.session.get_bind().dialect.name == "postgresql":
+        _copy_rows(rows)
+    else:
+        db.session.execute(insert(License.__table__), rows)
+
+
+def _flush(batch, result):
+    """Escribe un lote; las claves ya existentes o conflictivas se reportan"""
+    keys = [row["key"] for _, row in batch]
+    existing = {k for (k,) in db.session.query(License.key).filter(License.key.in_(keys))}
+
+    pending = []
+    for line, row in batch:
+        if row["key"] in existing:
+            result.fail(line, row["key"], "La clave ya existe")
+        else:
+            pending.append((line, row))
+    if not pending:
+        return
+
+    try:
+        with db.session.begin_nested():
+            _write([row for _, row in pending])
+        result.imported += len(pending)
+        return
+    except IntegrityError:
+        pass
+
+    # El lote falló entero: fila a fila para aislar los conflictos
+    for line, row in pending:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(License.__table__), [row])
+            result.imported += 1
+        except IntegrityError:
+            result.fail(line, row["key"], "La clave ya existe")
+
+
+def import_licenses(stream, fmt, batch_size=BATCH_SIZE):
+    """Importa licencias en una transacción y devuelve un ImportResult"""
+    result = ImportResult()
+    now = datetime.utcnow()
+    batch, batch_keys = [], set()
+
+    for line, raw in read_rows(stream, fmt):
+        result.total += 1
+        key = raw.get("key", "") if isinstance(raw, dict) else ""
+        try:
+            if isinstance(raw, Exception):
+                raise raw
+            row = validate_row(raw, now)
+            if row["key"] in batch_keys:
+                raise ValueError("Clave duplicada en el fichero")
+        except ValueError as e:
+            result.fail(line, key, e)
+            continue
+
+        batch.append((line, row))
+        batch_keys.add(row["key"])
+        if len(batch) >= batch_size:
+            _flush(batch, result)
+            batch, batch_keys = [], set()
+
+    if batch:
+        _flush(batch, result)
+
+    if result.imported:
+        # Escritura sin ORM: contadores a reconstruir y aviso global por el bus
+        stats.invalidate()
+        publish("*", "IMPORTED", f"{result.imported} licencias")
+    db.session.commit()
+    return result
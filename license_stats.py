@@ -0,0 +1,225 @@
+"""
+license_stats.py - Estadísticas de vida por licencia mantenidas al registrar logs
+
+  • Contadores por estado en LicenseStats.
+  • IPs distintas en un sketch HyperLogLog por licencia (los dispositivos
+    distintos ya son exactos: una fila de DeviceHistory por dispositivo), más
+    dos sketches globales (StatSketch "ips" / "devices") para la flota.
+
+Nada de esto se escribe al validar: record() lo anota en memoria y
+write_behind.py lo vuelca cada pocos segundos con un UPSERT agrupado de
+contadores y una lectura-fusión-escritura de los sketches que han cambiado,
+con las filas bloqueadas (SELECT ... FOR UPDATE; en SQLite la transacción ya
+empieza con BEGIN IMMEDIATE) para que dos workers no se pisen.
+
+Cada worker guarda además la copia de los sketches que leyó en el último
+volcado. Esa copia es un límite inferior de la de la BD, así que si añadir
+un valor no la cambia tampoco cambiaría la de la BD y ni se anota.
+"""
+
+import threading
+from collections import OrderedDict
+from sqlalchemy import select, update, bindparam, event as sa_event
+from sqlalchemy.orm import Session
+from models import db, LicenseStats, StatSketch
+from database import dialect_insert
+from hll import HyperLogLog
+import write_behind
+
+STATUS_COLUMNS = {
+    "SUCCESS":      "success",
+    "REVOKED":      "revoked",
+    "EXPIRED":      "expired",
+    "WRONG_DEVICE": "wrong_device",
+}
+COUNTERS = ("total", *STATUS_COLUMNS.values())
+GLOBALS = ("ips", "devices")
+
+CACHE_SIZE = 2000
+
+_lock = threading.Lock()
+_cache = OrderedDict()      # license_id -> sketch de IPs leído en el último volcado
+_globals = {}               # "ips" / "devices" -> sketch leído en el último volcado
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _reset_cache(session):
+    # Lo añadido a la copia en una transacción revertida no llegará a la BD
+    with _lock:
+        _cache.clear()
+        _globals.clear()
+
+
+def _combine(current, new):
+    """Fusiona dos pendientes de una licencia: contadores sumados, IPs unidas"""
+    for column, n in new["counters"].items():
+        current["counters"][column] = current["counters"].get(column, 0) + n
+    current["ips"] |= new["ips"]
+    return current
+
+
+def _known(sketch, value):
+    """True si el valor ya está en la copia local (y entonces en la BD)"""
+    return sketch is not None and not sketch.add(value)
+
+
+def record(license_id, status, ip, hw_id, new_device=False):
+    """Anota contadores y valores únicos de un log recién creado"""
+    fleet = {"ips": ip, "devices": hw_id if new_device or not license_id else ""}
+    with _lock:
+        for name, value in fleet.items():
+            if value and not _known(_globals.get(name), value):
+                _fleet.add(name, {value})
+        if not license_id:
+            # Claves inexistentes: solo cuentan para los únicos de la flota
+            return
+        sketch = _cache.get(license_id)
+        if sketch is not None:
+            _cache.move_to_end(license_id)
+        ips = {ip} if ip and not _known(sketch, ip) else set()
+
+    counters = {"total": 1}
+    if status in STATUS_COLUMNS:
+        counters[STATUS_COLUMNS[status]] = 1
+    _licenses.add(license_id, {"counters": counters, "ips": ips})
+
+
+def _flush_licenses(items):
+    """UPSERT agrupado de contadores y fusión de los sketches de IPs que cambian"""
+    existing = write_behind.existing_licenses(items)
+    items = {i: v for i, v in items.items() if i in existing}
+    if not items:
+        return
+    table = LicenseStats.__table__
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["license_id"],
+        set_={c: table.c[c] + stmt.excluded[c] for c in COUNTERS},
+    )
+    db.session.execute(stmt, [{"license_id": license_id,
+                               **{c: item["counters"].get(c, 0) for c in COUNTERS}}
+                              for license_id, item in items.items()])
+
+    with_ips = [license_id for license_id, item in items.items() if item["ips"]]
+    if not with_ips:
+        return
+    stored = dict(db.session.execute(
+        select(table.c.license_id, table.c.ip_sketch)
+        .where(table.c.license_id.in_(with_ips))
+        .with_for_update()
+    ).all())
+    changed = []
+    for license_id in with_ips:
+        sketch = HyperLogLog(stored.get(license_id))
+        if any([sketch.add(ip) for ip in items[license_id]["ips"]]):
+            changed.append({"b_id": license_id, "b_sketch": sketch.to_bytes()})
+        with _lock:
+            _cache[license_id] = sketch
+            _cache.move_to_end(license_id)
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    if changed:
+        db.session.execute(update(table).where(table.c.license_id == bindparam("b_id"))
+                                        .values(ip_sketch=bindparam("b_sketch")), changed)
+
+
+def _flush_fleet(items):
+    """Lee-fusiona-escribe cada sketch global con la fila bloqueada"""
+    for name, values in items.items():
+        locked = select(StatSketch.data).where(StatSketch.name == name).with_for_update()
+        row = db.session.execute(locked).first()
+        if row is None:
+            # Primera escritura: se crea la fila vacía para poder bloquearla
+            stmt = dialect_insert(StatSketch.__table__).values(name=name, data=HyperLogLog().to_bytes())
+            db.session.execute(stmt.on_conflict_do_nothing(index_elements=["name"]))
+            row = db.session.execute(locked).first()
+        sketch = HyperLogLog(row[0])
+        if any([sketch.add(value) for value in values]):
+            db.session.execute(update(StatSketch.__table__).where(StatSketch.name == name)
+                                                           .values(data=sketch.to_bytes()))
+        with _lock:
+            _globals[name] = sketch
+
+
+_licenses = write_behind.register("license_stats", _combine, _flush_licenses)
+_fleet = write_behind.register("fleet_sketches", lambda current, new: current | new, _flush_fleet)
+
+
+# ── Lectura ─────────────────────────────────────────────────────
+
+def license_statistics(lic):
+    """Estadísticas de vida de una licencia (O(1))"""
+    row = lic.stats
+    if not row:
+        return {"total_attempts": 0, "successful": 0, "failed": 0, "unique_ips": 0,
+                "by_status": {}}
+    return {
+        "total_attempts": row.total,
+        "successful":     row.success,
+        "failed":         row.total - row.success,
+        "unique_ips":     HyperLogLog(row.ip_sketch).count(),
+        "by_status":      {status: getattr(row, col) for status, col in STATUS_COLUMNS.items()},
+    }
+
+
+def fleet_uniques():
+    """IPs y dispositivos distintos vistos en toda la flota"""
+    rows = dict(db.session.query(StatSketch.name, StatSketch.data).all())
+    return {name: HyperLogLog(rows.get(name)).count() for name in GLOBALS}
+
+
+# ── Reconstrucción ──────────────────────────────────────────────
+
+def rebuild(chunk_size=5000):
+    """Recalcula todo desde ActivityLog, licencia a licencia (memoria constante)"""
+    from sqlalchemy import func
+    from models import ActivityLog, Device
+
+    LicenseStats.query.delete()
+    StatSketch.query.delete()
+    fleet = {name: HyperLogLog() for name in GLOBALS}
+    current, acc = None, None
+
+    def flush():
+        if current:
+            db.session.add(LicenseStats(
+                license_id=current, **acc["counters"],
+                ip_sketch=acc["ip_sketch"].to_bytes()))
+            if len(db.session.new) >= 500:
+                db.session.flush()
+                db.session.expunge_all()
+
+    stmt = select(ActivityLog.license_id, ActivityLog.status, ActivityLog.ip_address,
+                  func.coalesce(Device.hw_id, ActivityLog.legacy_hw_id))\
+        .outerjoin(Device, Device.id == ActivityLog.device_id)\
+        .order_by(ActivityLog.license_id)\
+        .execution_options(yield_per=chunk_size, stream_results=True)
+    processed = 0
+    for license_id, status, ip, hw_id in db.session.execute(stmt):
+        if license_id != current:
+            flush()
+            current = license_id
+            acc = {"counters": {"total": 0, **{c: 0 for c in STATUS_COLUMNS.values()}},
+                   "ip_sketch": HyperLogLog()}
+        processed += 1
+        if ip:
+            fleet["ips"].add(ip)
+        if hw_id:
+            fleet["devices"].add(hw_id)
+        if not license_id:
+            continue
+        acc["counters"]["total"] += 1
+        if status in STATUS_COLUMNS:
+            acc["counters"][STATUS_COLUMNS[status]] += 1
+        if ip:
+            acc["ip_sketch"].add(ip)
+    flush()
+
+    db.session.add_all(StatSketch(name=n, data=s.to_bytes()) for n, s in fleet.items())
+    db.session.commit()
+    with _lock:
+        _cache.clear()
+        _globals.clear()
+    _licenses.clear()
+    _fleet.clear()
+    return processed
@@ -0,0 +1,40 @@
+"""
+metrics.py - Métricas en memoria del worker (contadores y gauges)
+
+Cada worker de gunicorn tiene sus propias métricas; /api/admin/metrics
+devuelve las del worker que atiende la petición junto con su pid.
+"""
+
+import os
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_providers = {}
+
+
+def incr(name, amount=1):
+    """Incrementa un contador"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def set_gauge(name, value):
+    """Fija el valor actual de un gauge"""
+    with _lock:
+        _gauges[name] = value
+
+
+def register(name, provider):
+    """Registra una función que devuelve un dict de métricas calculadas al vuelo"""
+    _providers[name] = provider
+
+
+def snapshot():
+    """Devuelve todas las métricas del worker actual"""
+    with _lock:
+        data = {"pid": os.getpid(), "counters": dict(_counters), "gauges": dict(_gauges)}
+    for name, provider in _providers.items():
+        data[name] = provider()
+    return data
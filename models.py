@@ -4,19 +4,24 @@ models.py - Modelos de base de datos SQLAlchemy
 
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from replica import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 class License(db.Model):
     """Modelo principal de licencias"""
+    # SQLite: sin AUTOINCREMENT reutiliza el id más alto borrado, y los
+    # license_id que aún circulan (instantánea, cachés) apuntarían a otra licencia
+    __table_args__ = {"sqlite_autoincrement": True}
+
     id          = db.Column(db.Integer, primary_key=True)
     key         = db.Column(db.String(32), unique=True, nullable=False, index=True)
     plan        = db.Column(db.String(20), nullable=False)
     user        = db.Column(db.String(100), default="")
-    hw_id       = db.Column(db.String(64), default="")
+    hw_id       = db.Column(db.String(64), default="", index=True)
     created_at  = db.Column(db.DateTime, default=datetime.utcnow)
-    expires_at  = db.Column(db.DateTime, nullable=True)
+    expires_at  = db.Column(db.DateTime, nullable=True, index=True)
     revoked     = db.Column(db.Boolean, default=False)
     last_seen   = db.Column(db.DateTime, nullable=True)
     activations = db.Column(db.Integer, default=0)
@@ -24,13 +29,22 @@ class License(db.Model):
     # Campos de tracking
     first_activation = db.Column(db.DateTime, nullable=True)
     device_info      = db.Column(db.String(200), default="")
-    ip_address       = db.Column(db.String(45), default="")
+    ip_address       = db.Column(db.String(45), default="", index=True)
+    
+    # Última modificación de la fila o de su presencia (delta-sync del panel)
+    updated_at       = db.Column(db.DateTime, default=datetime.utcnow,
+                                 onupdate=datetime.utcnow, index=True)
     
-    # Relaciones
-    activity_logs = db.relationship('ActivityLog', backref='license', lazy='dynamic', 
-                                    cascade='all, delete-orphan')
+    # Relaciones: el borrado en cascada lo hace la BD (ON DELETE CASCADE),
+    # el ORM no carga los hijos para borrarlos uno a uno
+    activity_logs = db.relationship('ActivityLog', backref='license', lazy='dynamic',
+                                    cascade='all, delete-orphan', passive_deletes=True)
     devices = db.relationship('DeviceHistory', backref='license', lazy='dynamic',
-                             cascade='all, delete-orphan')
+                             cascade='all, delete-orphan', passive_deletes=True)
+    stats = db.relationship('LicenseStats', uselist=False,
+                            cascade='all, delete-orphan', passive_deletes=True)
+    flags = db.relationship('SuspiciousFlag', backref='license', lazy='dynamic',
+                            cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f"<License {self.key} - {self.plan}>"
@@ -39,14 +53,20 @@ class License(db.Model):
 class ActivityLog(db.Model):
     """Registro detallado de cada validación/intento de acceso"""
     id           = db.Column(db.Integer, primary_key=True)
-    license_id   = db.Column(db.Integer, db.ForeignKey('license.id'), nullable=False, index=True)
+    # NULL en los intentos con claves que no existen
+    license_id   = db.Column(db.Integer, db.ForeignKey('license.id', ondelete='CASCADE'),
+                             nullable=True, index=True)
     timestamp    = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
-    # Información del dispositivo
-    hw_id        = db.Column(db.String(64), default="")
-    ip_address   = db.Column(db.String(45), default="")
-    device_info  = db.Column(db.String(200), default="")
-    user_agent   = db.Column(db.String(300), default="")
+    # Información del dispositivo: hw_id y user agent (+ device_info) van en
+    # tablas de dimensión; las columnas legacy_* solo tienen datos en logs
+    # anteriores a la migración (flask --app app migrate-activity-dims)
+    device_id     = db.Column(db.Integer, db.ForeignKey('device.id'), nullable=True, index=True)
+    user_agent_id = db.Column(db.Integer, db.ForeignKey('user_agent.id'), nullable=True)
+    ip_address    = db.Column(db.String(45), default="")
+    legacy_hw_id       = db.Column("hw_id", db.String(64), nullable=True)
+    legacy_device_info = db.Column("device_info", db.String(200), nullable=True)
+    legacy_user_agent  = db.Column("user_agent", db.String(300), nullable=True)
     
     # Resultado de la validación
     status       = db.Column(db.String(20), default="SUCCESS")
@@ -55,15 +75,57 @@ class ActivityLog(db.Model):
     # Metadata adicional
     app_version  = db.Column(db.String(20), default="")
     
+    # Ventanas por licencia (detector de abuso, historial de una licencia)
+    __table_args__ = (db.Index('ix_activity_license_time', 'license_id', 'timestamp'),)
+    
+    device = db.relationship('Device', lazy='joined')
+    agent  = db.relationship('UserAgent', lazy='joined')
+    
+    @property
+    def hw_id(self):
+        return self.device.hw_id if self.device else (self.legacy_hw_id or "")
+    
+    @property
+    def user_agent(self):
+        return self.agent.user_agent if self.agent else (self.legacy_user_agent or "")
+    
+    @property
+    def device_info(self):
+        return self.agent.device_info if self.agent else (self.legacy_device_info or "")
+    
     def __repr__(self):
         return f"<ActivityLog {self.timestamp} - {self.status}>"
 
 
+class Device(db.Model):
+    """Dimensión de ActivityLog: cada hw_id distinto, una sola vez"""
+    id          = db.Column(db.Integer, primary_key=True)
+    hw_id       = db.Column(db.String(64), unique=True, nullable=False)
+
+    def __repr__(self):
+        return f"<Device {self.id} {self.hw_id[:16]}>"
+
+
+class UserAgent(db.Model):
+    """Dimensión de ActivityLog: cada user agent distinto y su device_info ya parseado"""
+    id          = db.Column(db.Integer, primary_key=True)
+    user_agent  = db.Column(db.String(300), unique=True, nullable=False)
+    device_info = db.Column(db.String(200), default="")
+
+    def __repr__(self):
+        return f"<UserAgent {self.id} {self.device_info}>"
+
+
 class DeviceHistory(db.Model):
     """Historial de dispositivos únicos que han usado una licencia"""
+    # Una fila por (licencia, hw_id): log_activity la mantiene con un UPSERT
+    __table_args__ = (db.Index('uq_device_history_license_hw', 'license_id', 'hw_id', unique=True),)
+
     id           = db.Column(db.Integer, primary_key=True)
-    license_id   = db.Column(db.Integer, db.ForeignKey('license.id'), nullable=False, index=True)
-    hw_id        = db.Column(db.String(64), nullable=False)
+    license_id   = db.Column(db.Integer, db.ForeignKey('license.id', ondelete='CASCADE'),
+                             nullable=False, index=True)
+    # Indexado: también es el índice inverso hw_id → licencias
+    hw_id        = db.Column(db.String(64), nullable=False, index=True)
     device_info  = db.Column(db.String(200), default="")
     first_seen   = db.Column(db.DateTime, default=datetime.utcnow)
     last_seen    = db.Column(db.DateTime, default=datetime.utcnow)
@@ -72,4 +134,148 @@ class DeviceHistory(db.Model):
     is_current   = db.Column(db.Boolean, default=False)
     
     def __repr__(self):
-        return f"<DeviceHistory {self.hw_id[:16]}... - {self.total_uses} uses>"
\ No newline at end of file
+        return f"<DeviceHistory {self.hw_id[:16]}... - {self.total_uses} uses>"
+
+
+class LicenseEvent(db.Model):
+    """Eventos de cambio de licencias que se empujan a los bots conectados"""
+    id          = db.Column(db.Integer, primary_key=True)
+    key         = db.Column(db.String(32), nullable=False, index=True)
+    kind        = db.Column(db.String(20), nullable=False)
+    detail      = db.Column(db.String(200), default="")
+    created_at  = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"<LicenseEvent {self.id} {self.kind} {self.key}>"
+
+
+class LicenseIp(db.Model):
+    """Índice inverso IP → licencias, con primera y última vez vista"""
+    __table_args__ = (db.UniqueConstraint('license_id', 'ip', name='uq_license_ip'),)
+
+    id          = db.Column(db.Integer, primary_key=True)
+    license_id  = db.Column(db.Integer, db.ForeignKey('license.id', ondelete='CASCADE'),
+                            nullable=False)
+    ip          = db.Column(db.String(45), nullable=False, index=True)
+    first_seen  = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seen   = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<LicenseIp {self.license_id} {self.ip}>"
+
+
+class StatCounter(db.Model):
+    """Contadores agregados del dashboard mantenidos incrementalmente"""
+    name        = db.Column(db.String(40), primary_key=True)
+    value       = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<StatCounter {self.name}={self.value}>"
+
+
+class PresenceBucket(db.Model):
+    """Número de licencias cuyo last_seen cae en cada intervalo de tiempo"""
+    bucket      = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count       = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<PresenceBucket {self.bucket}={self.count}>"
+
+
+class LicenseStats(db.Model):
+    """Contadores de vida de una licencia y sketch de IPs únicas"""
+    license_id     = db.Column(db.Integer, db.ForeignKey('license.id', ondelete='CASCADE'),
+                               primary_key=True, autoincrement=False)
+    total          = db.Column(db.Integer, default=0, nullable=False)
+    success        = db.Column(db.Integer, default=0, nullable=False)
+    revoked        = db.Column(db.Integer, default=0, nullable=False)
+    expired        = db.Column(db.Integer, default=0, nullable=False)
+    wrong_device   = db.Column(db.Integer, default=0, nullable=False)
+    ip_sketch      = db.Column(db.LargeBinary, nullable=True)
+
+    def __repr__(self):
+        return f"<LicenseStats {self.license_id} - {self.total} intentos>"
+
+
+class StatSketch(db.Model):
+    """Sketches HyperLogLog globales de la flota (ips, devices)"""
+    name        = db.Column(db.String(40), primary_key=True)
+    data        = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f"<StatSketch {self.name}>"
+
+
+class SuspiciousFlag(db.Model):
+    """Marca de abuso de una licencia, mantenida por el detector de abuse.py"""
+    __table_args__ = (db.UniqueConstraint('license_id', 'rule', name='uq_flag_license_rule'),)
+
+    id          = db.Column(db.Integer, primary_key=True)
+    license_id  = db.Column(db.Integer, db.ForeignKey('license.id', ondelete='CASCADE'),
+                            nullable=False, index=True)
+    rule        = db.Column(db.String(20), nullable=False)
+    severity    = db.Column(db.String(10), nullable=False)
+    value       = db.Column(db.Integer, default=0, nullable=False)
+    reason      = db.Column(db.String(200), default="")
+    first_seen  = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seen   = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f"<SuspiciousFlag {self.license_id} {self.rule} {self.severity}>"
+
+
+class ReportRun(db.Model):
+    """Ejecución del generador de informes offline (reports.py)"""
+    id          = db.Column(db.Integer, primary_key=True)
+    status      = db.Column(db.String(10), default="running", nullable=False)
+    started_at  = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # Rango de ids de ActivityLog fijado al empezar: [min_id, max_id]
+    min_id      = db.Column(db.Integer, nullable=False)
+    max_id      = db.Column(db.Integer, nullable=False)
+    chunk_size  = db.Column(db.Integer, nullable=False)
+    error       = db.Column(db.Text, default="")
+
+    chunks = db.relationship('ReportChunk', backref='run', lazy='dynamic',
+                             cascade='all, delete-orphan', passive_deletes=True)
+
+    def __repr__(self):
+        return f"<ReportRun {self.id} {self.status}>"
+
+
+class ReportChunk(db.Model):
+    """Resultado parcial de un bloque de ids ya procesado (permite reanudar)"""
+    __table_args__ = (db.UniqueConstraint('run_id', 'start_id', name='uq_report_chunk'),)
+
+    id          = db.Column(db.Integer, primary_key=True)
+    run_id      = db.Column(db.Integer, db.ForeignKey('report_run.id', ondelete='CASCADE'),
+                            nullable=False)
+    start_id    = db.Column(db.Integer, nullable=False)
+    rows        = db.Column(db.Integer, default=0, nullable=False)
+    data        = db.Column(db.Text, nullable=False)
+
+    def __repr__(self):
+        return f"<ReportChunk {self.run_id}:{self.start_id}>"
+
+
+class ReportResult(db.Model):
+    """Último resultado de cada informe, servido por /api/admin/reports"""
+    name         = db.Column(db.String(40), primary_key=True)
+    run_id       = db.Column(db.Integer, nullable=False)
+    generated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    data         = db.Column(db.Text, nullable=False)
+
+    def __repr__(self):
+        return f"<ReportResult {self.name}>"
+
+
+class SchemaVersion(db.Model):
+    """Versión del esquema aplicada en la BD (una sola fila, id=1)"""
+    id          = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version     = db.Column(db.Integer, nullable=False)
+    applied_at  = db.Column(db.DateTime, default=datetime.utcnow)
+    # Identidad de la BD (ver database.instance_id)
+    instance_id = db.Column(db.String(32), nullable=True)
+
+    def __repr__(self):
+        return f"<SchemaVersion {self.version}>"
@@ -0,0 +1,178 @@
+"""
+profiler.py - Profiling bajo demanda de peticiones concretas
+
+Un admin añade `X-Profile: N` (o `?profile=N`) a una petición autenticada
+y las N siguientes peticiones a ese mismo endpoint (incluida esta) se
+ejecutan bajo cProfile en cada worker. La orden llega a todos los workers
+por el bus de eventos como mensaje de control.
+
+Cada perfil se guarda en PROFILE_DIR como fichero .prof de pstats
+(`python -m pstats`, snakeviz...) y solo se conservan los PROFILE_KEEP más
+recientes. Se listan y descargan desde /api/admin/profiles.
+
+Sin nada armado el coste por petición es comprobar un dict vacío y una
+cabecera; no se instala ningún hook de profiling.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+from flask import g, request
+from config import Config
+from models import db
+from events import hub, publish
+from utils import require_admin
+import metrics
+
+CONTROL_KEY = "@profile"
+
+_lock = threading.Lock()
+_armed = {}     # endpoint -> peticiones que quedan por perfilar en este worker
+
+_NAME = re.compile(r"^[\w.\-]+\.prof$")
+
+
+def arm(endpoint, count):
+    """Perfila las próximas `count` peticiones a `endpoint` en este worker"""
+    with _lock:
+        if count > 0:
+            _armed[endpoint] = min(count, Config.PROFILE_MAX_REQUESTS)
+        else:
+            _armed.pop(endpoint, None)
+
+
+def armed():
+    with _lock:
+        return dict(_armed)
+
+
+def _take(endpoint):
+    """True si a esta petición le toca profiling (descuenta una)"""
+    with _lock:
+        remaining = _armed.get(endpoint)
+        if not remaining:
+            return False
+        if remaining > 1:
+            _armed[endpoint] = remaining - 1
+        else:
+            del _armed[endpoint]
+        return True
+
+
+def _on_control(event):
+    if event["key"] != CONTROL_KEY or event["kind"] != "PROFILE":
+        return
+    endpoint, _, count = event["detail"].rpartition(":")
+    arm(endpoint, int(count or 0))
+
+
+def _requested_count():
+    value = request.headers.get("X-Profile") or request.args.get("profile")
+    if not value:
+        return 0
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+
+def _arm_everywhere(endpoint, count):
+    """Publica la orden para todos los workers (este la recibe tras el commit)"""
+    count = min(count, Config.PROFILE_MAX_REQUESTS)
+    publish(CONTROL_KEY, "PROFILE", f"{endpoint}:{count}")
+    db.session.commit()
+
+
+# ── Ficheros ────────────────────────────────────────────────────
+
+def _directory():
+    os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+    return Config.PROFILE_DIR
+
+
+def _save(profile, endpoint, elapsed):
+    now = time.time()
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"{int(now % 1 * 1000):03d}"
+    name = f"{stamp}_{endpoint}_{os.getpid()}_{int(elapsed * 1000)}ms.prof"
+    profile.dump_stats(os.path.join(_directory(), name))
+    metrics.incr("profiles_written")
+    _rotate()
+
+
+def _rotate():
+    files = sorted(list_profiles(), key=lambda p: p["created"], reverse=True)
+    for old in files[Config.PROFILE_KEEP:]:
+        try:
+            os.remove(os.path.join(Config.PROFILE_DIR, old["name"]))
+        except OSError:
+            pass
+
+
+def list_profiles():
+    """Perfiles guardados (de todos los workers), del más reciente al más antiguo"""
+    if not os.path.isdir(Config.PROFILE_DIR):
+        return []
+    result = []
+    for entry in os.scandir(Config.PROFILE_DIR):
+        if not _NAME.match(entry.name):
+            continue
+        stamp, _, rest = entry.name.partition("_")
+        endpoint, pid, elapsed = rest[:-len(".prof")].rsplit("_", 2)
+        st = entry.stat()
+        result.append({"name": entry.name, "endpoint": endpoint, "pid": int(pid),
+                       "elapsed_ms": int(elapsed[:-2]), "size": st.st_size,
+                       "created": st.st_mtime})
+    result.sort(key=lambda p: p["created"], reverse=True)
+    return result
+
+
+def profile_path(name):
+    """Ruta de un perfil guardado, o None si el nombre no es válido"""
+    if not _NAME.match(name):
+        return None
+    path = os.path.join(Config.PROFILE_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def summary(name, limit=40, sort="cumulative"):
+    """Resumen en texto de pstats (las `limit` funciones más costosas)"""
+    out = io.StringIO()
+    pstats.Stats(profile_path(name), stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+# ── Hooks ───────────────────────────────────────────────────────
+
+def init_app(app):
+    """Registra los hooks de petición y el listener de control del bus"""
+    hub.add_listener(_on_control, control=True)
+    metrics.register("profiler", lambda: {"armed": armed()})
+
+    @app.before_request
+    def _profile_start():
+        endpoint = request.endpoint
+        if endpoint is None:
+            return
+        if ("X-Profile" in request.headers or "profile" in request.args) and require_admin(request):
+            count = _requested_count()
+            if count > 0:
+                _arm_everywhere(endpoint, count)
+        if _armed and _take(endpoint):
+            g.profile = cProfile.Profile()
+            g.profile_started = time.perf_counter()
+            g.profile.enable()
+
+    @app.teardown_request
+    def _profile_stop(exc):
+        profile = g.pop("profile", None)
+        if profile is None:
+            return
+        profile.disable()
+        try:
+            _save(profile, request.endpoint, time.perf_counter() - g.profile_started)
+        except OSError:
+            app.logger.exception("No se pudo guardar el perfil")
@@ -0,0 +1,92 @@
+"""
+purge.py - Borrado en segundo plano de licencias con mucho historial
+
+Borrar la licencia basta para que la BD elimine en cascada sus logs,
+dispositivos, estadísticas, marcas e IPs (ON DELETE CASCADE), pero en una
+licencia con años de heartbeats eso es un único DELETE enorme que retiene el
+bloqueo de escritura. En modo background la licencia se oculta al momento:
+se revoca y su clave pasa a ser BORRANDO-<id>, así que la clave original
+queda libre, validate responde INVALID y el bot recibe DELETED. Un hilo
+borra el historial por bloques de PURGE_CHUNK_SIZE filas, cada uno en su
+propia transacción, y al final la licencia.
+
+Si el worker muere a medias, la licencia queda oculta con parte del
+historial: `flask --app app resume-purges` termina el borrado.
+"""
+
+import threading
+from sqlalchemy import select, delete
+from config import Config
+from models import db, License, ActivityLog, DeviceHistory
+from events import publish
+import metrics
+
+# Prefijo de la clave de una licencia con el borrado en curso
+TOMBSTONE = "BORRANDO-"
+
+_lock = threading.Lock()
+_running = set()    # ids de licencias con una purga en curso en este worker
+
+
+def hide(lic):
+    """Revoca la licencia y libera su clave en la transacción actual (el llamador confirma)"""
+    key = lic.key
+    lic.key = f"{TOMBSTONE}{lic.id}"
+    lic.revoked = True
+    lic.hw_id = ""
+    publish(key, "DELETED")
+
+
+def purge_history(license_id, chunk_size=None):
+    """Borra logs y dispositivos de la licencia por bloques; devuelve filas borradas"""
+    chunk_size = chunk_size or Config.PURGE_CHUNK_SIZE
+    total = 0
+    for model in (ActivityLog, DeviceHistory):
+        table = model.__table__
+        while True:
+            chunk = select(table.c.id).where(table.c.license_id == license_id).limit(chunk_size)
+            deleted = db.session.execute(delete(table).where(table.c.id.in_(chunk))).rowcount
+            db.session.commit()
+            total += deleted
+            metrics.incr("purged_rows", deleted)
+            if deleted < chunk_size:
+                break
+    return total
+
+
+def finish(license_id, chunk_size=None):
+    """Purga el historial y borra la licencia oculta (el resto cae en cascada)"""
+    total = purge_history(license_id, chunk_size)
+    lic = db.session.get(License, license_id)
+    if lic is not None:
+        db.session.delete(lic)
+    db.session.commit()
+    return total
+
+
+def pending():
+    """Licencias ocultas cuyo borrado no terminó (el worker murió a medias)"""
+    return list(db.session.scalars(select(License.id).where(License.key.like(f"{TOMBSTONE}%"))))
+
+
+def _run(app, license_id):
+    with app.app_context():
+        try:
+            finish(license_id)
+        except Exception:
+            db.session.rollback()
+            app.logger.exception("Error purgando la licencia %s", license_id)
+        finally:
+            with _lock:
+                _running.discard(license_id)
+
+
+def start(app, license_id):
+    """Lanza la purga de una licencia oculta en un hilo; False si ya hay una en curso"""
+    with _lock:
+        if license_id in _running:
+            return False
+        _running.add(license_id)
+    threading.Thread(target=_run, args=(app, license_id), daemon=True,
+                     name=f"purge-{license_id}").start()
+    return True
@@ -0,0 +1,146 @@
+"""
+replica.py - Enrutado de lecturas a una réplica opcional (DATABASE_READ_URL)
+
+  • Las vistas marcadas con @replica_read leen de la réplica. Las escrituras
+    (flush e INSERT/UPDATE/DELETE) y cualquier vista sin marcar, validate
+    incluido, van siempre a la primaria.
+  • Si la réplica va más de READ_REPLICA_MAX_LAG segundos por detrás, o no
+    responde, la petición lee de la primaria.
+  • Read-your-writes: una petición admin que escribe deja una cookie que manda
+    las lecturas de ese navegador a la primaria (y salta la caché de analytics)
+    durante READ_YOUR_WRITES_SECONDS.
+    Los clientes de la API pueden pedir lo mismo con la cabecera X-Read-Primary: 1.
+
+El retraso se mide con el bus de eventos: el primer LicenseEvent de la
+primaria que aún no está en la réplica dice desde cuándo va atrasada. Solo
+lo mueven las mutaciones admin, que son las que el panel no debe perder de
+vista; el last_seen que escribe validate puede llegar con algo de retraso.
+"""
+
+import time
+import threading
+from datetime import datetime
+from functools import wraps
+from flask import g, request, current_app, has_app_context, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event as sa_event, select, func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.dml import UpdateBase
+from config import Config
+
+BIND_KEY = "replica"
+COOKIE = "read_primary_until"
+
+# Cada cuánto se vuelve a medir el retraso (por worker)
+LAG_CHECK_INTERVAL = 2.0
+
+_lock = threading.Lock()
+_lag = {"value": 0.0, "checked": 0.0}
+
+
+class RoutingSession(Session):
+    """Sesión que envía las lecturas de vistas @replica_read a la réplica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context() and g.get("read_source") == BIND_KEY:
+            if self._flushing or isinstance(clause, UpdateBase):
+                g.db_wrote = True
+            else:
+                return self._db.engines[BIND_KEY]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@sa_event.listens_for(Session, "after_flush")
+def _mark_write(session, flush_context):
+    if has_request_context():
+        g.db_wrote = True
+
+
+# ── Retraso de la réplica ───────────────────────────────────────
+
+def replica_lag(engines):
+    """Segundos que la réplica va por detrás (inf si no responde)"""
+    from models import LicenseEvent
+
+    now = time.time()
+    with _lock:
+        if now - _lag["checked"] < LAG_CHECK_INTERVAL:
+            return _lag["value"]
+
+    try:
+        with engines[BIND_KEY].connect() as conn:
+            applied = conn.execute(select(func.max(LicenseEvent.id))).scalar() or 0
+        with engines[None].connect() as conn:
+            missing = conn.execute(select(LicenseEvent.created_at)
+                                   .where(LicenseEvent.id > applied)
+                                   .order_by(LicenseEvent.id).limit(1)).scalar()
+        lag = 0.0 if missing is None else max((datetime.utcnow() - missing).total_seconds(), 0.0)
+    except SQLAlchemyError as e:
+        current_app.logger.warning("Réplica no disponible, se lee de la primaria: %s", e)
+        lag = float("inf")
+
+    with _lock:
+        _lag.update(value=lag, checked=now)
+    return lag
+
+
+def wants_primary():
+    """La petición pide leer lo último escrito (cookie o X-Read-Primary)"""
+    if request.headers.get("X-Read-Primary") == "1":
+        return True
+    try:
+        return float(request.cookies.get(COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def _choose_source():
+    engines = current_app.extensions["sqlalchemy"].engines
+    if BIND_KEY not in engines or (has_request_context() and wants_primary()):
+        return "primary", None
+    lag = replica_lag(engines)
+    if lag > Config.READ_REPLICA_MAX_LAG:
+        return "primary", None
+    return BIND_KEY, lag
+
+
+def replica_read(view):
+    """Marca una vista de solo lectura para servirse desde la réplica"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        use_replica()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def use_replica():
+    """Lecturas del contexto actual a la réplica (p. ej. refrescos en segundo plano)"""
+    g.read_source, g.read_lag = _choose_source()
+    g.read_only = True
+
+
+def use_primary():
+    """Lo que quede de la petición lee de la primaria (p. ej. antes de reconstruir)"""
+    if has_app_context() and "read_source" in g:
+        g.read_source = "primary"
+
+
+def staleness():
+    """Retraso máximo de lo leído en esta petición (0 si todo vino de la primaria)"""
+    lag = g.get("read_lag")
+    return 0.0 if lag is None else lag + LAG_CHECK_INTERVAL
+
+
+def init_app(app):
+    """Cabecera de diagnóstico y cookie de read-your-writes"""
+    @app.after_request
+    def _read_your_writes(response):
+        if "read_source" in g:
+            # Vista de lectura: lo que escriba son cachés internas, no mutaciones
+            response.headers["X-Read-Source"] = g.read_source
+        elif g.get("db_wrote") and request.path.startswith("/api/admin"):
+            # También la respetan las cachés de resultados, haya réplica o no
+            until = time.time() + Config.READ_YOUR_WRITES_SECONDS
+            response.set_cookie(COOKIE, f"{until:.0f}", max_age=Config.READ_YOUR_WRITES_SECONDS,
+                                httponly=True, samesite="Lax")
+        return response
@@ -0,0 +1,266 @@
+"""
+reports.py - Informes offline sobre ActivityLog (flask --app app run-reports)
+
+  • app_versions         logs, éxitos y licencias distintas por mes y app_version
+  • churn_cohorts        licencias por mes de primera validación correcta y
+                         cuántas siguen validando N meses después
+  • devices_per_license  por mes: licencias activas, media y máximo de
+                         dispositivos por licencia, licencias con varios
+
+El rango de ids de ActivityLog se fija al empezar y se parte en bloques de
+REPORTS_CHUNK_SIZE ids. Un pool de procesos lee cada bloque con un cursor
+de servidor (su propio engine) y devuelve un resultado parcial; el proceso
+principal lo guarda en ReportChunk al terminar cada bloque. Si la ejecución
+se interrumpe, la siguiente retoma la misma y solo procesa los bloques que
+faltan. Al final se fusionan los parciales, se guarda cada informe en
+ReportResult y se borran los parciales.
+
+Las lecturas van a la réplica (DATABASE_READ_URL) si está configurada.
+"""
+
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from sqlalchemy import create_engine, select, func
+from sqlalchemy.pool import NullPool
+from config import Config
+from models import db, ActivityLog, Device, ReportRun, ReportChunk, ReportResult
+import replica
+
+REPORTS = ("app_versions", "churn_cohorts", "devices_per_license")
+
+# Engine de cada proceso del pool (ver _init_worker)
+_engine = None
+
+
+# ── Procesos del pool ───────────────────────────────────────────
+
+def _init_worker(url):
+    global _engine
+    _engine = create_engine(url, poolclass=NullPool)
+
+
+def _month(ts):
+    return ts.strftime("%Y-%m")
+
+
+def aggregate_chunk(start_id, end_id, engine=None):
+    """Parcial de los logs con id en [start_id, end_id): (filas, datos JSON)"""
+    versions = {}   # "mes|versión" -> [logs, éxitos, {license_id}]
+    active = {}     # license_id -> {mes con validación correcta}
+    devices = {}    # mes -> {license_id -> {dispositivo}}
+
+    stmt = select(ActivityLog.license_id, ActivityLog.timestamp, ActivityLog.status,
+                  ActivityLog.app_version, func.coalesce(Device.hw_id, ActivityLog.legacy_hw_id))\
+        .outerjoin(Device, Device.id == ActivityLog.device_id)\
+        .where(ActivityLog.id >= start_id, ActivityLog.id < end_id)
+    rows = 0
+    with (engine or _engine).connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=5000).execute(stmt)
+        for license_id, ts, status, version, hw_id in result:
+            rows += 1
+            month = _month(ts)
+            acc = versions.setdefault(f"{month}|{version or ''}", [0, 0, set()])
+            acc[0] += 1
+            if license_id is None:
+                continue
+            acc[2].add(license_id)
+            if status != "SUCCESS":
+                continue
+            acc[1] += 1
+            active.setdefault(license_id, set()).add(month)
+            if hw_id:
+                devices.setdefault(month, {}).setdefault(license_id, set()).add(hw_id)
+
+    data = {
+        "versions": {k: [logs, ok, sorted(ids)] for k, (logs, ok, ids) in versions.items()},
+        "active":   {str(k): sorted(v) for k, v in active.items()},
+        "devices":  {m: {str(k): sorted(v) for k, v in lic.items()}
+                     for m, lic in devices.items()},
+    }
+    return rows, json.dumps(data, separators=(",", ":"))
+
+
+# ── Fusión ──────────────────────────────────────────────────────
+
+def _merge(chunks):
+    versions, active, devices = {}, {}, {}
+    for data in chunks:
+        data = json.loads(data)
+        for key, (logs, ok, ids) in data["versions"].items():
+            acc = versions.setdefault(key, [0, 0, set()])
+            acc[0] += logs
+            acc[1] += ok
+            acc[2].update(ids)
+        for license_id, months in data["active"].items():
+            active.setdefault(license_id, set()).update(months)
+        for month, lics in data["devices"].items():
+            target = devices.setdefault(month, {})
+            for license_id, devs in lics.items():
+                target.setdefault(license_id, set()).update(devs)
+    return versions, active, devices
+
+
+def _month_index(month):
+    year, m = month.split("-")
+    return int(year) * 12 + int(m) - 1
+
+
+def build_reports(chunks):
+    """Informes finales a partir de los parciales de todos los bloques"""
+    versions, active, devices = _merge(chunks)
+
+    app_versions = []
+    for key, (logs, ok, ids) in sorted(versions.items()):
+        month, version = key.split("|", 1)
+        app_versions.append({"month": month, "app_version": version, "logs": logs,
+                             "success": ok, "licenses": len(ids)})
+
+    last = max((_month_index(m) for months in active.values() for m in months), default=None)
+    cohorts = {}
+    for months in active.values():
+        indexes = {_month_index(m) for m in months}
+        first = min(indexes)
+        retention = cohorts.setdefault(first, [0] * (last - first + 1))
+        for i in indexes:
+            retention[i - first] += 1
+    churn_cohorts = [{
+        "cohort":    f"{first // 12}-{first % 12 + 1:02d}",
+        "licenses":  retention[0],
+        "retention": retention,
+        "active_last_month": retention[-1],
+    } for first, retention in sorted(cohorts.items())]
+
+    devices_per_license = []
+    for month, lics in sorted(devices.items()):
+        counts = [len(devs) for devs in lics.values()]
+        devices_per_license.append({
+            "month":         month,
+            "licenses":      len(counts),
+            "avg_devices":   round(sum(counts) / len(counts), 3),
+            "max_devices":   max(counts),
+            "multi_device":  sum(1 for n in counts if n > 1),
+        })
+
+    return {"app_versions": app_versions, "churn_cohorts": churn_cohorts,
+            "devices_per_license": devices_per_license}
+
+
+# ── Ejecución ───────────────────────────────────────────────────
+
+def _source_engine():
+    return db.engines.get(replica.BIND_KEY, db.engine)
+
+
+def _pending_run(chunk_size):
+    """Ejecución sin terminar que retomar, o una nueva con el rango de ids actual"""
+    run = ReportRun.query.filter(ReportRun.status != "done")\
+                         .order_by(ReportRun.id.desc()).first()
+    if run:
+        run.status = "running"
+        run.error = ""
+        db.session.commit()
+        return run
+
+    low, high = db.session.execute(select(func.min(ActivityLog.id), func.max(ActivityLog.id)),
+                                   bind_arguments={"bind": _source_engine()}).first()
+    run = ReportRun(min_id=low or 0, max_id=high or 0, chunk_size=chunk_size)
+    db.session.add(run)
+    db.session.commit()
+    return run
+
+
+def run(workers=None, chunk_size=None, restart=False, progress=None):
+    """Genera todos los informes; devuelve la ReportRun terminada"""
+    workers = Config.REPORTS_WORKERS if workers is None else workers
+    if restart:
+        ReportRun.query.filter(ReportRun.status != "done").delete()
+        db.session.commit()
+    job = _pending_run(chunk_size or Config.REPORTS_CHUNK_SIZE)
+
+    run_id, chunk_size = job.id, job.chunk_size
+    done = {start for (start,) in db.session.query(ReportChunk.start_id).filter_by(run_id=run_id)}
+    starts = range(job.min_id, job.max_id + 1, chunk_size) if job.max_id else ()
+    pending = [s for s in starts if s not in done]
+    total, completed = len(starts), len(done)
+    # Los bloques se leen con otras conexiones: no dejar abierta la transacción
+    # de la sesión (en SQLite retiene el bloqueo de escritura). Por lo mismo
+    # no se vuelve a tocar `job` hasta el final (recargarlo abriría otra)
+    db.session.commit()
+
+    def save(start, rows, data):
+        nonlocal completed
+        db.session.add(ReportChunk(run_id=run_id, start_id=start, rows=rows, data=data))
+        db.session.commit()
+        completed += 1
+        if progress:
+            progress(completed, total)
+
+    try:
+        if workers <= 1:
+            engine = _source_engine()
+            for start in pending:
+                save(start, *aggregate_chunk(start, start + chunk_size, engine))
+        elif pending:
+            url = _source_engine().url.render_as_string(hide_password=False)
+            # spawn: los procesos no heredan los hilos ni las conexiones del worker
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                     initializer=_init_worker, initargs=(url,)) as pool:
+                futures = {pool.submit(aggregate_chunk, start, start + chunk_size): start
+                           for start in pending}
+                for future in as_completed(futures):
+                    save(futures[future], *future.result())
+
+        chunks = (data for (data,) in db.session.query(ReportChunk.data)
+                                                .filter_by(run_id=run_id).yield_per(100))
+        now = datetime.utcnow()
+        for name, data in build_reports(chunks).items():
+            db.session.merge(ReportResult(name=name, run_id=job.id, generated_at=now,
+                                          data=json.dumps(data)))
+        job.status = "done"
+        job.finished_at = now
+        ReportChunk.query.filter_by(run_id=job.id).delete()
+        db.session.commit()
+        return job
+    except BaseException as e:
+        db.session.rollback()
+        job.status = "failed"
+        job.error = repr(e)[:500]
+        db.session.commit()
+        raise
+
+
+# ── Lectura (admin API) ─────────────────────────────────────────
+
+def status():
+    """Informes disponibles y estado de la última ejecución"""
+    last = ReportRun.query.order_by(ReportRun.id.desc()).first()
+    reports = db.session.query(ReportResult.name, ReportResult.run_id,
+                               ReportResult.generated_at).order_by(ReportResult.name).all()
+    run_info = None
+    if last:
+        total = (last.max_id - last.min_id) // last.chunk_size + 1 if last.max_id else 0
+        run_info = {
+            "id":          last.id,
+            "status":      last.status,
+            "started_at":  last.started_at.isoformat(),
+            "finished_at": last.finished_at.isoformat() if last.finished_at else None,
+            "chunks":      total,
+            "chunks_done": total if last.status == "done" else last.chunks.count(),
+            "error":       last.error or None,
+        }
+    return {
+        "reports": [{"name": name, "run_id": run_id, "generated_at": generated_at.isoformat()}
+                    for name, run_id, generated_at in reports],
+        "last_run": run_info,
+    }
+
+
+def load(name):
+    """Datos de un informe, o None si aún no se ha generado"""
+    row = db.session.get(ReportResult, name)
+    if row is None:
+        return None
+    return {"name": name, "run_id": row.run_id, "generated_at": row.generated_at.isoformat(),
+            "data": json.loads(row.data)}
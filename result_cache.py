@@ -0,0 +1,214 @@
+"""
+result_cache.py - Caché de resultados de analytics por worker
+
+  • Cada resultado vive ANALYTICS_CACHE_TTL segundos como fresco.
+  • Durante ANALYTICS_CACHE_STALE segundos más se sirve caducado mientras un
+    único hilo de fondo lo recalcula (stale-while-revalidate).
+  • Varias peticiones que fallan a la vez por la misma clave esperan a un solo
+    cálculo (single-flight).
+  • Las entradas llevan etiquetas ("license:<KEY>", "fleet"); un evento del bus
+    sobre una licencia invalida sus entradas y las globales, y "*" lo vacía todo.
+
+Un cálculo que empezó antes de una invalidación no se guarda al terminar,
+así que un resultado previo a una mutación nunca llega a la caché. Para eso
+solo se cuentan las invalidaciones de las etiquetas con cálculos en curso:
+el contador de una etiqueta desaparece cuando termina su último cálculo.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from config import Config
+import metrics
+import replica
+
+FLEET = "fleet"
+
+_lock = threading.Lock()
+_entries = OrderedDict()    # clave -> _Entry
+_inflight = {}              # clave -> _Flight
+_by_tag = {}                # etiqueta -> claves de las entradas con esa etiqueta
+_watched = {}               # etiqueta -> nº de cálculos en curso que la usan
+_generations = {}           # etiqueta vigilada -> nº de invalidaciones
+_epoch = 0                  # invalidaciones totales ("*")
+_stats = {"hits": 0, "stale": 0, "misses": 0, "refreshes": 0, "evictions": 0, "shared": 0}
+
+
+class _Entry:
+    __slots__ = ("value", "created", "tags")
+
+    def __init__(self, value, tags):
+        self.value = value
+        self.created = time.monotonic()
+        self.tags = tags
+
+
+class _Flight:
+    __slots__ = ("done", "value", "error", "version")
+
+    def __init__(self, version):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.version = version
+
+
+def _version(tags):
+    return (_epoch,) + tuple(_generations.get(t, 0) for t in tags)
+
+
+def _start(tags):
+    """Nuevo cálculo (con _lock): vigila sus etiquetas hasta que se guarde"""
+    for tag in tags:
+        _watched[tag] = _watched.get(tag, 0) + 1
+    return _Flight(_version(tags))
+
+
+def _unwatch(tags):
+    for tag in tags:
+        if _watched[tag] > 1:
+            _watched[tag] -= 1
+        else:
+            del _watched[tag]
+            _generations.pop(tag, None)
+
+
+def _drop(key):
+    entry = _entries.pop(key)
+    for tag in entry.tags:
+        keys = _by_tag[tag]
+        keys.discard(key)
+        if not keys:
+            del _by_tag[tag]
+
+
+def _store(key, tags, flight, owner=True):
+    """Guarda el resultado si ninguna etiqueta se invalidó durante el cálculo"""
+    with _lock:
+        if owner:
+            _inflight.pop(key, None)
+        if flight.error is None and flight.version == _version(tags):
+            if key in _entries:
+                _drop(key)
+            _entries[key] = _Entry(flight.value, tags)
+            for tag in tags:
+                _by_tag.setdefault(tag, set()).add(key)
+            while len(_entries) > Config.ANALYTICS_CACHE_MAX_ENTRIES:
+                _drop(next(iter(_entries)))
+        _unwatch(tags)
+    flight.done.set()
+
+
+def _run(key, tags, compute, flight, owner=True):
+    try:
+        flight.value = compute()
+    except Exception as e:
+        flight.error = e
+    _store(key, tags, flight, owner)
+
+
+def _refresh(app, key, tags, compute, flight):
+    with app.app_context():
+        replica.use_replica()
+        _run(key, tags, compute, flight)
+        if flight.error is not None:
+            app.logger.error("Error recalculando %s en segundo plano: %s", key, flight.error)
+
+
+def get_or_compute(key, tags, compute, refresh=False):
+    """
+    Devuelve (valor, estado) con estado HIT, STALE o MISS.
+
+    `compute` se ejecuta sin argumentos en la petición actual (MISS) o en un
+    hilo con contexto de aplicación propio (refresco de STALE). Con refresh
+    se calcula siempre de nuevo y se guarda el resultado.
+    """
+    ttl, stale = Config.ANALYTICS_CACHE_TTL, Config.ANALYTICS_CACHE_STALE
+    if ttl <= 0:
+        return compute(), "MISS"
+
+    tags = tuple(tags)
+    if refresh:
+        with _lock:
+            flight = _start(tags)
+            _stats["misses"] += 1
+        _run(key, tags, compute, flight, owner=False)
+        if flight.error is not None:
+            raise flight.error
+        return flight.value, "MISS"
+
+    with _lock:
+        entry = _entries.get(key)
+        age = time.monotonic() - entry.created if entry else None
+        if entry and age < ttl:
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+            return entry.value, "HIT"
+
+        flight = _inflight.get(key)
+        if entry and age < ttl + stale:
+            _stats["stale"] += 1
+            if flight is None:
+                flight = _inflight[key] = _start(tags)
+                _stats["refreshes"] += 1
+                threading.Thread(target=_refresh, daemon=True, name="cache-refresh",
+                                 args=(current_app._get_current_object(), key, tags,
+                                       compute, flight)).start()
+            return entry.value, "STALE"
+
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = _start(tags)
+            _stats["misses"] += 1
+        else:
+            _stats["shared"] += 1
+
+    if leader:
+        _run(key, tags, compute, flight)
+    else:
+        flight.done.wait()
+    if flight.error is not None:
+        raise flight.error
+    return flight.value, "MISS"
+
+
+def invalidate(tags=None):
+    """Invalida las entradas con alguna de las etiquetas (todas si tags es None)"""
+    global _epoch
+    with _lock:
+        if tags is None:
+            _epoch += 1
+            removed = len(_entries)
+            _entries.clear()
+            _by_tag.clear()
+        else:
+            stale_keys = set()
+            for tag in tags:
+                if tag in _watched:
+                    _generations[tag] = _generations.get(tag, 0) + 1
+                stale_keys.update(_by_tag.get(tag, ()))
+            for k in stale_keys:
+                _drop(k)
+            removed = len(stale_keys)
+        _stats["evictions"] += removed
+
+
+def _on_event(event):
+    if event["key"] == "*":
+        invalidate()
+    else:
+        invalidate([f"license:{event['key']}", FLEET])
+
+
+def stats():
+    with _lock:
+        return dict(_stats, entries=len(_entries), inflight=len(_inflight),
+                    watched_tags=len(_watched))
+
+
+def init_app(app):
+    """Engancha la invalidación al bus de eventos"""
+    from events import hub
+    hub.add_listener(_on_event)
+    metrics.register("analytics_cache", stats)
@@ -0,0 +1,219 @@
+"""
+reverse_index.py - Índices inversos dispositivo → licencias e IP → licencias
+
+  • hw_id → licencias: DeviceHistory ya tiene una fila por (licencia, hw_id)
+    con primera y última vez; basta el índice sobre hw_id.
+  • IP → licencias: LicenseIp, una fila por (licencia, IP), mantenida por
+    log_activity con un UPSERT diferido (write_behind.py, agrupado en cada
+    volcado). Cada worker recuerda cuándo anotó cada par y no vuelve a
+    tocarlo durante LAST_SEEN_RESOLUTION segundos, así que un bot que valida
+    cada minuto desde la misma IP no añade escrituras.
+
+shared_groups() une las licencias que comparten dispositivo o IP con
+union-find y devuelve los grupos conexos (posible reventa o préstamo de
+claves). Las IPs compartidas por demasiadas licencias (NAT, proxies de
+empresa) se ignoran para no unir clientes sin relación.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import select, insert, func, distinct, event as sa_event
+from sqlalchemy.orm import Session
+from models import db, License, ActivityLog, DeviceHistory, LicenseIp
+from database import dialect_insert
+import write_behind
+
+# Precisión de LicenseIp.last_seen (segundos)
+LAST_SEEN_RESOLUTION = 300
+CACHE_SIZE = 50000
+
+_lock = threading.Lock()
+_written = OrderedDict()    # (license_id, ip) -> última escritura
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _publish_written(session):
+    pending = session.info.pop("reverse_index_pending", None)
+    if not pending:
+        return
+    with _lock:
+        for pair, at in pending.items():
+            _written[pair] = at
+            _written.move_to_end(pair)
+        while len(_written) > CACHE_SIZE:
+            _written.popitem(last=False)
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _discard_written(session):
+    session.info.pop("reverse_index_pending", None)
+
+
+def record_ip(license_id, ip, now=None):
+    """Registra que la licencia se usó desde la IP (UPSERT de LicenseIp)"""
+    if not license_id or not ip:
+        return
+    now = now or datetime.utcnow()
+    pair = (license_id, ip)
+    pending = db.session.info.setdefault("reverse_index_pending", {})
+    with _lock:
+        last = _written.get(pair)
+    if pair in pending or (last and (now - last).total_seconds() < LAST_SEEN_RESOLUTION):
+        return
+
+    _ips.add(pair, (now, now))
+    pending[pair] = now
+
+
+def _flush_ips(items):
+    """UPSERT agrupado de los pares anotados: {(license_id, ip): (primera, última)}"""
+    existing = write_behind.existing_licenses({license_id for license_id, _ in items})
+    rows = [{"license_id": license_id, "ip": ip, "first_seen": first, "last_seen": last}
+            for (license_id, ip), (first, last) in items.items() if license_id in existing]
+    if not rows:
+        return
+    stmt = dialect_insert(LicenseIp.__table__)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=["license_id", "ip"],
+        set_={"last_seen": stmt.excluded.last_seen},
+    ), rows)
+
+
+_ips = write_behind.register(
+    "license_ip", lambda current, new: (min(current[0], new[0]), max(current[1], new[1])), _flush_ips)
+
+
+# ── Consultas ───────────────────────────────────────────────────
+
+def licenses_by_device(hw_id):
+    """Licencias que han usado el hw_id, con primera y última vez"""
+    return db.session.query(License, DeviceHistory.first_seen, DeviceHistory.last_seen)\
+                     .join(DeviceHistory, DeviceHistory.license_id == License.id)\
+                     .filter(DeviceHistory.hw_id == hw_id)\
+                     .order_by(DeviceHistory.last_seen.desc()).all()
+
+
+def licenses_by_ip(ip):
+    """Licencias que han validado desde la IP, con primera y última vez"""
+    return db.session.query(License, LicenseIp.first_seen, LicenseIp.last_seen)\
+                     .join(LicenseIp, LicenseIp.license_id == License.id)\
+                     .filter(LicenseIp.ip == ip)\
+                     .order_by(LicenseIp.last_seen.desc()).all()
+
+
+class _UnionFind:
+    """Conjuntos disjuntos con compresión de caminos y unión por tamaño"""
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, x):
+        parent = self.parent
+        if x not in parent:
+            parent[x] = x
+            self.size[x] = 1
+            return x
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+
+def _shared(model, value_col, since, max_licenses=None):
+    """Pares (valor, license_id) de los valores usados por 2+ licencias en la ventana"""
+    n = func.count(distinct(model.license_id))
+    shared = select(value_col).where(model.last_seen > since)\
+                              .group_by(value_col).having(n > 1)
+    if max_licenses:
+        shared = shared.having(n <= max_licenses)
+    return db.session.execute(
+        select(value_col, model.license_id)
+        .where(model.last_seen > since, value_col.in_(shared))
+    ).all()
+
+
+def shared_groups(days=30, min_size=2, ip_max_licenses=20, limit=100):
+    """Grupos de licencias conectadas por dispositivos o IPs compartidos"""
+    since = datetime.utcnow() - timedelta(days=days)
+    uf = _UnionFind()
+    links = {}      # license_id -> {("device" | "ip", valor)}
+    first_of = {}   # (tipo, valor) -> primera licencia vista con ese valor
+
+    edges = [("device", row) for row in _shared(DeviceHistory, DeviceHistory.hw_id, since)] + \
+            [("ip", row) for row in _shared(LicenseIp, LicenseIp.ip, since, ip_max_licenses)]
+    for kind, (value, license_id) in edges:
+        link = (kind, value)
+        links.setdefault(license_id, set()).add(link)
+        if link in first_of:
+            uf.union(first_of[link], license_id)
+        else:
+            first_of[link] = license_id
+            uf.find(license_id)
+
+    members = {}
+    for license_id in uf.parent:
+        members.setdefault(uf.find(license_id), []).append(license_id)
+    groups = sorted((ids for ids in members.values() if len(ids) >= min_size),
+                    key=len, reverse=True)
+
+    total = len(groups)
+    groups = groups[:limit]
+    ids = [i for ids in groups for i in ids]
+    lics = {l.id: l for l in License.query.filter(License.id.in_(ids))} if ids else {}
+
+    result = []
+    for group in groups:
+        values = set().union(*(links[i] for i in group))
+        result.append({
+            "size":           len(group),
+            "licenses":       [{"key": lics[i].key, "user": lics[i].user, "plan": lics[i].plan,
+                                "revoked": lics[i].revoked} for i in group if i in lics],
+            "shared_devices": sorted(v for k, v in values if k == "device"),
+            "shared_ips":     sorted(v for k, v in values if k == "ip"),
+        })
+    return {"groups": result, "total_groups": total, "days": days,
+            "ip_max_licenses": ip_max_licenses}
+
+
+# ── Reconstrucción ──────────────────────────────────────────────
+
+def rebuild_ips(chunk_size=1000, progress=None):
+    """Rellena LicenseIp desde ActivityLog, por bloques de ids de licencia"""
+    LicenseIp.query.delete()
+    db.session.commit()
+    _ips.clear()
+    last_id, total = 0, 0
+    while True:
+        upper = db.session.execute(
+            select(License.id).where(License.id > last_id)
+            .order_by(License.id).offset(chunk_size - 1).limit(1)
+        ).scalar()
+        bound = [ActivityLog.license_id > last_id]
+        if upper is not None:
+            bound.append(ActivityLog.license_id <= upper)
+        rows = select(ActivityLog.license_id, ActivityLog.ip_address,
+                      func.min(ActivityLog.timestamp), func.max(ActivityLog.timestamp))\
+            .where(*bound, ActivityLog.ip_address != "")\
+            .group_by(ActivityLog.license_id, ActivityLog.ip_address)
+        result = db.session.execute(insert(LicenseIp.__table__).from_select(
+            ["license_id", "ip", "first_seen", "last_seen"], rows))
+        db.session.commit()
+        total += result.rowcount
+        if progress:
+            progress(total)
+        if upper is None:
+            return total
+        last_id = upper
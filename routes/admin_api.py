@@ -5,12 +5,27 @@ routes/admin_api.py - Endpoints de administración (API JSON)
 import threading
 import time
 from datetime import datetime, timedelta
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
+from sqlalchemy import update, case, func
 from models import db, License
 from utils import require_admin, generate_key, make_expiry
+from events import publish, publish_many
+from replica import replica_read
+import stats
+import purge
 
 bp = Blueprint('admin_api', __name__)
 
+PLANS = ("monthly", "yearly", "lifetime")
+
+# Acción masiva → tipo de evento publicado por cada licencia afectada
+BULK_ACTIONS = {
+    "extend":      "EXTENDED",
+    "revoke":      "REVOKED",
+    "reactivate":  "REACTIVATED",
+    "change_plan": "EDITED",
+}
+
 
 @bp.route("/api/admin/create", methods=["POST"])
 def create():
@@ -31,6 +46,7 @@ def create():
 
     lic = License(key=key, plan=plan, user=user, expires_at=make_expiry(plan))
     db.session.add(lic)
+    publish(key, "CREATED")
     db.session.commit()
 
     # Si es petición de formulario HTML, redirigir al panel
@@ -68,6 +84,7 @@ def revoke():
     
     lic.revoked = True
     lic.hw_id = ""          # ← limpia el dispositivo al revocar
+    publish(key, "REVOKED")
     db.session.commit()
     
     return jsonify({"revoked": key}), 200
@@ -86,6 +103,7 @@ def reactivate():
         return jsonify({"error": "No encontrada"}), 404
     
     lic.revoked = False
+    publish(key, "REACTIVATED")
     db.session.commit()
     
     return jsonify({"reactivated": key}), 200
@@ -105,6 +123,7 @@ def reset_device():
 
     lic.revoked = True
     lic.hw_id = ""
+    publish(key, "RESET")
     db.session.commit()
 
     def _reactivate():
@@ -115,6 +134,7 @@ def reset_device():
             l = License.query.filter_by(key=key).first()
             if l and l.revoked and not l.hw_id:
                 l.revoked = False
+                publish(key, "REACTIVATED")
                 db.session.commit()
     
     threading.Thread(target=_reactivate, daemon=True).start()
@@ -141,12 +161,14 @@ def extend():
     
     base = max(lic.expires_at or datetime.utcnow(), datetime.utcnow())
     lic.expires_at = base + timedelta(days=days)
+    publish(key, "EXTENDED", lic.expires_at.isoformat())
     db.session.commit()
     
     return jsonify({"extended_until": lic.expires_at.isoformat()}), 200
 
 
 @bp.route("/api/admin/list", methods=["GET"])
+@replica_read
 def list_licenses():
     """Lista todas las licencias"""
     if not require_admin(request):
@@ -199,6 +221,7 @@ def edit_license():
         if not lic.expires_at or lic.expires_at > datetime.utcnow():
             lic.expires_at = make_expiry(plan)
     
+    publish(key, "EDITED")
     db.session.commit()
     
     return jsonify({
@@ -215,15 +238,163 @@ def delete_license():
     if not require_admin(request):
         return jsonify({"error": "UNAUTHORIZED"}), 401
     
-    key = (request.get_json(force=True).get("key") or "").upper()
+    data = request.get_json(force=True)
+    key = (data.get("key") or "").upper()
     
     lic = License.query.filter_by(key=key).first()
     if not lic:
         return jsonify({"error": "No encontrada"}), 404
     
-    # SQLAlchemy eliminará automáticamente los registros relacionados
-    # gracias al cascade='all, delete-orphan' en los modelos
+    if data.get("background"):
+        # Se oculta ya (clave libre, bot avisado); historial y licencia se
+        # borran por bloques en segundo plano (ver purge.py)
+        purge.hide(lic)
+        db.session.commit()
+        purge.start(current_app._get_current_object(), lic.id)
+        return jsonify({"deleted": key, "background": True}), 202
+    
+    # La BD borra logs, dispositivos, estadísticas y marcas (ON DELETE CASCADE)
     db.session.delete(lic)
+    publish(key, "DELETED")
+    db.session.commit()
+    
+    return jsonify({"deleted": key}), 200
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Fecha inválida en '{name}'")
+
+
+def _license_conditions(data):
+    """Condiciones WHERE a partir de una lista de claves o un filtro"""
+    keys = data.get("keys")
+    if keys:
+        return [License.key.in_([str(k).strip().upper() for k in keys])]
+    
+    flt = data.get("filter") or {}
+    if not flt:
+        raise ValueError("Indica 'keys' o 'filter'")
+    
+    conditions = []
+    if flt.get("plan"):
+        if flt["plan"] not in PLANS:
+            raise ValueError("Plan inválido")
+        conditions.append(License.plan == flt["plan"])
+    if flt.get("expires_after"):
+        conditions.append(License.expires_at >= _parse_date(flt["expires_after"], "expires_after"))
+    if flt.get("expires_before"):
+        conditions.append(License.expires_at < _parse_date(flt["expires_before"], "expires_before"))
+    if "revoked" in flt:
+        conditions.append(License.revoked == bool(flt["revoked"]))
+    if flt.get("user_contains"):
+        conditions.append(License.user.contains(flt["user_contains"], autoescape=True))
+    if not conditions:
+        raise ValueError("Filtro vacío")
+    return conditions
+
+
+def _add_days(column, days):
+    """column + N días en el dialecto de la BD"""
+    if db.session.get_bind().dialect.name == "sqlite":
+        return func.datetime(column, f"{int(days):+d} days")
+    return column + timedelta(days=days)
+
+
+@bp.route("/api/admin/expiring", methods=["GET"])
+@replica_read
+def expiring():
+    """Licencias que vencen en un rango (por defecto los próximos 7 días)"""
+    if not require_admin(request):
+        return jsonify({"error": "UNAUTHORIZED"}), 401
+    
+    now = datetime.utcnow()
+    try:
+        start = _parse_date(request.args["from"], "from") if request.args.get("from") else now
+        end = (_parse_date(request.args["to"], "to") if request.args.get("to")
+               else start + timedelta(days=max(0, min(request.args.get("days", 7, type=int), 3650))))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    query = License.query.filter(License.expires_at >= start, License.expires_at < end)
+    if request.args.get("plan"):
+        query = query.filter(License.plan == request.args["plan"])
+    if request.args.get("include_revoked", "") not in ("1", "true"):
+        query = query.filter(License.revoked == False)
+    
+    limit = max(1, min(request.args.get("limit", 1000, type=int), 5000))
+    lics = query.order_by(License.expires_at).limit(limit).all()
+    # Total real de coincidencias; solo cuesta un COUNT si el límite recortó
+    total = query.count() if len(lics) == limit else len(lics)
+    
+    return jsonify({
+        "from":     start.isoformat(),
+        "to":       end.isoformat(),
+        "total":    total,
+        "licenses": [{
+            "key":        l.key,
+            "plan":       l.plan,
+            "user":       l.user,
+            "expires_at": l.expires_at.isoformat(),
+            "revoked":    l.revoked,
+            "last_seen":  l.last_seen.isoformat() if l.last_seen else None,
+        } for l in lics],
+    })
+
+
+@bp.route("/api/admin/bulk", methods=["POST"])
+def bulk():
+    """Operación masiva con un único UPDATE sobre una lista de claves o un filtro"""
+    if not require_admin(request):
+        return jsonify({"error": "UNAUTHORIZED"}), 401
+    
+    data = request.get_json(force=True)
+    action = data.get("action", "")
+    if action not in BULK_ACTIONS:
+        return jsonify({"error": f"Acción inválida, usa: {', '.join(BULK_ACTIONS)}"}), 400
+    
+    try:
+        conditions = _license_conditions(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    now = datetime.utcnow()
+    stmt = update(License).where(*conditions)
+    
+    if action == "extend":
+        try:
+            days = int(data.get("days", 30))
+        except (TypeError, ValueError):
+            days = 0
+        if not 1 <= days <= 3650:
+            return jsonify({"error": "days debe ser un entero entre 1 y 3650"}), 400
+        # Igual que /extend: desde hoy si ya venció; las lifetime no se tocan
+        base = case((License.expires_at > now, License.expires_at), else_=now)
+        stmt = stmt.where(License.expires_at.isnot(None))\
+                   .values(expires_at=_add_days(base, days))
+    elif action == "revoke":
+        stmt = stmt.values(revoked=True, hw_id="")
+    elif action == "reactivate":
+        stmt = stmt.values(revoked=False)
+    else:
+        plan = data.get("plan", "")
+        if plan not in PLANS:
+            return jsonify({"error": "Plan inválido"}), 400
+        # Igual que edit_license: solo se recalcula la expiración si no ha vencido
+        still_valid = License.expires_at.is_(None) | (License.expires_at > now)
+        stmt = stmt.where(License.plan != plan).values(
+            plan=plan,
+            expires_at=case((still_valid, make_expiry(plan)), else_=License.expires_at),
+        )
+    
+    keys = [k for (k,) in db.session.execute(
+        stmt.returning(License.key).execution_options(synchronize_session=False))]
+    
+    publish_many(keys, BULK_ACTIONS[action], f"bulk:{action}")
+    if action in ("revoke", "reactivate", "change_plan"):
+        stats.invalidate()
     db.session.commit()
     
-    return jsonify({"deleted": key}), 200
\ No newline at end of file
+    return jsonify({"action": action, "affected": len(keys)}), 200
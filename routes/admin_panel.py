@@ -2,16 +2,45 @@
 routes/admin_panel.py - Panel web de administración
 """
 
-from datetime import datetime
-from flask import Blueprint, request, render_template_string
-from models import db, License
+from datetime import datetime, timedelta
+from flask import Blueprint, request, render_template_string, jsonify
+from sqlalchemy import or_, and_
+from config import Config
+from models import db, License, LicenseEvent
 from utils import require_admin, redirect_panel
+from events import publish
+from replica import replica_read, staleness
+import stats
+import search
+import assets
 from templates._panel import PANEL_HTML
 
 bp = Blueprint('admin_panel', __name__)
 
+# Delta-sync del panel
+SYNC_OVERLAP_SECONDS = 5
+SYNC_PAGE_SIZE = 500
+
+
+def _row(l):
+    """Fila de licencia tal como la pinta el panel"""
+    return {
+        "key":              l.key,
+        "plan":             l.plan,
+        "user":             l.user,
+        "hw_id":            l.hw_id or "",
+        "expires_at":       l.expires_at.isoformat() if l.expires_at else "lifetime",
+        "revoked":          l.revoked,
+        "last_seen":        l.last_seen.isoformat() if l.last_seen else "nunca",
+        "first_activation": l.first_activation.isoformat() if l.first_activation else "nunca",
+        "activations":      l.activations,
+        "device_info":      l.device_info,
+        "ip_address":       l.ip_address,
+    }
+
 
 @bp.route("/api/admin/panel")
+@replica_read
 def panel():
     """Panel de administración HTML"""
     if not require_admin(request):
@@ -21,41 +50,110 @@ def panel():
     secret = request.args.get("secret", "")
     now = datetime.utcnow()
     
-    # Calcular estadísticas
-    active_24h = sum(1 for l in lics if l.last_seen and (now - l.last_seen).total_seconds() < 86400)
-    inactive = sum(1 for l in lics if not l.last_seen or (now - l.last_seen).total_seconds() > 604800)
-    revoked = sum(1 for l in lics if l.revoked)
+    # Estadísticas mantenidas incrementalmente (no recorren las licencias)
+    counts = stats.dashboard_counts(now)
     
     # Preparar datos para el template
     data = []
     for l in lics:
-        data.append({
-            "key":              l.key,
-            "plan":             l.plan,
-            "user":             l.user,
-            "hw_id":            l.hw_id or "",
-            "expires_at":       l.expires_at.isoformat() if l.expires_at else "lifetime",
-            "revoked":          l.revoked,
-            "last_seen":        l.last_seen.isoformat() if l.last_seen else "nunca",
-            "last_seen_dt":     l.last_seen,
-            "first_activation": l.first_activation.isoformat() if l.first_activation else "nunca",
-            "activations":      l.activations,
-            "device_info":      l.device_info,
-            "ip_address":       l.ip_address,
-        })
-    
-    return render_template_string(
+        row = _row(l)
+        row["last_seen_dt"] = l.last_seen
+        data.append(row)
+    
+    html = render_template_string(
         PANEL_HTML, 
         licenses=data, 
         secret=secret,
         now=now,
-        stats={
-            'total': len(lics),
-            'active_24h': active_24h,
-            'inactive': inactive,
-            'revoked': revoked
-        }
+        stats=counts,
+        panel_data={
+            "secret": secret,
+            # Si se leyó de la réplica, el delta-sync arranca desde lo que ya tenía
+            "cursor": (now - timedelta(seconds=staleness())).isoformat(),
+            "now":    now.isoformat(),
+        },
     )
+    return assets.page(html, request)
+
+
+@bp.route("/api/admin/assets/<filename>")
+def asset(filename):
+    """CSS/JS del panel (sin autenticación: no llevan datos ni el secreto)"""
+    response = assets.serve(filename, request)
+    if response is None:
+        return "Not found", 404
+    return response
+
+
+def _parse_after(value):
+    """Posición "updated_at|id" de la página anterior"""
+    updated_at, _, license_id = value.partition("|")
+    return datetime.fromisoformat(updated_at), int(license_id)
+
+
+@bp.route("/api/admin/changes")
+def changes():
+    """Licencias modificadas (fila o presencia) desde el cursor, por páginas
+
+    `since` es el cursor de la ronda; mientras la respuesta traiga `next`,
+    el panel pide la página siguiente con `after=<next>` y el mismo `since`.
+    """
+    if not require_admin(request):
+        return jsonify({"error": "UNAUTHORIZED"}), 401
+    
+    now = datetime.utcnow()
+    try:
+        since = datetime.fromisoformat(request.args.get("since", ""))
+        after = _parse_after(request.args["after"]) if request.args.get("after") else None
+    except ValueError:
+        return jsonify({"error": "Cursor inválido"}), 400
+    
+    # Eventos purgados: no se sabe qué se borró, el panel debe recargarse entero
+    if now - since > timedelta(hours=Config.EVENTS_RETENTION_HOURS):
+        return jsonify({"full_reload": True, "cursor": now.isoformat()})
+    
+    # Solape para no perder commits en vuelo con marcas de tiempo anteriores
+    floor = since - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+    query = License.query.filter(License.updated_at > floor)
+    if after:
+        query = query.filter(or_(License.updated_at > after[0],
+                                 and_(License.updated_at == after[0], License.id > after[1])))
+    lics = query.order_by(License.updated_at, License.id).limit(SYNC_PAGE_SIZE + 1).all()
+    more = len(lics) > SYNC_PAGE_SIZE
+    lics = lics[:SYNC_PAGE_SIZE]
+    
+    # Los borrados van en la primera página de la ronda
+    deleted = [] if after else db.session.query(LicenseEvent.key)\
+                        .filter(LicenseEvent.kind == "DELETED",
+                                LicenseEvent.created_at > floor).all()
+    
+    return jsonify({
+        "full_reload": False,
+        "cursor":      now.isoformat(),
+        "next":        f"{lics[-1].updated_at.isoformat()}|{lics[-1].id}" if more else None,
+        "now":         now.isoformat(),
+        "changes":     [_row(l) for l in lics],
+        "deleted":     sorted({k for (k,) in deleted}),
+        "stats":       stats.dashboard_counts(now),
+    })
+
+
+@bp.route("/api/admin/search")
+@replica_read
+def search_licenses():
+    """Búsqueda por prefijo de clave, usuario, hw_id, IP, plan y estado (ver search.py)"""
+    if not require_admin(request):
+        return jsonify({"error": "UNAUTHORIZED"}), 401
+    
+    conds = search.conditions(request.args)
+    if not conds:
+        return jsonify({"error": "Indica q, key, user, hw_id, ip, plan o revoked"}), 400
+    
+    limit = max(1, min(request.args.get("limit", 100, type=int), 500))
+    lics = License.query.filter(*conds)\
+                        .order_by(License.created_at.desc())\
+                        .limit(limit).all()
+    return jsonify({"results": [_row(l) for l in lics], "truncated": len(lics) == limit})
 
 
 @bp.route("/api/admin/revoke_ui/<key>")
@@ -67,6 +165,7 @@ def revoke_ui(key):
     lic = License.query.filter_by(key=key.upper()).first()
     if lic:
         lic.revoked = True
+        publish(lic.key, "REVOKED")
         db.session.commit()
     
     return redirect_panel(request.args.get("secret", ""))
@@ -81,6 +180,7 @@ def reactivate_ui(key):
     lic = License.query.filter_by(key=key.upper()).first()
     if lic:
         lic.revoked = False
+        publish(lic.key, "REACTIVATED")
         db.session.commit()
     
     return redirect_panel(request.args.get("secret", ""))
@@ -96,6 +196,7 @@ def reset_ui(key):
     if lic:
         lic.revoked = True
         lic.hw_id = ""
+        publish(lic.key, "RESET")
         db.session.commit()
         
         import threading
@@ -108,6 +209,7 @@ def reset_ui(key):
                 l = License.query.filter_by(key=k).first()
                 if l and l.revoked and not l.hw_id:
                     l.revoked = False
+                    publish(k, "REACTIVATED")
                     db.session.commit()
         
         threading.Thread(target=_reactivate, daemon=True).start()
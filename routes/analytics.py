@@ -4,22 +4,48 @@ routes/analytics.py - Endpoints de análisis y estadísticas
 
 import json
 from datetime import datetime, timedelta
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, send_file
+from sqlalchemy import tuple_
 from models import db, License, ActivityLog, DeviceHistory
 from utils import require_admin
+import replica
+from replica import replica_read
+import metrics
+import stats
+import license_stats
+import abuse
+import result_cache
+import profiler
+import reverse_index
+import reports
 
 bp = Blueprint('analytics', __name__)
 
 
+def _cached(cache_key, tags, compute):
+    """Respuesta JSON desde la caché de resultados (ver result_cache.py)"""
+    # Quien acaba de escribir (read-your-writes) recalcula en vez de leer la caché
+    (body, status), state = result_cache.get_or_compute(cache_key, tags, compute,
+                                                        refresh=replica.wants_primary())
+    return jsonify(body), status, {"X-Cache": state}
+
+
 @bp.route("/api/admin/license_details/<key>")
+@replica_read
 def license_details(key):
     """Información detallada de una licencia específica"""
     if not require_admin(request):
         return jsonify({"error": "UNAUTHORIZED"}), 401
     
-    lic = License.query.filter_by(key=key.upper()).first()
+    key = key.upper()
+    return _cached(f"license_details:{key}", [f"license:{key}"],
+                   lambda: _license_details(key))
+
+
+def _license_details(key):
+    lic = License.query.filter_by(key=key).first()
     if not lic:
-        return jsonify({"error": "No encontrada"}), 404
+        return {"error": "No encontrada"}, 404
     
     # Logs de actividad (últimos 100)
     logs = ActivityLog.query.filter_by(license_id=lic.id)\
@@ -30,13 +56,12 @@ def license_details(key):
     devices = DeviceHistory.query.filter_by(license_id=lic.id)\
                                  .order_by(DeviceHistory.last_seen.desc()).all()
     
-    # Estadísticas
-    total_attempts = len(logs)
-    success_count = sum(1 for log in logs if log.status == "SUCCESS")
-    failed_count = total_attempts - success_count
-    unique_ips = len(set(log.ip_address for log in logs if log.ip_address))
+    # Estadísticas de vida (contadores incrementales + HyperLogLog)
+    statistics = license_stats.license_statistics(lic)
+    # Exacto: DeviceHistory tiene una fila por dispositivo (no hace falta sketch)
+    statistics["unique_devices"] = len(devices)
     
-    return jsonify({
+    return {
         "license": {
             "key":              lic.key,
             "plan":             lic.plan,
@@ -51,22 +76,8 @@ def license_details(key):
             "device_info":      lic.device_info,
             "ip_address":       lic.ip_address,
         },
-        "statistics": {
-            "total_attempts": total_attempts,
-            "successful":     success_count,
-            "failed":         failed_count,
-            "unique_ips":     unique_ips,
-            "unique_devices": len(devices),
-        },
-        "recent_activity": [{
-            "timestamp":    log.timestamp.isoformat(),
-            "status":       log.status,
-            "hw_id":        log.hw_id[:20] + "..." if len(log.hw_id) > 20 else log.hw_id,
-            "ip":           log.ip_address,
-            "device_info":  log.device_info,
-            "error_detail": log.error_detail,
-            "app_version":  log.app_version,
-        } for log in logs],
+        "statistics": statistics,
+        "recent_activity": [_activity_row(log) for log in logs],
         "devices": [{
             "hw_id":        dev.hw_id,
             "device_info":  dev.device_info,
@@ -76,77 +87,184 @@ def license_details(key):
             "is_current":   dev.is_current,
             "ip_addresses": json.loads(dev.ip_addresses) if dev.ip_addresses else [],
         } for dev in devices]
+    }, 200
+
+
+def _activity_row(log):
+    return {
+        "id":           log.id,
+        "timestamp":    log.timestamp.isoformat(),
+        "status":       log.status,
+        "hw_id":        log.hw_id[:20] + "..." if len(log.hw_id) > 20 else log.hw_id,
+        "ip":           log.ip_address,
+        "device_info":  log.device_info,
+        "error_detail": log.error_detail,
+        "app_version":  log.app_version,
+    }
+
+
+@bp.route("/api/admin/license/<key>/activity")
+@replica_read
+def license_activity(key):
+    """
+    Historial de una licencia paginado por (timestamp, id), del más reciente
+    al más antiguo. Filtros: status (lista separada por comas), from, to.
+    La respuesta trae next_cursor para pedir la página siguiente (?cursor=).
+    """
+    if not require_admin(request):
+        return jsonify({"error": "UNAUTHORIZED"}), 401
+    
+    lic = License.query.filter_by(key=key.upper()).first()
+    if not lic:
+        return jsonify({"error": "No encontrada"}), 404
+    
+    limit = max(1, min(request.args.get("limit", 50, type=int), 500))
+    query = ActivityLog.query.filter(ActivityLog.license_id == lic.id)
+    try:
+        cursor = request.args.get("cursor")
+        if cursor:
+            ts, _, log_id = cursor.rpartition("_")
+            query = query.filter(tuple_(ActivityLog.timestamp, ActivityLog.id) <
+                                 tuple_(datetime.fromisoformat(ts), int(log_id)))
+        if request.args.get("from"):
+            query = query.filter(ActivityLog.timestamp >= datetime.fromisoformat(request.args["from"]))
+        if request.args.get("to"):
+            query = query.filter(ActivityLog.timestamp < datetime.fromisoformat(request.args["to"]))
+    except ValueError:
+        return jsonify({"error": "cursor, from y to deben ser fechas ISO válidas"}), 400
+    
+    statuses = [s for s in request.args.get("status", "").upper().split(",") if s]
+    if statuses:
+        query = query.filter(ActivityLog.status.in_(statuses))
+    
+    # El índice (license_id, timestamp) da el orden; se pide una fila de más para saber si sigue
+    logs = query.order_by(ActivityLog.timestamp.desc(), ActivityLog.id.desc())\
+                .limit(limit + 1).all()
+    more = len(logs) > limit
+    logs = logs[:limit]
+    
+    return jsonify({
+        "activity":    [_activity_row(log) for log in logs],
+        "next_cursor": f"{logs[-1].timestamp.isoformat()}_{logs[-1].id}" if more else None,
     })
 
 
 @bp.route("/api/admin/suspicious_activity")
+@replica_read
 def suspicious_activity():
     """Detecta actividad sospechosa"""
     if not require_admin(request):
         return jsonify({"error": "UNAUTHORIZED"}), 401
     
-    suspicious = []
-    
-    for lic in License.query.all():
-        devices = DeviceHistory.query.filter_by(license_id=lic.id).all()
-        
-        # Más de 2 dispositivos diferentes
-        if len(devices) > 2:
-            suspicious.append({
-                "key": lic.key,
-                "user": lic.user,
-                "reason": f"{len(devices)} dispositivos diferentes detectados",
-                "devices": len(devices),
-                "severity": "HIGH"
-            })
-        
-        # Intentos fallidos recientes
-        recent_fails = ActivityLog.query.filter(
-            ActivityLog.license_id == lic.id,
-            ActivityLog.status != "SUCCESS",
-            ActivityLog.timestamp > datetime.utcnow() - timedelta(days=1)
-        ).count()
-        
-        if recent_fails > 5:
-            suspicious.append({
-                "key": lic.key,
-                "user": lic.user,
-                "reason": f"{recent_fails} intentos fallidos en 24h",
-                "devices": len(devices),
-                "severity": "MEDIUM"
-            })
-        
-        # IPs muy diferentes
-        unique_ips = set()
-        for dev in devices:
-            if dev.ip_addresses:
-                unique_ips.update(json.loads(dev.ip_addresses))
-        
-        if len(unique_ips) > 5:
-            suspicious.append({
-                "key": lic.key,
-                "user": lic.user,
-                "reason": f"{len(unique_ips)} IPs diferentes",
-                "devices": len(devices),
-                "severity": "LOW"
-            })
-    
-    return jsonify({"suspicious_licenses": suspicious, "total": len(suspicious)})
+    days = request.args.get("days", type=int)
+    return _cached(f"suspicious_activity:{days}", [result_cache.FLEET],
+                   lambda: _suspicious_activity(days))
+
+
+def _suspicious_activity(days):
+    # Marcas mantenidas por el detector al registrar cada log (abuse.py)
+    suspicious = [{
+        "key":        key,
+        "user":       user,
+        "revoked":    revoked,
+        "rule":       flag.rule,
+        "reason":     flag.reason,
+        "value":      flag.value,
+        "severity":   flag.severity,
+        "first_seen": flag.first_seen.isoformat(),
+        "last_seen":  flag.last_seen.isoformat(),
+    } for flag, key, user, revoked in abuse.recent_flags(days)]
+    
+    return {"suspicious_licenses": suspicious, "total": len(suspicious)}, 200
+
+
+@bp.route("/api/admin/reverse_lookup")
+@replica_read
+def reverse_lookup():
+    """Licencias que han usado un dispositivo (hw_id) o una IP"""
+    if not require_admin(request):
+        return jsonify({"error": "UNAUTHORIZED"}), 401
+    
+    hw_id = (request.args.get("hw_id") or "").strip()
+    ip = (request.args.get("ip") or "").strip()
+    if bool(hw_id) == bool(ip):
+        return jsonify({"error": "Indica hw_id o ip"}), 400
+    
+    rows = reverse_index.licenses_by_device(hw_id) if hw_id else reverse_index.licenses_by_ip(ip)
+    return jsonify({
+        "hw_id": hw_id or None,
+        "ip":    ip or None,
+        "licenses": [{
+            "key":        lic.key,
+            "user":       lic.user,
+            "plan":       lic.plan,
+            "revoked":    lic.revoked,
+            "first_seen": first_seen.isoformat() if first_seen else None,
+            "last_seen":  last_seen.isoformat() if last_seen else None,
+        } for lic, first_seen, last_seen in rows],
+        "total": len(rows),
+    })
+
+
+@bp.route("/api/admin/shared_groups")
+@replica_read
+def shared_groups():
+    """Grupos de licencias que comparten dispositivos o IPs"""
+    if not require_admin(request):
+        return jsonify({"error": "UNAUTHORIZED"}), 401
+    
+    days = max(1, min(request.args.get("days", 30, type=int), 365))
+    min_size = max(2, request.args.get("min_size", 2, type=int))
+    ip_max = max(2, request.args.get("ip_max_licenses", 20, type=int))
+    limit = max(1, min(request.args.get("limit", 100, type=int), 1000))
+    return _cached(f"shared_groups:{days}:{min_size}:{ip_max}:{limit}", [result_cache.FLEET],
+                   lambda: (reverse_index.shared_groups(days, min_size, ip_max, limit), 200))
+
+
+@bp.route("/api/admin/reports")
+@replica_read
+def report_list():
+    """Informes offline disponibles y estado de la última ejecución"""
+    if not require_admin(request):
+        return jsonify({"error": "UNAUTHORIZED"}), 401
+    
+    return jsonify(reports.status())
+
+
+@bp.route("/api/admin/reports/<name>")
+@replica_read
+def report(name):
+    """Resultado de un informe offline (flask --app app run-reports)"""
+    if not require_admin(request):
+        return jsonify({"error": "UNAUTHORIZED"}), 401
+    
+    if name not in reports.REPORTS:
+        return jsonify({"error": "Informe desconocido", "reports": list(reports.REPORTS)}), 404
+    result = reports.load(name)
+    if result is None:
+        return jsonify({"error": "Informe aún no generado"}), 404
+    return jsonify(result)
 
 
 @bp.route("/api/admin/activity_summary")
+@replica_read
 def activity_summary():
     """Resumen de actividad general"""
     if not require_admin(request):
         return jsonify({"error": "UNAUTHORIZED"}), 401
     
+    return _cached("activity_summary", [result_cache.FLEET], _activity_summary)
+
+
+def _activity_summary():
     now = datetime.utcnow()
     last_24h = now - timedelta(days=1)
-    last_7d = now - timedelta(days=7)
     
-    # Licencias activas
-    active_24h = License.query.filter(License.last_seen >= last_24h).count()
-    active_7d = License.query.filter(License.last_seen >= last_7d).count()
+    # Licencias activas (contadores incrementales)
+    counts = stats.dashboard_counts(now)
+    
+    # Únicos de toda la flota (sketches HyperLogLog)
+    uniques = license_stats.fleet_uniques()
     
     # Intentos de validación
     attempts_24h = ActivityLog.query.filter(ActivityLog.timestamp >= last_24h).count()
@@ -155,21 +273,57 @@ def activity_summary():
         ActivityLog.status == "SUCCESS"
     ).count()
     
-    # Licencias inactivas
-    total_licenses = License.query.count()
-    inactive = License.query.filter(
-        (License.last_seen < last_7d) | (License.last_seen == None)
-    ).count()
-    
-    return jsonify({
+    return {
         "summary": {
-            "total_licenses":        total_licenses,
-            "active_last_24h":       active_24h,
-            "active_last_7d":        active_7d,
-            "inactive_7d":           inactive,
+            "total_licenses":        counts["total"],
+            "revoked":               counts["revoked"],
+            "by_plan":               counts["by_plan"],
+            "active_last_1h":        counts["active_1h"],
+            "active_last_24h":       counts["active_24h"],
+            "active_last_7d":        counts["active_7d"],
+            "inactive_7d":           counts["inactive"],
             "validation_attempts_24h": attempts_24h,
             "successful_24h":        success_24h,
             "failed_24h":            attempts_24h - success_24h,
+            "unique_ips_total":      uniques["ips"],
+            "unique_devices_total":  uniques["devices"],
         },
         "timestamp": now.isoformat()
-    })
\ No newline at end of file
+    }, 200
+
+
+@bp.route("/api/admin/metrics")
+def worker_metrics():
+    """Métricas internas del worker que atiende la petición"""
+    if not require_admin(request):
+        return jsonify({"error": "UNAUTHORIZED"}), 401
+    
+    return jsonify(metrics.snapshot())
+
+
+@bp.route("/api/admin/profiles")
+def profiles():
+    """Perfiles guardados por el profiler bajo demanda (X-Profile: N)"""
+    if not require_admin(request):
+        return jsonify({"error": "UNAUTHORIZED"}), 401
+    
+    return jsonify({"armed": profiler.armed(), "profiles": profiler.list_profiles()})
+
+
+@bp.route("/api/admin/profiles/<name>")
+def download_profile(name):
+    """Descarga un perfil (.prof de pstats) o su resumen con ?format=text"""
+    if not require_admin(request):
+        return jsonify({"error": "UNAUTHORIZED"}), 401
+    
+    path = profiler.profile_path(name)
+    if path is None:
+        return jsonify({"error": "No encontrado"}), 404
+    if request.args.get("format") == "text":
+        limit = min(int(request.args.get("limit", 40)), 500)
+        sort = request.args.get("sort", "cumulative")
+        if sort not in ("cumulative", "tottime", "ncalls"):
+            return jsonify({"error": "sort debe ser cumulative, tottime o ncalls"}), 400
+        return profiler.summary(name, limit, sort), 200, {"Content-Type": "text/plain; charset=utf-8"}
+    return send_file(path, mimetype="application/octet-stream", as_attachment=True,
+                     download_name=name)
@@ -0,0 +1,62 @@
+"""
+routes/data_transfer.py - Exportación e importación masiva de datos (admin)
+"""
+
+from datetime import datetime
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from utils import require_admin
+from replica import replica_read
+import exporter
+import importer
+
+bp = Blueprint('data_transfer', __name__)
+
+
+@bp.route("/api/admin/export/activity")
+@replica_read
+def export_activity():
+    """Exporta ActivityLog en streaming (CSV o NDJSON, opcionalmente gzip)"""
+    if not require_admin(request):
+        return jsonify({"error": "UNAUTHORIZED"}), 401
+
+    fmt = request.args.get("format", "csv").lower()
+    compress = request.args.get("gzip", "") in ("1", "true")
+
+    try:
+        filters = exporter.parse_filters(request.args)
+        body = exporter.stream_export(filters, fmt, compress)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    filename = f"activity_{datetime.utcnow():%Y%m%d_%H%M%S}.{fmt}" + (".gz" if compress else "")
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    if compress:
+        mimetype = "application/gzip"
+
+    return Response(stream_with_context(body), mimetype=mimetype, headers={
+        "Content-Disposition": f"attachment; filename={filename}",
+        "X-Accel-Buffering":   "no",
+    })
+
+
+@bp.route("/api/admin/import/licenses", methods=["POST"])
+def import_licenses():
+    """Importa licencias en bloque desde CSV o NDJSON"""
+    if not require_admin(request):
+        return jsonify({"error": "UNAUTHORIZED"}), 401
+
+    upload = request.files.get("file")
+    stream = upload.stream if upload else request.stream
+    filename = upload.filename if upload else ""
+
+    fmt = request.args.get("format", "").lower()
+    if not fmt:
+        is_json = filename.endswith((".ndjson", ".jsonl")) or "json" in (request.mimetype or "")
+        fmt = "ndjson" if is_json else "csv"
+
+    try:
+        result = importer.import_licenses(stream, fmt)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(result.to_dict()), 200
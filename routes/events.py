@@ -0,0 +1,116 @@
+"""
+routes/events.py - Canal push de revocaciones para bots conectados (SSE / long-poll)
+"""
+
+import json
+import time
+from datetime import datetime
+from flask import Blueprint, request, jsonify, Response, current_app, g
+from config import Config
+from models import db, License
+from events import hub, TERMINAL_EVENTS
+
+bp = Blueprint('events', __name__)
+
+
+def _sse(event, data):
+    """Formatea un mensaje Server-Sent Events"""
+    lines = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    if "id" in data:
+        lines = f"id: {data['id']}\n" + lines
+    return lines
+
+
+def _stream(sub):
+    """Mantiene la conexión abierta hasta un evento terminal o EVENTS_MAX_DURATION"""
+    yield "retry: 5000\n" + _sse("ready", {"key": sub.key})
+    deadline = time.monotonic() + Config.EVENTS_MAX_DURATION
+
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            yield _sse("reconnect", {})
+            return
+
+        pending = sub.wait(min(Config.EVENTS_KEEPALIVE, remaining))
+        if not pending:
+            yield ": keepalive\n\n"
+            continue
+
+        for ev in pending:
+            yield _sse(ev["kind"].lower(), ev)
+        if any(ev["kind"] in TERMINAL_EVENTS for ev in pending):
+            return
+
+
+@bp.route("/api/events")
+def events():
+    """Conexión persistente que avisa al bot cuando su licencia cambia"""
+    key   = (request.args.get("key") or request.headers.get("X-License-Key") or "").strip().upper()
+    hw_id = (request.args.get("hw_id") or request.headers.get("X-HW-ID") or "").strip()
+
+    if not key or not hw_id:
+        return jsonify({"error": "INVALID"}), 403
+
+    # Solo lectura: en SQLite no pide el bloqueo de escritura (ver sqlite_tuning)
+    g.read_only = True
+
+    if not hub.acquire():
+        return jsonify({"error": "BUSY", "retry_after": 30}), 503, {"Retry-After": "30"}
+
+    sub = None
+    closed = []
+
+    def _cleanup():
+        if not closed:
+            closed.append(True)
+            if sub is not None:
+                hub.unsubscribe(sub)
+            hub.release()
+
+    # Hasta entregar la respuesta cualquier error (p. ej. la BD caída) debe
+    # devolver el hueco de conexión y la suscripción
+    try:
+        # Suscribirse antes de leer la licencia: un cambio posterior a la
+        # lectura llega siempre al buzón
+        sub = hub.subscribe(current_app._get_current_object(), key)
+
+        lic = License.query.filter_by(key=key).first()
+        error = None
+        if not lic:
+            error = "INVALID"
+        elif lic.revoked:
+            error = "REVOKED"
+        elif lic.expires_at and datetime.utcnow() > lic.expires_at:
+            error = "EXPIRED"
+        elif lic.hw_id != hw_id:
+            error = "WRONG_DEVICE"
+
+        # No retener la conexión ni la transacción mientras la petición espera
+        db.session.close()
+    except BaseException:
+        _cleanup()
+        raise
+
+    if error:
+        _cleanup()
+        return jsonify({"error": error}), 403
+
+    # Modo long-poll: una respuesta JSON por evento o por timeout
+    if request.args.get("mode") == "poll":
+        try:
+            pending = sub.wait(Config.EVENTS_LONGPOLL_TIMEOUT)
+        finally:
+            _cleanup()
+        return jsonify({"events": pending})
+
+    try:
+        response = Response(_stream(sub), mimetype="text/event-stream", headers={
+            "Cache-Control":     "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+        response.call_on_close(_cleanup)
+    except BaseException:
+        _cleanup()
+        raise
+    return response
@@ -3,12 +3,41 @@ routes/validation.py - Endpoints de validación de licencias (API pública)
 """
 
 from datetime import datetime
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, after_this_request
+from sqlalchemy import update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.attributes import flag_modified
 from models import db, License, DeviceHistory
-from utils import log_activity, get_device_info, get_client_ip
+from config import Config
+from utils import log_activity, get_client_ip
+from admission import AdmissionControl
+from events import publish
+from snapshot import snapshot, Record
+import metrics
+import device_info
+import stats
+import result_cache
 
 bp = Blueprint('validation', __name__)
 
+# Máximo de validaciones en curso por worker; el resto espera poco o recibe BUSY
+admission = AdmissionControl(
+    "validate",
+    max_inflight=Config.VALIDATE_MAX_INFLIGHT,
+    max_queue=Config.VALIDATE_MAX_QUEUE,
+    queue_timeout=Config.VALIDATE_QUEUE_TIMEOUT,
+    retry_after=Config.VALIDATE_RETRY_AFTER,
+    grace_seconds=Config.VALIDATE_GRACE_SECONDS,
+)
+admission.install(bp)
+
+# Rechazos que se pueden decidir con la instantánea, sin leer la BD
+REJECTIONS = {
+    "REVOKED":      "Licencia revocada",
+    "EXPIRED":      "Licencia expirada",
+    "WRONG_DEVICE": "Intento desde dispositivo no autorizado",
+}
+
 
 @bp.route("/api/validate", methods=["POST"])
 def validate():
@@ -22,11 +51,68 @@ def validate():
     if not key or not hw_id:
         return jsonify({"error": "INVALID"}), 403
 
+    # Cada validación añade un log: license_details de este worker se recalcula.
+    # Las validaciones no publican eventos, así que en los demás workers puede
+    # seguir en caché hasta ANALYTICS_CACHE_TTL + ANALYTICS_CACHE_STALE segundos
+    @after_this_request
+    def _invalidate_details(response):
+        result_cache.invalidate([f"license:{key}"])
+        return response
+
+    # Instantánea compartida (snapshot.py): los rechazos no leen la BD
+    record = snapshot.lookup(key)
+    if isinstance(record, Record) and record.fresh and record.decision(hw_id) in REJECTIONS:
+        return _reject_from_snapshot(record, key, hw_id, ip, app_version)
+
+    try:
+        return _validate_db(key, hw_id, ip, app_version)
+    except SQLAlchemyError:
+        db.session.rollback()
+        current_app.logger.exception("BD no disponible en /api/validate")
+        return _from_snapshot(record, hw_id)
+
+
+def _accepted(lic):
+    return {
+        "valid":      True,
+        "plan":       lic.plan,
+        "user":       lic.user,
+        "expires_at": lic.expires_at.isoformat() if lic.expires_at else "lifetime",
+    }
+
+
+def _reject_from_snapshot(record, key, hw_id, ip, app_version):
+    """Rechazo decidido con la instantánea; el log se pierde si la BD no responde"""
+    error = record.decision(hw_id)
+    try:
+        lic = License(id=record.license_id, key=key, revoked=record.revoked)
+        log_activity(lic, hw_id, ip, error, REJECTIONS[error], app_version)
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        metrics.incr("validate_log_dropped")
+    return jsonify({"error": error}), 403
+
+
+def _from_snapshot(record, hw_id):
+    """Respuesta con la BD caída: la instantánea si la decide, si no BUSY"""
+    if isinstance(record, Record) and record.decision(hw_id) is None:
+        metrics.incr("validate_snapshot_fallback")
+        response = jsonify(_accepted(record))
+        response.headers["X-Decision-Source"] = "snapshot"
+        return response, 200
+    # Sin instantánea, clave con cambios recientes, creada después de la
+    # instantánea (MISSING) o primer uso (hay que escribir)
+    return admission.busy_response()
+
+
+def _validate_db(key, hw_id, ip, app_version):
+    """Validación completa contra la BD"""
     lic = License.query.filter_by(key=key).first()
 
     if not lic:
-        # Log de intento fallido con clave inválida
-        fake_lic = License(id=0, key=key)
+        # Log de intento fallido con clave inválida (sin licencia: license_id NULL)
+        fake_lic = License(key=key)
         log_activity(fake_lic, hw_id, ip, "INVALID", "Clave no existe", app_version)
         db.session.commit()
         return jsonify({"error": "INVALID"}), 403
@@ -44,11 +130,17 @@ def validate():
         return jsonify({"error": "EXPIRED"}), 403
 
     # Vincular dispositivo en el primer uso
-    if not lic.hw_id:
+    binding = not lic.hw_id
+    if binding:
         lic.hw_id = hw_id
         lic.first_activation = datetime.utcnow()
-        lic.device_info = get_device_info(request.headers.get('User-Agent', ''))
-        lic.ip_address = ip
+        user_agent = request.headers.get('User-Agent', '')
+        info = device_info.describe_now(user_agent)
+        lic.device_info = info or ""
+        if info is None:
+            device_info.backfill(db.session, user_agent, ("license", lic.id))
+        # El constructor de la instantánea relee las claves con eventos
+        publish(key, "ACTIVATED")
     elif lic.hw_id != hw_id:
         log_activity(lic, hw_id, ip, "WRONG_DEVICE", 
                     "Intento desde dispositivo no autorizado", app_version)
@@ -56,24 +148,31 @@ def validate():
         return jsonify({"error": "WRONG_DEVICE"}), 403
 
     # Actualizar última actividad
-    lic.last_seen   = datetime.utcnow()
+    now = datetime.utcnow()
+    # Un heartbeat solo es un cambio para el delta-sync del panel si cambia
+    # la presencia (bucket de last_seen), la IP o el dispositivo: si no, se
+    # reescribe el updated_at que ya tenía en lugar de aplicar el onupdate
+    quiet = (not binding and lic.ip_address == ip and lic.last_seen is not None
+             and stats.bucket_of(lic.last_seen) == stats.bucket_of(now))
+    lic.last_seen   = now
     lic.activations += 1
     lic.ip_address  = ip
+    if quiet:
+        flag_modified(lic, "updated_at")
     
-    # Log exitoso
-    log_activity(lic, hw_id, ip, "SUCCESS", "", app_version)
+    if binding:
+        # El dispositivo vinculado pasa a ser el actual: se desmarcan los demás
+        db.session.execute(update(DeviceHistory.__table__)
+                           .where(DeviceHistory.license_id == lic.id,
+                                  DeviceHistory.hw_id != hw_id,
+                                  DeviceHistory.is_current.is_(True))
+                           .values(is_current=False))
     
-    # Marcar dispositivo actual
-    DeviceHistory.query.filter_by(license_id=lic.id).update({"is_current": False})
-    current_device = DeviceHistory.query.filter_by(license_id=lic.id, hw_id=hw_id).first()
-    if current_device:
-        current_device.is_current = True
+    # Log exitoso (marca el dispositivo como actual en el mismo UPSERT)
+    log_activity(lic, hw_id, ip, "SUCCESS", "", app_version)
     
+    # Respuesta antes del commit: después habría que recargar la licencia
+    body = _accepted(lic)
     db.session.commit()
 
-    return jsonify({
-        "valid":      True,
-        "plan":       lic.plan,
-        "user":       lic.user,
-        "expires_at": lic.expires_at.isoformat() if lic.expires_at else "lifetime",
-    }), 200
\ No newline at end of file
+    return jsonify(body), 200
@@ -0,0 +1,127 @@
+"""
+search.py - Búsqueda indexada de licencias (/api/admin/search)
+
+  • key       prefijo, como rango [prefijo, siguiente) sobre el índice único
+  • user      subcadena: en PostgreSQL ILIKE sobre un índice GIN de trigramas
+              (pg_trgm); en SQLite una tabla FTS5 con tokenizer trigram
+              (license_search) que mantienen triggers sobre license
+  • hw_id/ip  igualdad sobre los índices de License.hw_id y License.ip_address
+
+Los términos de menos de 3 caracteres no tienen trigramas y se resuelven
+con LIKE. Si la BD no tiene pg_trgm o FTS5 se usa LIKE igualmente (más
+lento, mismo resultado).
+"""
+
+from flask import current_app
+from sqlalchemy import text, or_, column
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, License
+
+FTS_TABLE = "license_search"
+TRGM_INDEX = "ix_license_user_trgm"
+
+_SQLITE_DDL = (
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        "user", content='license', content_rowid='id', tokenize='trigram')""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON license BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, "user") VALUES (new.id, new."user");
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON license BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, "user") VALUES ('delete', old.id, old."user");
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF "user" ON license BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, "user") VALUES ('delete', old.id, old."user");
+        INSERT INTO {FTS_TABLE}(rowid, "user") VALUES (new.id, new."user");
+    END""",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+)
+
+_available = {}     # dialecto -> hay índice de texto en la BD
+
+
+def sync_indexes(conn):
+    """Crea el índice de texto de `user` si falta (lo llama sync_schema)"""
+    name = conn.dialect.name
+    try:
+        # Savepoint: en PostgreSQL un error abortaría la transacción de sync_schema
+        with conn.begin_nested():
+            if name == "sqlite":
+                exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :n"),
+                                      {"n": FTS_TABLE}).first()
+                if not exists:
+                    for stmt in _SQLITE_DDL:
+                        conn.execute(text(stmt))
+            elif name == "postgresql":
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(text(f'CREATE INDEX IF NOT EXISTS {TRGM_INDEX} '
+                                  f'ON license USING gin ("user" gin_trgm_ops)'))
+    except SQLAlchemyError as e:
+        # Sin FTS5 / sin permiso para pg_trgm: la búsqueda usa LIKE
+        current_app.logger.warning("Índice de búsqueda de usuarios no disponible: %s", e)
+    _available.pop(name, None)
+
+
+def _text_index():
+    name = db.session.get_bind().dialect.name
+    if name not in _available:
+        if name == "sqlite":
+            query = "SELECT 1 FROM sqlite_master WHERE name = :n"
+            target = FTS_TABLE
+        elif name == "postgresql":
+            query = "SELECT 1 FROM pg_indexes WHERE indexname = :n"
+            target = TRGM_INDEX
+        else:
+            return name, False
+        _available[name] = db.session.execute(text(query), {"n": target}).first() is not None
+    return name, _available[name]
+
+
+def _like_pattern(value):
+    return "%" + value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+# ── Condiciones ─────────────────────────────────────────────────
+
+def key_prefix(prefix):
+    """key empieza por `prefix` (rango sobre el índice, sin LIKE)"""
+    prefix = prefix.upper()
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return (License.key >= prefix) & (License.key < upper)
+
+
+def user_contains(value):
+    """user contiene `value` (sin distinguir mayúsculas)"""
+    dialect, indexed = _text_index()
+    if dialect != "sqlite":
+        # PostgreSQL: ILIKE usa el índice de trigramas (3+ caracteres)
+        return License.user.ilike(_like_pattern(value), escape="\\")
+    if indexed and len(value) >= 3:
+        phrase = '"' + value.replace('"', '""') + '"'
+        matches = text(f'SELECT rowid FROM {FTS_TABLE} WHERE "user" MATCH :user_phrase')\
+            .bindparams(user_phrase=phrase).columns(column("rowid"))
+        return License.id.in_(matches)
+    return License.user.contains(value, autoescape=True)
+
+
+def conditions(args):
+    """Condiciones (AND) a partir de los parámetros de /api/admin/search"""
+    value = lambda name: (args.get(name) or "").strip()
+    conds = []
+    if value("q"):
+        # Búsqueda libre: cualquiera de los campos indexados
+        q = value("q")
+        conds.append(or_(key_prefix(q), user_contains(q), License.hw_id == q,
+                         License.ip_address == q))
+    if value("key"):
+        conds.append(key_prefix(value("key")))
+    if value("user"):
+        conds.append(user_contains(value("user")))
+    if value("hw_id"):
+        conds.append(License.hw_id == value("hw_id"))
+    if value("ip"):
+        conds.append(License.ip_address == value("ip"))
+    if args.get("plan"):
+        conds.append(License.plan == args["plan"])
+    if args.get("revoked") in ("true", "false"):
+        conds.append(License.revoked == (args["revoked"] == "true"))
+    return conds
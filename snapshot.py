@@ -0,0 +1,355 @@
+"""
+snapshot.py - Instantánea de licencias en un fichero compartido por los workers
+
+Formato (little-endian): una cabecera fija y registros de ancho fijo
+ordenados por clave, así que una búsqueda es una bisección sobre el mmap sin
+deserializar nada:
+
+    cabecera  magic(8) | nº registros (u32) | tamaño registro (u16) |
+              construido (f64, epoch) | última reconstrucción completa (f64) |
+              último evento aplicado (u64) | identidad de la BD (32, ascii)
+    registro  key(32) | license_id (u32) | revoked (u8) | expires (i64, -1 = lifetime) |
+              hw_id(64) | user(128, utf-8 truncado) | plan(20)
+
+Todos los workers mapean el mismo fichero en solo lectura (el sistema
+operativo comparte las páginas) y lo vuelven a abrir cuando cambia. Uno solo
+de ellos, el que consigue el flock de `<fichero>.lock`, lo regenera: aplica
+los LicenseEvent nuevos releyendo solo las licencias afectadas, escribe un
+fichero temporal y lo cambia con os.replace (atómico). Las claves con eventos
+más recientes que la instantánea se consultan en la BD hasta la siguiente
+versión, y ningún rechazo se decide con ella mientras el bus del worker haya
+visto eventos que aún no incluye.
+
+La cabecera guarda la identidad de la BD (database.instance_id). Si la BD
+cambia o se restaura (sus eventos quedan por detrás de la instantánea), el
+constructor la regenera entera en el siguiente paso y, mientras tanto, los
+workers no deciden nada con ella.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime
+from flask import g
+from sqlalchemy import select, func
+from config import Config
+from models import db, License, LicenseEvent
+import database
+import metrics
+
+MAGIC = b"LSNAP002"
+HEADER = struct.Struct("<8sIHddQ32s")
+RECORD = struct.Struct("<32sIBxxxq64s128s20s")
+KEY_SIZE = 32
+
+# Eventos antes del último aplicado que se releen por si hubo commits desordenados
+OVERLAP = 100
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class Record:
+    """Datos de una licencia leídos de la instantánea"""
+    __slots__ = ("key", "license_id", "revoked", "expires_at", "hw_id", "user", "plan", "fresh")
+
+    def __init__(self, raw):
+        key, self.license_id, revoked, expires, hw_id, user, plan = RECORD.unpack(raw)
+        self.key = key.rstrip(b"\0").decode("ascii")
+        self.revoked = bool(revoked)
+        self.expires_at = None if expires < 0 else datetime.utcfromtimestamp(expires)
+        self.hw_id = hw_id.rstrip(b"\0").decode("utf-8", "replace")
+        self.user = user.rstrip(b"\0").decode("utf-8", "ignore")
+        self.plan = plan.rstrip(b"\0").decode("utf-8", "replace")
+        # La instantánea incluye todo evento que ha visto el bus de este worker
+        self.fresh = False
+
+    def decision(self, hw_id, now=None):
+        """Error de validación (como validate), "UNBOUND" o None si es válida"""
+        if self.revoked:
+            return "REVOKED"
+        if self.expires_at and (now or datetime.utcnow()) > self.expires_at:
+            return "EXPIRED"
+        if not self.hw_id:
+            return "UNBOUND"
+        if self.hw_id != hw_id:
+            return "WRONG_DEVICE"
+        return None
+
+
+def _fit(text, size):
+    data = (text or "").encode("utf-8")[:size]
+    return data.decode("utf-8", "ignore").encode("utf-8")
+
+
+def pack(lic):
+    """Registro binario de una licencia"""
+    expires = -1 if lic.expires_at is None else int((lic.expires_at - _EPOCH).total_seconds())
+    return RECORD.pack(lic.key.encode("ascii"), lic.id, 1 if lic.revoked else 0, expires,
+                       _fit(lic.hw_id, 64), _fit(lic.user, 128), _fit(lic.plan, 20))
+
+
+# ── Lectura (todos los workers) ─────────────────────────────────
+
+class _Mapped:
+    __slots__ = ("mm", "count", "built_at", "full_at", "event_id", "instance", "identity")
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.identity = (st.st_ino, st.st_mtime_ns)
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, size, self.built_at, self.full_at, self.event_id, instance = \
+            HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or size != RECORD.size:
+            raise ValueError("Instantánea con formato desconocido")
+        self.instance = instance.rstrip(b"\0").decode("ascii", "replace")
+
+    def raw(self, i):
+        offset = HEADER.size + i * RECORD.size
+        return self.mm[offset:offset + RECORD.size]
+
+    def find(self, key):
+        target = key.encode("ascii", "replace")[:KEY_SIZE].ljust(KEY_SIZE, b"\0")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = HEADER.size + mid * RECORD.size
+            current = self.mm[offset:offset + KEY_SIZE]
+            if current < target:
+                lo = mid + 1
+            elif current > target:
+                hi = mid
+            else:
+                return Record(self.mm[offset:offset + RECORD.size])
+        return None
+
+
+class Snapshot:
+    """Instantánea mapeada en memoria más las claves cambiadas desde que se generó"""
+
+    MISSING = object()
+
+    def __init__(self):
+        self.path = None
+        self._current = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._dirty = {}        # clave -> id del evento que la cambió
+        self._dirty_all = 0     # id de un evento "*" aún no incluido
+        self._thread = None
+        self.hub = None         # EventHub del worker (ver init_app)
+        self._stats = {"hits": 0, "missing": 0, "dirty": 0, "unavailable": 0, "stale": 0,
+                       "reloads": 0, "builds": 0, "full_builds": 0, "builder": False}
+
+    def _reload(self):
+        """Reabre el fichero si lo ha sustituido el constructor (como mucho 1 vez/s)"""
+        now = time.monotonic()
+        if now - self._checked < 1.0:
+            return self._current
+        self._checked = now
+        try:
+            st = os.stat(self.path)
+            if self._current is None or self._current.identity != (st.st_ino, st.st_mtime_ns):
+                # La versión anterior se libera sola cuando nadie la usa
+                previous, self._current = self._current, _Mapped(self.path)
+                self._stats["reloads"] += 1
+                if previous is not None and previous.instance != self._current.instance:
+                    # Ids de eventos de otra BD: no se pueden comparar
+                    self._forget(float("inf"))
+                self._forget(self._current.event_id)
+        except (OSError, ValueError):
+            self._current = None
+        return self._current
+
+    def _forget(self, event_id):
+        with self._lock:
+            self._dirty = {k: v for k, v in self._dirty.items() if v > event_id}
+            if self._dirty_all <= event_id:
+                self._dirty_all = 0
+
+    def lookup(self, key):
+        """Record, MISSING (no estaba al generarla) o None (hay que preguntar a la BD)"""
+        if not self.path:
+            return None
+        current = self._reload()
+        if current is None:
+            self._stats["unavailable"] += 1
+            return None
+        with self._lock:
+            if self._dirty_all > current.event_id or self._dirty.get(key, 0) > current.event_id:
+                self._stats["dirty"] += 1
+                return None
+        record = current.find(key)
+        if record is None:
+            self._stats["missing"] += 1
+            return self.MISSING
+        # Un bus sin línea base o con eventos posteriores a la instantánea
+        # puede no haber marcado aún la clave como cambiada; una instantánea
+        # de otra BD (o de antes de restaurarla) no vale para nada
+        version = self.hub.version if self.hub else None
+        record.fresh = version is not None and current.event_id >= version \
+            and current.instance == self.hub.instance
+        self._stats["hits" if record.fresh else "stale"] += 1
+        return record
+
+    def on_event(self, event):
+        """Listener del bus: la clave deja de leerse de la instantánea hasta la próxima"""
+        with self._lock:
+            if event["key"] == "*":
+                self._dirty_all = max(self._dirty_all, event["id"])
+            else:
+                self._dirty[event["key"]] = max(self._dirty.get(event["key"], 0), event["id"])
+
+    def stats(self):
+        current = self._current
+        with self._lock:
+            data = dict(self._stats, dirty_keys=len(self._dirty))
+        if current is not None:
+            data.update(records=current.count, event_id=current.event_id,
+                        age=round(time.time() - current.built_at, 1))
+        return data
+
+    # ── Construcción (un solo worker, el que tiene el flock) ────
+
+    def start(self, app):
+        """Arranca el hilo que mantiene la instantánea (idempotente)"""
+        if not self.path or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(app,), daemon=True,
+                                            name="license-snapshot")
+            self._thread.start()
+
+    def _run(self, app):
+        lock_file = None
+        builder = None
+        while True:
+            try:
+                if lock_file is None:
+                    lock_file = self._try_lock()
+                if lock_file is not None:
+                    self._stats["builder"] = True
+                    with app.app_context():
+                        g.read_only = True
+                        builder = builder or _Builder(self.path)
+                        builder.step()
+                        self._stats["builds"] = builder.builds
+                        self._stats["full_builds"] = builder.full_builds
+            except Exception:
+                app.logger.exception("Error generando la instantánea de licencias")
+                builder = None
+            time.sleep(Config.SNAPSHOT_INTERVAL)
+
+    def _try_lock(self):
+        f = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return f
+        except OSError:
+            f.close()
+            return None
+
+
+class _Builder:
+    """Mantiene en memoria los registros y reescribe el fichero cuando hay eventos"""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        self.event_id = 0
+        self.full_at = 0.0
+        self.instance = ""
+        self.builds = 0
+        self.full_builds = 0
+        try:
+            current = _Mapped(path)
+            for i in range(current.count):
+                raw = current.raw(i)
+                self.records[raw[:KEY_SIZE]] = raw
+            self.event_id = current.event_id
+            self.full_at = current.full_at
+            self.instance = current.instance
+        except (OSError, ValueError):
+            pass
+
+    def step(self):
+        instance = database.instance_id()
+        oldest, latest = db.session.query(func.min(LicenseEvent.id),
+                                          func.max(LicenseEvent.id)).one()
+        if latest is not None and latest < self.event_id and instance == self.instance:
+            # Misma BD con menos eventos que la instantánea: se ha restaurado.
+            # Identidad nueva para que ningún worker use la instantánea vieja
+            db.session.rollback()
+            g.read_only = False
+            instance = database.rotate_instance_id(instance)
+            g.read_only = True
+        if instance != self.instance or not self.records \
+                or time.time() - self.full_at > Config.SNAPSHOT_FULL_INTERVAL \
+                or (oldest or 0) > self.event_id + 1:
+            return self.full(instance)
+
+        if (latest or 0) <= self.event_id:
+            return
+        keys = {k for (k,) in db.session.query(LicenseEvent.key)
+                                       .filter(LicenseEvent.id > self.event_id - OVERLAP)}
+        if "*" in keys:
+            return self.full()
+
+        for key in keys:
+            self.records.pop(key.encode("ascii", "replace")[:KEY_SIZE].ljust(KEY_SIZE, b"\0"), None)
+        for lic in License.query.filter(License.key.in_(keys)):
+            raw = pack(lic)
+            self.records[raw[:KEY_SIZE]] = raw
+        self.event_id = latest
+        self.write()
+
+    def full(self, instance):
+        # El id se lee antes que las licencias: lo posterior se aplicará después
+        self.instance = instance
+        self.event_id = db.session.query(func.max(LicenseEvent.id)).scalar() or 0
+        records = {}
+        stmt = select(License).execution_options(yield_per=2000)
+        for lic in db.session.scalars(stmt):
+            raw = pack(lic)
+            records[raw[:KEY_SIZE]] = raw
+        self.records = records
+        self.full_at = time.time()
+        self.full_builds += 1
+        self.write()
+
+    def write(self):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(self.records), RECORD.size, time.time(), self.full_at,
+                                self.event_id, self.instance.encode("ascii")))
+            for k in sorted(self.records):
+                f.write(self.records[k])
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.builds += 1
+        metrics.incr("snapshot_builds")
+
+
+snapshot = Snapshot()
+
+
+def start(app):
+    """Arranca el constructor en este worker (tras el fork)"""
+    snapshot.start(app)
+
+
+def init_app(app):
+    """Configura la ruta y engancha la instantánea al bus de eventos"""
+    from events import hub
+    snapshot.path = Config.SNAPSHOT_PATH or None
+    snapshot.hub = hub
+    # baseline: las claves con eventos anteriores al arranque del worker pero
+    # posteriores a la instantánea tampoco se pueden leer de ella
+    hub.add_listener(snapshot.on_event, baseline=True)
+    metrics.register("snapshot", snapshot.stats)
@@ -0,0 +1,138 @@
+"""
+sqlite_tuning.py - Perfil de SQLite para varios workers escribiendo a la vez
+
+  • Cada conexión nueva fija WAL, synchronous=NORMAL, busy_timeout, mmap_size,
+    cache_size y temp_store (SQLITE_TUNING=0 lo desactiva).
+  • Las transacciones empiezan con BEGIN IMMEDIATE: el
+    bloqueo de escritura se pide al principio y, si está ocupado, se espera
+    busy_timeout. Con BEGIN diferido, una transacción que lee y luego escribe
+    falla con "database is locked" si otro worker escribió entretanto, y
+    busy_timeout no lo evita.
+  • Lo marcado con g.read_only (vistas @replica_read, /api/events, el hilo
+    lector de eventos) usa BEGIN normal para no hacer cola con las
+    escrituras; en WAL las lecturas van en paralelo.
+  • PRAGMA foreign_keys=ON siempre (también con SQLITE_TUNING=0): sin él
+    SQLite ignora las claves foráneas y el ON DELETE CASCADE de los modelos.
+  • Un hilo por worker hace checkpoint del WAL cada SQLITE_CHECKPOINT_INTERVAL
+    y ANALYZE (acotado) cada SQLITE_ANALYZE_INTERVAL. También a mano con
+    `flask --app app sqlite-maintenance`.
+"""
+
+import random
+import sqlite3
+import threading
+import time
+from flask import g, has_app_context
+from sqlalchemy import event as sa_event
+from sqlalchemy.engine import Engine
+from config import Config
+import metrics
+
+# Filas por índice que lee ANALYZE en el mantenimiento periódico
+ANALYSIS_LIMIT = 1000
+
+_lock = threading.Lock()
+_thread = None
+
+
+def _pragmas():
+    return (
+        ("journal_mode", "WAL"),
+        ("synchronous",  "NORMAL"),
+        ("busy_timeout", Config.SQLITE_BUSY_TIMEOUT_MS),
+        ("mmap_size",    Config.SQLITE_MMAP_SIZE),
+        ("cache_size",   -Config.SQLITE_CACHE_SIZE_KB),
+        ("temp_store",   "MEMORY"),
+    )
+
+
+@sa_event.listens_for(Engine, "connect")
+def _enable_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute("PRAGMA foreign_keys=ON")
+
+
+@sa_event.listens_for(Engine, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    if not Config.SQLITE_TUNING or not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    # pysqlite emite sus propios BEGIN diferidos; los desactivamos y los pone _on_begin
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    for name, value in _pragmas():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+    connection_record.info["sqlite_tuned"] = True
+
+
+@sa_event.listens_for(Engine, "begin")
+def _on_begin(conn):
+    if not conn.info.get("sqlite_tuned"):
+        return
+    read_only = has_app_context() and g.get("read_only")
+    conn.exec_driver_sql("BEGIN" if read_only else "BEGIN IMMEDIATE")
+
+
+# ── Mantenimiento ───────────────────────────────────────────────
+
+def checkpoint(engine, mode="TRUNCATE"):
+    """Vuelca el WAL a la BD; devuelve (busy, páginas en el WAL, volcadas)"""
+    raw = engine.raw_connection()
+    try:
+        row = raw.cursor().execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    finally:
+        raw.close()
+    metrics.incr("sqlite_checkpoints")
+    metrics.set_gauge("sqlite_wal_pages", row[1])
+    return tuple(row)
+
+
+def analyze(engine, limit=ANALYSIS_LIMIT):
+    """Actualiza las estadísticas del planificador (limit=0 lee los índices enteros)"""
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.execute(f"PRAGMA analysis_limit={int(limit)}")
+        cursor.execute("ANALYZE")
+    finally:
+        raw.close()
+    metrics.incr("sqlite_analyze")
+
+
+def start(app):
+    """Arranca el hilo de mantenimiento del worker si la BD es SQLite (idempotente)"""
+    global _thread
+    if _thread is not None:
+        return
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_run, args=(app,), daemon=True,
+                                   name="sqlite-maintenance")
+        _thread.start()
+
+
+def _run(app):
+    from models import db
+
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != "sqlite" or not Config.SQLITE_TUNING:
+        return
+
+    # Escalonado para que los workers no coincidan
+    next_checkpoint = time.time() + random.uniform(0, Config.SQLITE_CHECKPOINT_INTERVAL)
+    next_analyze = time.time() + random.uniform(0, Config.SQLITE_ANALYZE_INTERVAL)
+    while True:
+        time.sleep(max(min(next_checkpoint, next_analyze) - time.time(), 1))
+        try:
+            if time.time() >= next_checkpoint:
+                checkpoint(engine)
+                next_checkpoint = time.time() + Config.SQLITE_CHECKPOINT_INTERVAL
+            if time.time() >= next_analyze:
+                analyze(engine)
+                next_analyze = time.time() + Config.SQLITE_ANALYZE_INTERVAL
+        except Exception:
+            app.logger.exception("Error en el mantenimiento de SQLite")
+            next_checkpoint = max(next_checkpoint, time.time() + 60)
+            next_analyze = max(next_analyze, time.time() + 60)
@@ -0,0 +1,190 @@
+"""
+stats.py - Contadores del dashboard mantenidos de forma incremental
+
+  • StatCounter guarda total, revoked y plan:<nombre>.
+  • PresenceBucket cuenta cada licencia en el bucket de tiempo de su last_seen;
+    una licencia cambia de bucket como mucho una vez cada PRESENCE_BUCKET_SECONDS.
+
+Ambos se ajustan en un listener de flush que mira las licencias creadas,
+borradas o modificadas, así que cualquier ruta que use el ORM los mantiene
+sin código extra. Los buckets cambian al validar, así que no se escriben en
+la transacción de la petición: se suman en memoria y los vuelca
+write_behind.py cada pocos segundos. Las tarjetas del panel se sirven con
+dos consultas acotadas, sin importar cuántas licencias existan. Las operaciones que
+escriben sin el ORM deben llamar a invalidate() o rebuild().
+"""
+
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event as sa_event, inspect, func, delete
+from sqlalchemy.orm import Session
+from config import Config
+from models import db, License, StatCounter, PresenceBucket
+from database import dialect_insert
+import replica
+import write_behind
+
+# Ventanas de presencia que muestra el dashboard (segundos)
+WINDOWS = {"active_1h": 3600, "active_24h": 86400, "active_7d": 604800}
+RETENTION = max(WINDOWS.values())
+
+# Marca de que los contadores se han reconstruido al menos una vez
+BUILT = "_built"
+
+_EPOCH = datetime(1970, 1, 1)
+_last_prune = 0.0
+
+
+def bucket_of(dt):
+    """Índice del bucket de presencia para un datetime UTC naive"""
+    return int((dt - _EPOCH).total_seconds()) // Config.PRESENCE_BUCKET_SECONDS
+
+
+def _add(conn, table, key_col, key, value_col, delta):
+    stmt = dialect_insert(table).values({key_col: key, value_col: delta})
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[key_col],
+        set_={value_col: table.c[value_col] + stmt.excluded[value_col]},
+    )
+    conn.execute(stmt)
+
+
+# ── Mantenimiento incremental ───────────────────────────────────
+
+@sa_event.listens_for(Session, "after_flush")
+def _track_license_changes(session, flush_context):
+    counters, presence = {}, {}
+
+    def count(name, delta):
+        counters[name] = counters.get(name, 0) + delta
+
+    def seen(dt, delta):
+        if dt is not None:
+            presence[bucket_of(dt)] = presence.get(bucket_of(dt), 0) + delta
+
+    def apply(lic, sign):
+        count("total", sign)
+        count(f"plan:{lic.plan}", sign)
+        if lic.revoked:
+            count("revoked", sign)
+        seen(lic.last_seen, sign)
+
+    for obj in session.new:
+        if isinstance(obj, License):
+            apply(obj, 1)
+    for obj in session.deleted:
+        if isinstance(obj, License):
+            apply(obj, -1)
+
+    for obj in session.dirty:
+        if not isinstance(obj, License):
+            continue
+        state = inspect(obj)
+        for attr in ("plan", "revoked", "last_seen"):
+            hist = state.attrs[attr].history
+            if not hist.added:
+                continue
+            if not hist.deleted and not hist.unchanged:
+                # Valor anterior desconocido: reconstruir en la próxima lectura
+                session.connection().execute(
+                    delete(StatCounter.__table__).where(StatCounter.name == BUILT))
+                continue
+            old = (hist.deleted or hist.unchanged)[0]
+            new = hist.added[0]
+            if attr == "plan":
+                count(f"plan:{old}", -1)
+                count(f"plan:{new}", 1)
+            elif attr == "revoked" and bool(old) != bool(new):
+                count("revoked", 1 if new else -1)
+            elif attr == "last_seen":
+                if old is None or new is None or bucket_of(old) != bucket_of(new):
+                    seen(old, -1)
+                    seen(new, 1)
+
+    for bucket, delta in presence.items():
+        if delta:
+            _presence.add(bucket, delta, session)
+
+    if any(counters.values()):
+        conn = session.connection()
+        for name, delta in counters.items():
+            if delta:
+                _add(conn, StatCounter.__table__, "name", name, "value", delta)
+
+
+def _flush_presence(items):
+    """Suma los deltas de presencia anotados: {bucket: delta}"""
+    conn = db.session.connection()
+    oldest = bucket_of(datetime.utcnow()) - RETENTION // Config.PRESENCE_BUCKET_SECONDS
+    for bucket, delta in items.items():
+        if delta and bucket > oldest:
+            _add(conn, PresenceBucket.__table__, "bucket", bucket, "count", delta)
+
+    global _last_prune
+    if time.time() - _last_prune > 3600:
+        _last_prune = time.time()
+        conn.execute(delete(PresenceBucket.__table__).where(PresenceBucket.bucket <= oldest))
+
+
+_presence = write_behind.register("presence", lambda current, new: current + new, _flush_presence)
+
+
+# ── Lectura y reconstrucción ────────────────────────────────────
+
+def rebuild():
+    """Recalcula todos los contadores desde la tabla de licencias"""
+    now = datetime.utcnow()
+    values = {
+        BUILT:     1,
+        "total":   License.query.count(),
+        "revoked": License.query.filter(License.revoked == True).count(),
+    }
+    for plan, n in db.session.query(License.plan, func.count()).group_by(License.plan):
+        values[f"plan:{plan}"] = n
+
+    buckets = {}
+    recent = db.session.query(License.last_seen)\
+                       .filter(License.last_seen >= now - timedelta(seconds=RETENTION))
+    for (last_seen,) in recent:
+        buckets[bucket_of(last_seen)] = buckets.get(bucket_of(last_seen), 0) + 1
+
+    StatCounter.query.delete()
+    PresenceBucket.query.delete()
+    db.session.add_all(StatCounter(name=k, value=v) for k, v in values.items())
+    db.session.add_all(PresenceBucket(bucket=b, count=n) for b, n in buckets.items())
+    db.session.commit()
+    # Lo pendiente ya está en last_seen, que es de donde se acaba de contar
+    _presence.clear()
+
+
+def invalidate():
+    """Marca los contadores para reconstruirse en la próxima lectura"""
+    StatCounter.query.filter_by(name=BUILT).delete()
+
+
+def dashboard_counts(now=None):
+    """Totales del dashboard en O(1) respecto al número de licencias"""
+    now = now or datetime.utcnow()
+    counters = dict(db.session.query(StatCounter.name, StatCounter.value).all())
+    if BUILT not in counters:
+        replica.use_primary()
+        rebuild()
+        counters = dict(db.session.query(StatCounter.name, StatCounter.value).all())
+
+    size = Config.PRESENCE_BUCKET_SECONDS
+    current = bucket_of(now)
+    rows = db.session.query(PresenceBucket.bucket, PresenceBucket.count)\
+                     .filter(PresenceBucket.bucket > current - RETENTION // size).all()
+    windows = {
+        name: sum(n for bucket, n in rows if bucket > current - seconds // size)
+        for name, seconds in WINDOWS.items()
+    }
+
+    total = counters.get("total", 0)
+    return {
+        "total":    total,
+        "revoked":  counters.get("revoked", 0),
+        "inactive": total - windows["active_7d"],
+        "by_plan":  {name[5:]: n for name, n in counters.items() if name.startswith("plan:") and n},
+        **windows,
+    }
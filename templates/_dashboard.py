@@ -7,19 +7,24 @@ DASHBOARD = """
 <div class="stats-grid">
   <div class="stat-card">
     <div class="label">Total Licencias</div>
-    <div class="value">{{ stats.total }}</div>
+    <div class="value" id="stat-total">{{ stats.total }}</div>
+    <div class="label" id="stat-by-plan" style="margin-top:6px">{% for plan, n in stats.by_plan.items() %}{{ plan }}: {{ n }} &nbsp;{% endfor %}</div>
+  </div>
+  <div class="stat-card">
+    <div class="label">Online (1h)</div>
+    <div class="value" style="color:#00e5a0" id="stat-active_1h">{{ stats.active_1h }}</div>
   </div>
   <div class="stat-card">
     <div class="label">Activas (24h)</div>
-    <div class="value" style="color:#00e5a0">{{ stats.active_24h }}</div>
+    <div class="value" style="color:#00e5a0" id="stat-active_24h">{{ stats.active_24h }}</div>
   </div>
   <div class="stat-card">
     <div class="label">Inactivas (7d+)</div>
-    <div class="value" style="color:#f0a500">{{ stats.inactive }}</div>
+    <div class="value" style="color:#f0a500" id="stat-inactive">{{ stats.inactive }}</div>
   </div>
   <div class="stat-card">
     <div class="label">Revocadas</div>
-    <div class="value" style="color:#e05252">{{ stats.revoked }}</div>
+    <div class="value" style="color:#e05252" id="stat-revoked">{{ stats.revoked }}</div>
   </div>
 </div>
 
@@ -2,7 +2,7 @@
 templates/_modal_and_scripts.py - Modal de detalles y toda la lógica JavaScript
 """
 
-MODAL_AND_SCRIPTS = """
+MODAL = """
 <!-- Modal for Details -->
 <div id="detailsModal" class="modal">
   <div class="modal-content">
@@ -13,9 +13,13 @@ MODAL_AND_SCRIPTS = """
 
 <!-- Toast notification -->
 <div id="toast" class="toast"></div>
+"""
 
-<script>
-  const SECRET = '{{ secret }}';
+# Sin Jinja: se sirve como fichero estático (ver assets.py). Los datos de la
+# petición llegan en el JSON #panel-data del HTML
+SCRIPTS = """
+  const PANEL = JSON.parse(document.getElementById('panel-data').textContent);
+  const SECRET = PANEL.secret;
 
   // ── Utilidades ──────────────────────────────────────────────
 
@@ -35,6 +39,87 @@ MODAL_AND_SCRIPTS = """
     event.target.classList.add('active');
     document.getElementById('tab-' + tab).classList.add('active');
     if (tab === 'suspicious') loadSuspicious();
+    if (tab === 'expiring') loadExpiring();
+    if (tab === 'search') document.getElementById('search-input').focus();
+  }
+
+  // Claves de la pestaña "Por vencer" para "Extender todas"
+  let expiringKeys = [];
+
+  function loadExpiring() {
+    fetch(`/api/admin/expiring?days=7&secret=${SECRET}`)
+      .then(r => r.json())
+      .then(data => {
+        const content = document.getElementById('expiring-content');
+        if (data.licenses.length === 0) {
+          content.innerHTML = '<p style="color:#00e5a0">✓ Ninguna licencia vence en los próximos 7 días</p>';
+          return;
+        }
+        expiringKeys = data.licenses.map(l => l.key);
+        let html = '<button class="btn btn-save" onclick="bulkExtend(expiringKeys)">⏩ Extender todas 30 días</button>';
+        if (data.total > data.licenses.length) {
+          html += `<p class="hw">Mostrando ${data.licenses.length} de ${data.total}</p>`;
+        }
+        html += '<table><tr><th>Clave</th><th>Usuario</th><th>Plan</th><th>Vence</th><th>Última actividad</th></tr>';
+        data.licenses.forEach(l => {
+          html += `<tr>
+            <td class="key">${esc(l.key)}</td>
+            <td>${esc(l.user || '—')}</td>
+            <td>${esc(l.plan)}</td>
+            <td class="warning">${esc(l.expires_at.substring(0,16))}</td>
+            <td>${l.last_seen ? esc(l.last_seen.substring(0,16)) : 'nunca'}</td>
+          </tr>`;
+        });
+        html += '</table>';
+        content.innerHTML = html;
+      });
+  }
+
+  // ── Búsqueda ────────────────────────────────────────────────
+
+  let searchTimer = null, searchSeq = 0;
+
+  function scheduleSearch() {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(runSearch, 250);
+  }
+
+  function runSearch() {
+    const value = document.getElementById('search-input').value.trim();
+    const field = document.getElementById('search-field').value;
+    const table = document.getElementById('search-table');
+    const status = document.getElementById('search-status');
+    while (table.rows.length > 1) table.deleteRow(1);
+    if (!value) { status.textContent = ''; return; }
+
+    const seq = ++searchSeq;
+    const params = new URLSearchParams({ secret: SECRET, [field]: value });
+    fetch(`/api/admin/search?${params}`)
+      .then(r => r.json())
+      .then(data => {
+        if (seq !== searchSeq) return;
+        if (data.error) { status.textContent = 'Error: ' + data.error; return; }
+        table.rows[0].insertAdjacentHTML('afterend', data.results.map(renderRow).join(''));
+        status.textContent = data.results.length === 0 ? 'Sin resultados'
+          : `${data.results.length} resultado${data.results.length !== 1 ? 's' : ''}` +
+            (data.truncated ? ' (se muestran los más recientes)' : '');
+      })
+      .catch(() => { if (seq === searchSeq) status.textContent = 'Error de conexión'; });
+  }
+
+  function bulkExtend(keys) {
+    if (!confirm(`¿Extender ${keys.length} licencias 30 días?`)) return;
+    fetch('/api/admin/bulk', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', 'X-Admin-Secret': SECRET },
+      body: JSON.stringify({ action: 'extend', keys, days: 30 })
+    })
+    .then(r => r.json())
+    .then(data => {
+      if (data.error) showToast('Error: ' + data.error, 'error');
+      else { showToast(`✓ ${data.affected} licencias extendidas`, 'success'); loadExpiring(); }
+    })
+    .catch(() => showToast('Error de conexión', 'error'));
   }
 
   function loadSuspicious() {
@@ -46,14 +131,16 @@ MODAL_AND_SCRIPTS = """
           content.innerHTML = '<p style="color:#00e5a0">✓ No se detectó actividad sospechosa</p>';
           return;
         }
-        let html = '<table><tr><th>Clave</th><th>Usuario</th><th>Motivo</th><th>Severidad</th></tr>';
+        let html = '<table><tr><th>Clave</th><th>Usuario</th><th>Motivo</th><th>Severidad</th><th>Primera vez</th><th>Última vez</th></tr>';
         data.suspicious_licenses.forEach(s => {
           const color = s.severity === 'HIGH' ? '#e05252' : s.severity === 'MEDIUM' ? '#f0a500' : '#60657a';
           html += `<tr>
-            <td class="key">${s.key}</td>
-            <td>${s.user || '—'}</td>
-            <td>${s.reason}</td>
-            <td style="color:${color};font-weight:bold">${s.severity}</td>
+            <td class="key">${esc(s.key)}</td>
+            <td>${esc(s.user || '—')}</td>
+            <td>${esc(s.reason)}</td>
+            <td style="color:${color};font-weight:bold">${esc(s.severity)}${s.revoked ? ' · revocada' : ''}</td>
+            <td>${s.first_seen.slice(0, 16).replace('T', ' ')}</td>
+            <td>${s.last_seen.slice(0, 16).replace('T', ' ')}</td>
           </tr>`;
         });
         html += '</table>';
@@ -63,6 +150,11 @@ MODAL_AND_SCRIPTS = """
 
   // ── Modal de detalles ───────────────────────────────────────
 
+  function showDetailsFromRow(row) {
+    const d = row.dataset;
+    showDetails(d.key, SECRET, d.revoked === 'true', d.user, d.plan, d.hw === 'true');
+  }
+
   function showDetails(key, secret, isRevoked, currentUser, currentPlan, hasDevice) {
     document.getElementById('detailsModal').style.display = 'block';
     document.getElementById('detailsContent').innerHTML = 'Cargando detalles...';
@@ -79,7 +171,8 @@ MODAL_AND_SCRIPTS = """
             buildInfo(lic) +
             buildStats(data.statistics) +
             buildDevices(data.devices) +
-            buildActivity(data.recent_activity);
+            buildActivity();
+        loadActivity(key, true);
         })
       .catch(() => {
         document.getElementById('detailsContent').innerHTML =
@@ -199,26 +292,90 @@ MODAL_AND_SCRIPTS = """
       </table>`;
   }
 
-  function buildActivity(activity) {
-    const rows = activity.slice(0, 50).map(a => `
-      <tr>
-        <td>${a.timestamp.substring(0,16)}</td>
-        <td class="${a.status === 'SUCCESS' ? 'success' : 'failed'}">${a.status}</td>
-        <td class="hw">${a.hw_id}</td>
-        <td class="hw">${a.ip}</td>
-        <td>${a.error_detail || a.device_info}</td>
-      </tr>`).join('');
+  // Historial paginado por cursor: primera página al abrir, más al hacer scroll
+  let activityKey = null, activityCursor = null, activityLoading = false, activitySeq = 0;
 
+  function buildActivity() {
     return `
-      <h3>📝 Actividad Reciente (últimos 50)</h3>
-      <div class="activity-log" style="max-height:300px;overflow-y:auto">
+      <h3>📝 Actividad</h3>
+      <div style="margin-bottom:6px;font-size:11px">
+        <select id="activity-status" onchange="loadActivity(activityKey, true)">
+          <option value="">Todos los estados</option>
+          <option value="SUCCESS">SUCCESS</option>
+          <option value="REVOKED,EXPIRED,WRONG_DEVICE">Fallidos</option>
+          <option value="WRONG_DEVICE">WRONG_DEVICE</option>
+          <option value="EXPIRED">EXPIRED</option>
+          <option value="REVOKED">REVOKED</option>
+        </select>
+        Desde <input type="date" id="activity-from" onchange="loadActivity(activityKey, true)">
+        Hasta <input type="date" id="activity-to" onchange="loadActivity(activityKey, true)">
+      </div>
+      <div class="activity-log" id="activity-scroll" style="max-height:300px;overflow-y:auto"
+           onscroll="onActivityScroll(this)">
         <table style="font-size:10px">
-          <tr><th>Fecha</th><th>Estado</th><th>Dispositivo</th><th>IP</th><th>Info</th></tr>
-          ${rows}
+          <thead><tr><th>Fecha</th><th>Estado</th><th>Dispositivo</th><th>IP</th><th>Info</th></tr></thead>
+          <tbody id="activity-rows"></tbody>
         </table>
+        <div id="activity-more" style="font-size:10px;padding:4px">Cargando...</div>
       </div>`;
   }
 
+  function loadActivity(key, reset) {
+    if (reset) {
+      activityKey = key;
+      activityCursor = null;
+      document.getElementById('activity-rows').innerHTML = '';
+    } else if (!activityCursor || activityLoading) {
+      return;
+    }
+    activityLoading = true;
+    const seq = ++activitySeq;
+
+    const params = new URLSearchParams({ secret: SECRET, limit: 50 });
+    const status = document.getElementById('activity-status').value;
+    const from = document.getElementById('activity-from').value;
+    const to = document.getElementById('activity-to').value;
+    if (status) params.set('status', status);
+    if (from) params.set('from', from);
+    if (to) params.set('to', to + 'T23:59:59.999999');
+    if (activityCursor) params.set('cursor', activityCursor);
+
+    fetch(`/api/admin/license/${key}/activity?${params}`)
+      .then(r => r.json())
+      .then(data => {
+        if (seq !== activitySeq) return;   // filtros o licencia cambiados mientras cargaba
+        activityLoading = false;
+        if (data.error) {
+          document.getElementById('activity-more').textContent = 'Error: ' + data.error;
+          return;
+        }
+        document.getElementById('activity-rows').insertAdjacentHTML('beforeend',
+          data.activity.map(a => `
+          <tr>
+            <td>${a.timestamp.substring(0,16)}</td>
+            <td class="${a.status === 'SUCCESS' ? 'success' : 'failed'}">${esc(a.status)}</td>
+            <td class="hw">${esc(a.hw_id)}</td>
+            <td class="hw">${esc(a.ip)}</td>
+            <td>${esc(a.error_detail || a.device_info)}</td>
+          </tr>`).join(''));
+        activityCursor = data.next_cursor;
+        const empty = !activityCursor && !document.getElementById('activity-rows').children.length;
+        document.getElementById('activity-more').textContent =
+          activityCursor ? 'Desliza para ver más' : (empty ? 'Sin actividad' : 'Fin del historial');
+        onActivityScroll(document.getElementById('activity-scroll'));
+      })
+      .catch(() => {
+        if (seq !== activitySeq) return;
+        activityLoading = false;
+        document.getElementById('activity-more').textContent = 'Error de conexión';
+      });
+  }
+
+  function onActivityScroll(el) {
+    // También rellena si la primera página no llega a llenar la caja
+    if (el.scrollTop + el.clientHeight >= el.scrollHeight - 40) loadActivity(activityKey, false);
+  }
+
   // ── Acciones CRUD ───────────────────────────────────────────
 
   function saveEdit(key) {
@@ -244,18 +401,21 @@ MODAL_AND_SCRIPTS = """
 
   function deleteLicense(key) {
     if (!confirm(`¿Eliminar permanentemente la licencia ${key}? Esta acción no se puede deshacer.`)) return;
+    // Opcional: con mucho historial, borrarlo por bloques sin bloquear la BD
+    const background = confirm('¿Borrar su historial en segundo plano? (recomendado con mucho historial)');
 
     fetch('/api/admin/delete_license', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json', 'X-Admin-Secret': SECRET },
-      body: JSON.stringify({ key })
+      body: JSON.stringify({ key, background })
     })
     .then(r => r.json())
     .then(data => {
       if (data.error) {
         showToast('Error: ' + data.error, 'error');
       } else {
-        showToast(`🗑️ Licencia ${key} eliminada`, 'success');
+        showToast(background ? `🗑️ Licencia ${key} eliminada; su historial se borra en segundo plano (aparece como BORRANDO-… hasta terminar)`
+                             : `🗑️ Licencia ${key} eliminada`, 'success');
         closeDetails();
         setTimeout(() => location.reload(), 1200);
       }
@@ -263,6 +423,125 @@ MODAL_AND_SCRIPTS = """
     .catch(() => showToast('Error de conexión', 'error'));
   }
 
+  // ── Sincronización incremental ──────────────────────────────
+  // El panel pide solo las licencias cambiadas desde el último cursor y
+  // parchea sus filas; los puntos de estado se recalculan en el cliente.
+
+  let syncCursor = PANEL.cursor;
+  let clockOffset = Date.parse(PANEL.now + 'Z') - Date.now();
+
+  function esc(value) {
+    return String(value ?? '').replace(/[&<>"']/g, c =>
+      ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c]));
+  }
+
+  function hoursAgo(lastSeen) {
+    if (!lastSeen || lastSeen === 'nunca') return Infinity;
+    return (Date.now() + clockOffset - Date.parse(lastSeen + 'Z')) / 3600000;
+  }
+
+  function statusDot(lastSeen) {
+    const h = hoursAgo(lastSeen);
+    const cls = h < 1 ? 'status-online' : h < 24 ? 'status-warning' : 'status-offline';
+    return `<span class="status-indicator ${cls}"></span>`;
+  }
+
+  function renderRow(l) {
+    const hw = l.hw_id || 'sin activar';
+    const seen = l.last_seen !== 'nunca' ? l.last_seen : '';
+    return `
+    <tr class="clickable-row" data-key="${esc(l.key)}"
+        data-revoked="${l.revoked}" data-user="${esc(l.user)}" data-plan="${esc(l.plan)}"
+        data-hw="${!!l.hw_id}" data-last-seen="${esc(seen)}"
+        onclick="showDetailsFromRow(this)" title="Click para ver detalles de ${esc(l.key)}">
+      <td class="status-cell">${statusDot(seen)}</td>
+      <td class="key">${esc(l.key)}</td>
+      <td>${esc(l.plan)}</td>
+      <td>${esc(l.user) || '—'}</td>
+      <td>${l.expires_at !== 'lifetime' ? l.expires_at.substring(0,10) : '♾ lifetime'}</td>
+      <td class="hw">
+        ${esc(hw.substring(0,16))}${l.hw_id && l.hw_id.length > 16 ? '...' : ''}
+        ${l.device_info ? `<br><small style="color:#3a3f50">${esc(l.device_info.substring(0,30))}</small>` : ''}
+      </td>
+      <td style="font-size:11px">
+        ${l.first_activation !== 'nunca' ? `<b>1ª:</b> ${l.first_activation.substring(0,10)}<br>` : ''}
+        <b>Ult:</b> ${seen ? seen.substring(0,16) : 'nunca'}
+      </td>
+      <td style="text-align:center">${l.activations}</td>
+    </tr>`;
+  }
+
+  function renderActiveRow(l) {
+    return `
+    <tr data-key="${esc(l.key)}">
+      <td class="key">${esc(l.key)}</td>
+      <td>${esc(l.user) || '—'}</td>
+      <td>${esc(l.plan)}</td>
+      <td>${l.last_seen.substring(0,16)}</td>
+      <td class="hw">${esc(l.ip_address) || '—'}</td>
+    </tr>`;
+  }
+
+  function upsertRow(tableId, key, html) {
+    const table = document.getElementById(tableId);
+    const row = table.querySelector(`tr[data-key="${key}"]`);
+    if (row) row.outerHTML = html;
+    else table.rows[0].insertAdjacentHTML('afterend', html);
+  }
+
+  function removeRow(tableId, key) {
+    const row = document.getElementById(tableId).querySelector(`tr[data-key="${key}"]`);
+    if (row) row.remove();
+  }
+
+  function refreshDots() {
+    document.querySelectorAll('#licenses-table tr[data-key]').forEach(row => {
+      row.querySelector('.status-cell').innerHTML = statusDot(row.dataset.lastSeen);
+    });
+  }
+
+  function updateStats(stats) {
+    ['total', 'active_1h', 'active_24h', 'inactive', 'revoked'].forEach(name => {
+      document.getElementById('stat-' + name).textContent = stats[name];
+    });
+    document.getElementById('stat-by-plan').innerHTML = Object.entries(stats.by_plan)
+      .map(([plan, n]) => `${esc(plan)}: ${n} &nbsp;`).join('');
+    document.getElementById('licenses-count').textContent = stats.total;
+  }
+
+  // Ronda de sincronización: páginas seguidas (after=next) hasta ponerse al
+  // día; solo entonces avanza el cursor. Una ronda no empieza si hay otra
+  let syncing = false;
+
+  function syncChanges(after = '') {
+    if (syncing && !after) return;
+    syncing = true;
+    fetch(`/api/admin/changes?since=${encodeURIComponent(syncCursor)}&after=${encodeURIComponent(after)}&secret=${SECRET}`)
+      .then(r => r.json())
+      .then(data => {
+        if (data.full_reload) { location.reload(); return; }
+        clockOffset = Date.parse(data.now + 'Z') - Date.now();
+        data.changes.forEach(l => {
+          upsertRow('licenses-table', l.key, renderRow(l));
+          if (hoursAgo(l.last_seen) < 24) upsertRow('active-table', l.key, renderActiveRow(l));
+          else removeRow('active-table', l.key);
+        });
+        data.deleted.forEach(key => {
+          removeRow('licenses-table', key);
+          removeRow('active-table', key);
+        });
+        updateStats(data.stats);
+        if (data.next) { syncChanges(data.next); return; }
+        syncCursor = data.cursor;
+        syncing = false;
+        refreshDots();
+      })
+      .catch(() => { syncing = false; });
+  }
+
+  setInterval(() => syncChanges(), 15000);
+  setInterval(refreshDots, 60000);
+
   // ── Modal ───────────────────────────────────────────────────
 
   function closeDetails() {
@@ -273,5 +552,4 @@ MODAL_AND_SCRIPTS = """
     const modal = document.getElementById('detailsModal');
     if (event.target == modal) modal.style.display = 'none';
   }
-</script>
-"""
\ No newline at end of file
+"""
@@ -6,12 +6,18 @@ Ensambla las secciones desde los módulos separados:
   _dashboard.py         → Stats cards + formulario crear
   _tabs.py              → Tabs + tablas de licencias
   _modal_and_scripts.py → Modal de detalles + JavaScript
+
+El CSS y el JavaScript se sirven aparte como ficheros estáticos cacheables
+(ver assets.py); el HTML solo lleva los datos de la petición.
 """
 
-from templates._styles import STYLES
+import assets
 from templates._dashboard import DASHBOARD
 from templates._tabs import TABS
-from templates._modal_and_scripts import MODAL_AND_SCRIPTS
+from templates._modal_and_scripts import MODAL
+
+# Datos de la petición para el JavaScript (secreto, cursor de sync, hora del servidor)
+PANEL_DATA = '<script id="panel-data" type="application/json">{{ panel_data|tojson }}</script>'
 
 PANEL_HTML = f"""
 <!DOCTYPE html>
@@ -19,7 +25,7 @@ PANEL_HTML = f"""
 <head>
   <title>Visual Bot — Licencias Advanced</title>
   <meta charset="utf-8">
-  {STYLES}
+  <link rel="stylesheet" href="{assets.url('panel.css')}">
 </head>
 <body>
   <div class="container">
@@ -28,7 +34,9 @@ PANEL_HTML = f"""
     {TABS}
   </div>
 
-  {MODAL_AND_SCRIPTS}
+  {MODAL}
+  {PANEL_DATA}
+  <script src="{assets.url('panel.js')}"></script>
 </body>
 </html>
-"""
\ No newline at end of file
+"""
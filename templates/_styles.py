@@ -3,7 +3,6 @@ templates/_styles.py - Estilos CSS del panel
 """
 
 STYLES = """
-<style>
   body{font-family:monospace;background:#0e0f11;color:#d4d8e2;margin:0;padding:0}
   .container{max-width:1400px;margin:0 auto;padding:32px}
   h1,h2{color:#00e5a0}
@@ -84,5 +83,4 @@ STYLES = """
   .toast{position:fixed;bottom:24px;right:24px;background:#16181c;border:1px solid #2a2d35;padding:12px 20px;border-radius:4px;font-size:13px;z-index:2000;display:none}
   .toast.success{border-color:#00e5a0;color:#00e5a0}
   .toast.error{border-color:#e05252;color:#e05252}
-</style>
 """
\ No newline at end of file
@@ -7,13 +7,15 @@ TABS = """
 <div class="tabs">
   <button class="tab active" onclick="showTab('all')">Todas las licencias</button>
   <button class="tab" onclick="showTab('active')">Activas</button>
+  <button class="tab" onclick="showTab('expiring')">Por vencer (7d)</button>
   <button class="tab" onclick="showTab('suspicious')">Actividad Sospechosa</button>
+  <button class="tab" onclick="showTab('search')">🔍 Buscar</button>
 </div>
 
 <!-- Tab: All Licenses -->
 <div class="tab-content active" id="tab-all">
-  <h2>Licencias ({{ licenses|length }}) <small style="color:#60657a;font-size:12px;font-weight:normal">— Click en una fila para ver detalles</small></h2>
-  <table>
+  <h2>Licencias (<span id="licenses-count">{{ licenses|length }}</span>) <small style="color:#60657a;font-size:12px;font-weight:normal">— Click en una fila para ver detalles</small></h2>
+  <table id="licenses-table">
     <tr>
       <th>Estado</th>
       <th>Clave</th>
@@ -25,10 +27,13 @@ TABS = """
       <th>Usos</th>
     </tr>
     {% for l in licenses %}
-    <tr class="clickable-row"
-        onclick="showDetails('{{ l.key }}', '{{ secret }}', {{ 'true' if l.revoked else 'false' }}, '{{ l.user or '' }}', '{{ l.plan }}', {{ 'true' if l.hw_id else 'false' }})"
+    <tr class="clickable-row" data-key="{{ l.key }}"
+        data-revoked="{{ 'true' if l.revoked else 'false' }}" data-user="{{ l.user or '' }}"
+        data-plan="{{ l.plan }}" data-hw="{{ 'true' if l.hw_id else 'false' }}"
+        data-last-seen="{{ l.last_seen if l.last_seen != 'nunca' else '' }}"
+        onclick="showDetailsFromRow(this)"
         title="Click para ver detalles de {{ l.key }}">
-      <td>
+      <td class="status-cell">
         {% if l.last_seen and l.last_seen != "nunca" %}
           {% set hours_ago = ((now - l.last_seen_dt).total_seconds() / 3600) | int %}
           {% if hours_ago < 1 %}
@@ -65,7 +70,7 @@ TABS = """
 <!-- Tab: Active -->
 <div class="tab-content" id="tab-active">
   <h2>Licencias Activas (últimas 24h)</h2>
-  <table>
+  <table id="active-table">
     <tr>
       <th>Clave</th>
       <th>Usuario</th>
@@ -74,7 +79,7 @@ TABS = """
       <th>IP</th>
     </tr>
     {% for l in licenses if l.last_seen_dt and (now - l.last_seen_dt).total_seconds() < 86400 %}
-    <tr>
+    <tr data-key="{{ l.key }}">
       <td class="key">{{ l.key }}</td>
       <td>{{ l.user or "—" }}</td>
       <td>{{ l.plan }}</td>
@@ -85,16 +90,50 @@ TABS = """
   </table>
 </div>
 
+<!-- Tab: Expiring -->
+<div class="tab-content" id="tab-expiring">
+  <h2>Licencias que vencen en los próximos 7 días</h2>
+  <div id="expiring-content">Cargando...</div>
+</div>
+
 <!-- Tab: Suspicious -->
 <div class="tab-content" id="tab-suspicious">
   <h2>Actividad Sospechosa</h2>
-  <p style="color:#60657a">Licencias con múltiples dispositivos o intentos fallidos recientes</p>
+  <p style="color:#60657a">Licencias con múltiples dispositivos, IPs o intentos fallidos en la ventana reciente (detectadas al validar)</p>
   <div id="suspicious-content">Cargando...</div>
 </div>
 
+<!-- Tab: Search -->
+<div class="tab-content" id="tab-search">
+  <h2>Buscar licencias</h2>
+  <p style="color:#60657a">Prefijo de clave, parte del usuario, HW ID o IP exactos</p>
+  <input type="text" id="search-input" placeholder="VB-AB12, cliente, hw_id o IP..."
+         oninput="scheduleSearch()" autocomplete="off" style="width:100%;max-width:420px">
+  <select id="search-field" onchange="scheduleSearch()">
+    <option value="q">Todos los campos</option>
+    <option value="key">Clave</option>
+    <option value="user">Usuario</option>
+    <option value="hw_id">HW ID</option>
+    <option value="ip">IP</option>
+  </select>
+  <p id="search-status" style="color:#60657a;font-size:11px"></p>
+  <table id="search-table">
+    <tr>
+      <th>Estado</th>
+      <th>Clave</th>
+      <th>Plan</th>
+      <th>Usuario</th>
+      <th>Vence</th>
+      <th>Dispositivo Actual</th>
+      <th>Primera/Última Actividad</th>
+      <th>Usos</th>
+    </tr>
+  </table>
+</div>
+
 <p style="color:#3a3f50;margin-top:24px;font-size:11px">
   🟢 Online (< 1h) &nbsp; 🟡 Reciente (< 24h) &nbsp; ⚫ Offline (> 24h)
   <br>
-  Los clientes re-validan cada 60 segundos. Una revocación tarda máximo 60s en aplicarse.
+  Los bots conectados a /api/events reciben revocaciones y resets al instante; el resto re-valida cada 60 segundos.
 </p>
 """
\ No newline at end of file
@@ -0,0 +1,33 @@
+"""
+tests/conftest.py - Entorno de pruebas: SQLite temporal y app de test
+
+app.py crea la aplicación al importarse, así que las variables de entorno se
+fijan aquí, antes de que ningún test la importe.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TMP = tempfile.mkdtemp()
+
+os.environ["DATABASE_URL"] = f"sqlite:///{TMP}/test.db"
+os.environ["ADMIN_SECRET"] = "test"
+os.environ["SNAPSHOT_PATH"] = f"{TMP}/snapshot.bin"
+sys.path.insert(0, ROOT)
+
+ADMIN = {"X-Admin-Secret": "test"}
+
+
+@pytest.fixture(scope="session")
+def app():
+    from app import app
+    return app
+
+
+@pytest.fixture(scope="session")
+def client(app):
+    return app.test_client()
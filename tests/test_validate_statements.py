@@ -0,0 +1,68 @@
+"""
+tests/test_validate_statements.py - Sentencias SQL por resultado de /api/validate
+
+Cuenta las sentencias que ejecuta cada resultado en el hilo de la petición
+(más el commit) con las cachés del worker calientes, y comprueba que no
+superan el máximo fijado. Presupuesto y preparación son los de
+benchmarks/validate_statements.py; aquí solo se comprueban con pytest.
+"""
+
+import pytest
+
+from benchmarks.validate_statements import BUDGET, capture, prepare
+from conftest import ADMIN
+
+
+@pytest.fixture(scope="module")
+def statements(app):
+    from models import db
+
+    with app.app_context():
+        captured, remove = capture(db.engine)
+    yield captured
+    remove()
+
+
+@pytest.fixture(scope="module")
+def cases(app, client):
+    from routes import validation
+    import write_behind
+
+    original = validation.snapshot.lookup
+    cases = prepare(app, client, ADMIN)
+    with app.app_context():
+        write_behind.flush()
+    yield cases
+    validation.snapshot.lookup = original
+
+
+@pytest.mark.parametrize("outcome", list(BUDGET))
+def test_statement_budget(outcome, cases, statements):
+    status, error, call = cases[outcome]
+    statements.clear()
+    response = call()
+    assert response.status_code == status
+    if error:
+        assert response.json["error"] == error
+    else:
+        assert response.json["valid"] is True
+    assert len(statements) <= BUDGET[outcome], "\n".join(statements)
+
+
+def test_write_behind_flush(app, cases, statements):
+    """Lo diferido llega a la BD en el volcado: contadores, únicos y reglas de abuso"""
+    from models import db, License, LicenseIp
+    import license_stats
+    import write_behind
+
+    with app.app_context():
+        write_behind.flush()
+        lic = License.query.filter(License.ip_address == "10.9.9.9").one()
+        statistics = license_stats.license_statistics(lic)
+        assert statistics["total_attempts"] >= 4
+        assert statistics["by_status"]["WRONG_DEVICE"] >= 1
+        assert statistics["unique_ips"] == 2
+        assert LicenseIp.query.filter_by(license_id=lic.id, ip="10.9.9.9").count() == 1
+        assert license_stats.fleet_uniques()["ips"] >= 3
+        assert write_behind.pending() == {name: 0 for name in write_behind.pending()}
+        db.session.rollback()
@@ -7,8 +7,14 @@ import random
 import json
 from datetime import datetime, timedelta
 from flask import request
-from user_agents import parse
+from sqlalchemy import update
 from models import db, ActivityLog, DeviceHistory
+from database import dialect_insert
+import license_stats
+import abuse
+import dims
+import reverse_index
+import device_info
 
 
 def generate_key(prefix="VB") -> str:
@@ -31,12 +37,8 @@ def make_expiry(plan: str):
 
 
 def get_device_info(user_agent_string: str) -> str:
-    """Extrae información legible del user agent"""
-    try:
-        ua = parse(user_agent_string)
-        return f"{ua.os.family} {ua.os.version_string} - {ua.browser.family}"
-    except:
-        return user_agent_string[:100] if user_agent_string else "Desconocido"
+    """Extrae información legible del user agent (memoizado, ver device_info.py)"""
+    return device_info.describe(user_agent_string)
 
 
 def get_client_ip(request) -> str:
@@ -70,7 +72,10 @@ def get_client_ip(request) -> str:
 def log_activity(license_obj, hw_id, ip, status, error_detail="", app_version=""):
     """Registra cada intento de validación"""
     user_agent = request.headers.get('User-Agent', '')
-    device_info = get_device_info(user_agent)
+    
+    # Ids de dimensión (cacheados por worker); solo se parsea un user agent nuevo
+    # (con UA_ENRICH_ASYNC ni eso: info queda None y lo rellena el enricher)
+    agent_id, info = dims.user_agent(user_agent, device_info.describe_now)
     
     # Asegurar que tengamos solo la IP real del cliente
     if ip and ',' in ip:
@@ -79,40 +84,60 @@ def log_activity(license_obj, hw_id, ip, status, error_detail="", app_version=""
     # Crear log de actividad
     log = ActivityLog(
         license_id=license_obj.id,
-        hw_id=hw_id,
+        device_id=dims.device_id(hw_id),
+        user_agent_id=agent_id,
         ip_address=ip,
-        device_info=device_info,
-        user_agent=user_agent,
         status=status,
         error_detail=error_detail,
         app_version=app_version
     )
     db.session.add(log)
     
-    # Actualizar o crear registro en DeviceHistory
-    if hw_id:
-        device = DeviceHistory.query.filter_by(
-            license_id=license_obj.id, 
-            hw_id=hw_id
-        ).first()
-        
-        if device:
-            device.last_seen = datetime.utcnow()
-            device.total_uses += 1
-            # Agregar IP si no existe
-            ips = json.loads(device.ip_addresses) if device.ip_addresses else []
-            if ip and ip not in ips:
-                ips.append(ip)
-                device.ip_addresses = json.dumps(ips)
-        else:
-            device = DeviceHistory(
-                license_id=license_obj.id,
-                hw_id=hw_id,
-                device_info=device_info,
-                ip_addresses=json.dumps([ip] if ip else []),
-                is_current=(status == "SUCCESS")
-            )
-            db.session.add(device)
+    # Actualizar o crear registro en DeviceHistory (solo licencias existentes)
+    new_device = new_ip = False
+    if hw_id and license_obj.id:
+        new_device, new_ip = _touch_device(license_obj.id, hw_id, ip, info or "", status)
+        if new_device and info is None:
+            device_info.backfill(db.session, user_agent, ("device", license_obj.id, hw_id))
+    
+    # Lo siguiente solo se anota en memoria; lo vuelca write_behind.py
+    # Índice inverso IP → licencias (solo licencias existentes)
+    reverse_index.record_ip(license_obj.id, ip)
+    
+    # Contadores de vida y sketches de únicos
+    license_stats.record(license_obj.id, status, ip, hw_id, new_device)
+    
+    # Detector de abuso: solo revisa lo que este log puede cambiar
+    abuse.observe(license_obj, status, new_device, bool(ip) and new_ip)
+
+
+def _touch_device(license_id, hw_id, ip, device_info, status):
+    """UPSERT de DeviceHistory en una sentencia; devuelve (dispositivo nuevo, IP nueva)"""
+    now = datetime.utcnow()
+    table = DeviceHistory.__table__
+    stmt = dialect_insert(table).values(
+        license_id=license_id, hw_id=hw_id, device_info=device_info,
+        ip_addresses=json.dumps([ip] if ip else []), first_seen=now, last_seen=now,
+        total_uses=1, is_current=(status == "SUCCESS"),
+    )
+    changes = {"last_seen": stmt.excluded.last_seen, "total_uses": table.c.total_uses + 1}
+    if status == "SUCCESS":
+        changes["is_current"] = True
+    row = db.session.execute(
+        stmt.on_conflict_do_update(index_elements=["license_id", "hw_id"], set_=changes)
+            .returning(table.c.id, table.c.total_uses, table.c.ip_addresses)
+    ).first()
+    
+    # total_uses == 1: la fila se acaba de insertar
+    if row.total_uses == 1:
+        return True, bool(ip)
+    ips = json.loads(row.ip_addresses) if row.ip_addresses else []
+    if not ip or ip in ips:
+        return False, False
+    # IP nueva para un dispositivo conocido (poco frecuente): una sentencia más
+    db.session.execute(update(table).where(table.c.id == row.id)
+                                    .values(ip_addresses=json.dumps(ips + [ip])))
+    return False, True
 
 
 def require_admin(req):
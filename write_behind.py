@@ -0,0 +1,153 @@
+"""
+write_behind.py - Escrituras diferidas fuera del camino de /api/validate
+
+Los contadores y sketches de license_stats, el índice IP → licencias de
+reverse_index, los buckets de presencia de stats y las reglas de abuse.py
+no necesitan estar en la BD en el mismo instante en que se valida. Cada
+petición deja su parte en un búfer de la transacción; al confirmarla pasa
+al búfer del worker (si se revierte se descarta, igual que el log) y un
+hilo lo vuelca cada WRITE_BEHIND_INTERVAL segundos en una transacción, con
+sentencias agrupadas. Al parar el worker se vuelca lo que quede.
+
+Si el volcado falla, lo sacado vuelve al búfer y se reintenta en la vuelta
+siguiente. Si el worker muere sin volcar se pierden como mucho esos
+segundos: rebuild-license-stats, rebuild-stats, rebuild-ip-index y
+detect-abuse lo recalculan todo desde la BD.
+"""
+
+import atexit
+import threading
+import time
+from sqlalchemy import select, event as sa_event
+from sqlalchemy.orm import Session
+from config import Config
+from models import db, License
+import metrics
+
+_lock = threading.Lock()
+_buffers = []               # en orden de registro, que es el orden de volcado
+_thread = None
+
+
+class Buffer:
+    """Cambios pendientes de un módulo, agrupados por clave"""
+
+    def __init__(self, name, combine, flush):
+        self.name = name
+        self._combine = combine     # combine(actual, nuevo) -> valor fusionado
+        self._flush = flush         # flush({clave: valor}) escribe en db.session
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def add(self, key, value, session=None):
+        """Anota un cambio en la transacción en curso (pasa al worker al confirmar)"""
+        staged = (session or db.session).info.setdefault("write_behind", {})
+        _merge(staged.setdefault(self, {}), {key: value}, self._combine)
+
+    def absorb(self, items):
+        with self._lock:
+            _merge(self._pending, items, self._combine)
+
+    def drain(self):
+        with self._lock:
+            items, self._pending = self._pending, {}
+        return items
+
+    def clear(self):
+        """Descarta lo pendiente (p. ej. tras una reconstrucción desde la BD)"""
+        self.drain()
+
+    def __len__(self):
+        return len(self._pending)
+
+
+def _merge(target, items, combine):
+    for key, value in items.items():
+        target[key] = combine(target[key], value) if key in target else value
+
+
+def register(name, combine, flush):
+    """Crea el búfer de un módulo; se vuelcan en el orden en que se registran"""
+    buffer = Buffer(name, combine, flush)
+    _buffers.append(buffer)
+    return buffer
+
+
+@sa_event.listens_for(Session, "after_commit")
+def _absorb_staged(session):
+    for buffer, items in session.info.pop("write_behind", {}).items():
+        buffer.absorb(items)
+
+
+@sa_event.listens_for(Session, "after_rollback")
+def _discard_staged(session):
+    session.info.pop("write_behind", None)
+
+
+def existing_licenses(ids):
+    """Los ids que aún existen (una licencia puede borrarse antes del volcado)"""
+    ids = [i for i in ids if i]
+    if not ids:
+        return set()
+    return set(db.session.scalars(select(License.id).where(License.id.in_(ids))))
+
+
+def flush():
+    """Vuelca lo pendiente de todos los búferes en una transacción; devuelve las claves"""
+    drained = [(buffer, buffer.drain()) for buffer in _buffers]
+    if not any(items for _, items in drained):
+        return 0
+    try:
+        for buffer, items in drained:
+            if items:
+                buffer._flush(items)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        for buffer, items in drained:
+            buffer.absorb(items)
+        metrics.incr("write_behind_errors")
+        raise
+    total = sum(len(items) for _, items in drained)
+    metrics.incr("write_behind_flushed", total)
+    return total
+
+
+def pending():
+    """Claves pendientes por búfer (para /metrics)"""
+    return {buffer.name: len(buffer) for buffer in _buffers}
+
+
+def init_app(app):
+    metrics.register("write_behind", pending)
+    atexit.register(_flush_at_exit, app)
+
+
+def start(app):
+    """Arranca el hilo de volcado del worker (idempotente)"""
+    global _thread
+    if _thread is not None:
+        return
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_run, args=(app,), daemon=True, name="write-behind")
+        _thread.start()
+
+
+def _run(app):
+    while True:
+        time.sleep(Config.WRITE_BEHIND_INTERVAL)
+        with app.app_context():
+            try:
+                flush()
+            except Exception:
+                app.logger.exception("Error volcando escrituras diferidas")
+
+
+def _flush_at_exit(app):
+    with app.app_context():
+        try:
+            flush()
+        except Exception:
+            app.logger.exception("Error volcando escrituras diferidas al salir")